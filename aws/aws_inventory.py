@@ -0,0 +1,446 @@
+#!/usr/bin/python3
+"""aws_inventory: Look up AWS VPCs, subnets, gateways and route tables.
+
+This module fetches all the resources of a given type (VPCs, subnets,
+Internet gateways, or route tables) in an AWS region with a single AWS
+CLI call, keeps the ID, CIDR-format address, VPC, and Name tag of each
+one, and caches the result on disk for a few minutes (by default in
+~/.cache/aws_inventory, or the directory in $AWS_INVENTORY_CACHE),
+separately for each AWS profile and access key.  A resource can then
+be looked up by ID, address, or name, in that order, as the
+list_*_aws.sh scripts do, without calling AWS again.  Several
+resources may have the same address or name, in which case all of them
+are found.
+
+Resources can also be looked up in a snapshot of several regions
+written by aws_snapshot.py, given by the --snapshot option or the
+$AWS_INVENTORY_SNAPSHOT environment variable, rather than fetched from
+AWS.  If that variable is set, the list_*_aws.sh scripts run this
+script to do all their listing from the snapshot, while the scripts
+that create or delete resources ignore it.
+
+When run as a script it prints the IDs of the resources found, in the
+same formats as the list_*_aws.sh scripts, and exits with an error
+status if none were found.  Scripts that create or delete resources
+set $AWS_INVENTORY_TTL (the default for --ttl) to 0, so that they check
+for existing resources in AWS itself rather than in the cache, and use
+the --invalidate option so that later lookups see the change.
+
+Examples:
+
+  # Find VPC ID(s) for VPC(s) with name tag value "My VPC"
+  aws_inventory.py -t vpc "My VPC"
+
+  # List info for subnets in VPC 10.192.0.0/20 in us-east-2 region
+  aws_inventory.py -r us-east-2 -t subnet -v 10.192.0.0/20 -l
+
+  # Forget cached resources in us-east-2 region
+  aws_inventory.py -r us-east-2 --invalidate
+"""
+
+
+# Import the required Python modules.
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+# AWS CLI command used to fetch each type of resource, the key for the
+# list of resources in its output, and the key for each resource's ID.
+INVENTORY_TYPES = {
+    'vpc': ('describe-vpcs', 'Vpcs', 'VpcId'),
+    'subnet': ('describe-subnets', 'Subnets', 'SubnetId'),
+    'igw': ('describe-internet-gateways', 'InternetGateways',
+            'InternetGatewayId'),
+    'rtb': ('describe-route-tables', 'RouteTables', 'RouteTableId'),
+}
+
+# Fields shown for each type of resource in long listings.
+INVENTORY_LONG_FIELDS = {
+    'vpc': ['id', 'cidr', 'name'],
+    'subnet': ['id', 'vpc', 'cidr', 'name'],
+    'igw': ['id', 'vpc', 'name'],
+    'rtb': ['id', 'vpc', 'name'],
+}
+
+# Fields by which resources are looked up, in order of precedence.
+INVENTORY_KEYS = ['id', 'cidr', 'name']
+
+# Default number of seconds for which cached resources are used, unless
+# set by $AWS_INVENTORY_TTL.
+INVENTORY_TTL = 300
+
+# Snapshots already read, by pathname.
+INVENTORY_SNAPSHOTS = {}
+
+
+class InventoryError(Exception):
+    """Error fetching or caching resources."""
+
+
+def inventory_record(resource_type, item):
+    """Return the ID, address, VPC, and name of a resource."""
+    id_key = INVENTORY_TYPES[resource_type][2]
+    vpc = ''
+    if resource_type != 'vpc':
+        vpc = item.get('VpcId', '')
+        for attachment in item.get('Attachments', []):
+            vpc = attachment.get('VpcId', vpc)
+    name = ''
+    for tag in item.get('Tags', []):
+        if tag.get('Key') == 'Name':
+            name = tag.get('Value', '')
+    return {
+        'id': item[id_key],
+        'cidr': item.get('CidrBlock', ''),
+        'vpc': vpc,
+        'name': name,
+    }
+
+
+def inventory_aws(args, region, endpoint_url=None):
+    """Run an AWS CLI ec2 command in region, return its JSON output."""
+    cmd = ['aws', 'ec2'] + args + ['--region', region, '--output', 'json']
+    if endpoint_url:
+        cmd.extend(['--endpoint-url', endpoint_url])
+    try:
+        proc = subprocess.run(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            check=False,
+        )
+    except OSError as err:
+        raise InventoryError('Cannot run AWS CLI: {}'.format(err))
+    if proc.returncode != 0:
+        raise InventoryError('aws ec2 {} failed in {}: {}'.format(
+            args[0], region, proc.stderr.strip(),
+        ))
+    try:
+        return json.loads(proc.stdout or '{}')
+    except ValueError as err:
+        raise InventoryError('Bad output from aws ec2 {}: {}'.format(
+            args[0], err,
+        ))
+
+
+def inventory_fetch(region, resource_type, endpoint_url=None):
+    """Fetch all resources of a type in region, return their records."""
+    (command, list_key, _) = INVENTORY_TYPES[resource_type]
+    output = inventory_aws([command], region, endpoint_url)
+    return [inventory_record(resource_type, item)
+            for item in output.get(list_key, [])]
+
+
+def inventory_cache_dir(cache_dir=None):
+    """Return the directory in which resources are cached."""
+    if cache_dir:
+        return cache_dir
+    return os.environ.get(
+        'AWS_INVENTORY_CACHE',
+        os.path.expanduser(os.path.join('~', '.cache', 'aws_inventory')),
+    )
+
+
+def inventory_identity():
+    """Return a string identifying the AWS credentials in use.
+
+    NOTE: This is the profile and access key the AWS CLI would use,
+    rather than the account ID, since asking AWS for that would take
+    about as long as fetching the resources.
+    """
+    return '{}:{}'.format(
+        os.environ.get('AWS_PROFILE')
+        or os.environ.get('AWS_DEFAULT_PROFILE') or 'default',
+        os.environ.get('AWS_ACCESS_KEY_ID', ''),
+    )
+
+
+def inventory_cache_path(cache_dir, region, resource_type,
+                         endpoint_url=None):
+    """Return pathname of the cache file for a type of resource.
+
+    The name includes a hash of the credentials and endpoint in use, so
+    that resources of one account are never used for another.
+    """
+    name = '{}_{}_{}'.format(
+        region,
+        resource_type,
+        hashlib.sha1('{}\n{}'.format(
+            inventory_identity(),
+            endpoint_url or '',
+        ).encode('utf-8')).hexdigest()[:8],
+    )
+    return os.path.join(inventory_cache_dir(cache_dir), name + '.json')
+
+
+def inventory_snapshot_records(snapshot, region, resource_type):
+    """Return records for resources of a type in region from snapshot."""
+    if snapshot not in INVENTORY_SNAPSHOTS:
+        try:
+            with open(snapshot, 'r') as snapshot_f:
+                INVENTORY_SNAPSHOTS[snapshot] = json.load(snapshot_f)
+        except (OSError, ValueError) as err:
+            raise InventoryError('Cannot read snapshot {}: {}'.format(
+                snapshot, err,
+            ))
+    regions = INVENTORY_SNAPSHOTS[snapshot].get('regions', {})
+    if region not in regions:
+        raise InventoryError('Region {} not in snapshot {}'.format(
+            region, snapshot,
+        ))
+    if 'error' in regions[region]:
+        raise InventoryError('Region {} not in snapshot {}: {}'.format(
+            region, snapshot, regions[region]['error'],
+        ))
+    return regions[region].get(resource_type, [])
+
+
+def inventory_load(region, resource_type, ttl=INVENTORY_TTL,
+                   cache_dir=None, endpoint_url=None, snapshot=None):
+    """Return records for resources of a type in region.
+
+    Use the snapshot if given.  Otherwise use the cached records if
+    fetched less than ttl seconds ago, or else fetch and cache them.
+    """
+    if snapshot:
+        return inventory_snapshot_records(snapshot, region, resource_type)
+    cache_path = inventory_cache_path(
+        cache_dir, region, resource_type, endpoint_url,
+    )
+    try:
+        with open(cache_path, 'r') as cache_f:
+            cache = json.load(cache_f)
+        if 0 <= time.time() - cache['fetched'] < ttl:
+            return cache['records']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass  # Not cached, or cache unreadable
+    records = inventory_fetch(region, resource_type, endpoint_url)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = '{}.{}'.format(cache_path, os.getpid())
+        with open(tmp_path, 'w') as cache_f:
+            json.dump({'fetched': time.time(), 'records': records}, cache_f)
+        os.replace(tmp_path, cache_path)
+    except OSError as err:
+        print('Cannot cache resources in {}: {}'.format(cache_path, err),
+              file=sys.stderr)
+    return records
+
+
+def inventory_invalidate(region, resource_types=None, cache_dir=None,
+                         endpoint_url=None):
+    """Forget cached records for resources in region."""
+    for resource_type in resource_types or INVENTORY_TYPES:
+        try:
+            os.remove(inventory_cache_path(
+                cache_dir, region, resource_type, endpoint_url,
+            ))
+        except FileNotFoundError:
+            pass
+
+
+def inventory_index(records):
+    """Return index of records by ID, address, and name.
+
+    The index maps each key field to a dictionary mapping each value of
+    that field to the list of records with that value.
+    """
+    index = {key: {} for key in INVENTORY_KEYS}
+    for record in records:
+        for key in INVENTORY_KEYS:
+            if record[key]:
+                index[key].setdefault(record[key], []).append(record)
+    return index
+
+
+def inventory_resolve(index, designator):
+    """Return records with designator as their ID, address, or name."""
+    for key in INVENTORY_KEYS:
+        if designator in index[key]:
+            return index[key][designator]
+    return []
+
+
+def inventory_lookup(region, resource_type, designator=None, vpc=None,
+                     ttl=INVENTORY_TTL, cache_dir=None, endpoint_url=None,
+                     snapshot=None):
+    """Look up resources of a type by ID, address, or name.
+
+    If vpc is given (as a VPC ID, address, or name), only look in the
+    VPC(s) it designates.  If designator is not given, return all
+    resources (in those VPCs).  Return None if the VPC is not found.
+    """
+    records = inventory_load(
+        region, resource_type, ttl, cache_dir, endpoint_url, snapshot,
+    )
+    if vpc:
+        vpc_ids = [
+            record['id'] for record in inventory_resolve(
+                inventory_index(inventory_load(
+                    region, 'vpc', ttl, cache_dir, endpoint_url, snapshot,
+                )),
+                vpc,
+            )
+        ]
+        if not vpc_ids:
+            return None
+        records = [record for record in records if record['vpc'] in vpc_ids]
+    if not designator:
+        return records
+    return inventory_resolve(inventory_index(records), designator)
+
+
+def inventory_default_region():
+    """Return the default AWS region, or None if there isn't one."""
+    region = os.environ.get('AWS_REGION') or os.environ.get(
+        'AWS_DEFAULT_REGION',
+    )
+    if region:
+        return region
+    try:
+        proc = subprocess.run(
+            ['aws', 'configure', 'get', 'region'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            check=False,
+        )
+    except OSError:
+        return None
+    return proc.stdout.strip() or None
+
+
+def get_args():
+    """Get arguments from command line or user input and return them."""
+    parser = argparse.ArgumentParser(
+        description='Look up AWS network resources by ID, address, or name',
+    )
+    parser.add_argument(
+        '-q',
+        action='store_true',
+        dest='quiet',
+        help='run quietly without unneeded messages',
+    )
+    parser.add_argument(
+        '-1',
+        action='store_true',
+        dest='one_per_line',
+        help='display IDs one per line',
+    )
+    parser.add_argument(
+        '-l',
+        action='store_true',
+        dest='long_listing',
+        help='also display address, VPC, and name (implies -1)',
+    )
+    parser.add_argument(
+        '-r',
+        action='store',
+        dest='region',
+        help='AWS region to search',
+    )
+    parser.add_argument(
+        '-t',
+        action='store',
+        dest='resource_type',
+        choices=sorted(INVENTORY_TYPES),
+        default='vpc',
+        help='type of resource to look up (default vpc)',
+    )
+    parser.add_argument(
+        '-v',
+        action='store',
+        dest='vpc',
+        help='VPC ID, address, or name to search',
+    )
+    parser.add_argument(
+        '--ttl',
+        action='store',
+        dest='ttl',
+        type=int,
+        default=os.environ.get('AWS_INVENTORY_TTL', INVENTORY_TTL),
+        help='seconds for which to use cached resources, 0 to always '
+             'fetch them (default $AWS_INVENTORY_TTL or '
+             '{})'.format(INVENTORY_TTL),
+    )
+    parser.add_argument(
+        '--invalidate',
+        action='store_true',
+        dest='invalidate',
+        help='forget cached resources in the region',
+    )
+    parser.add_argument(
+        '--endpoint-url',
+        action='store',
+        dest='endpoint_url',
+        help='URL of EC2 API endpoint to use instead of the default',
+    )
+    parser.add_argument(
+        '--snapshot',
+        action='store',
+        dest='snapshot',
+        default=os.environ.get('AWS_INVENTORY_SNAPSHOT'),
+        help='snapshot written by aws_snapshot.py in which to look up '
+             'resources (default $AWS_INVENTORY_SNAPSHOT)',
+    )
+    parser.add_argument(
+        'designator',
+        action='store',
+        nargs='?',
+        help='ID, address, or name of resource to look up',
+    )
+    args = parser.parse_args()
+    args.region = args.region or inventory_default_region()
+    if not args.region:
+        parser.print_usage(sys.stderr)
+        sys.exit('No AWS region specified')
+    return args
+
+
+def main():
+    """Look up AWS network resources."""
+    args = get_args()
+    fn = os.path.basename(sys.argv[0])
+    if args.invalidate:
+        inventory_invalidate(args.region, endpoint_url=args.endpoint_url)
+        return
+    try:
+        records = inventory_lookup(
+            args.region,
+            args.resource_type,
+            args.designator,
+            args.vpc,
+            args.ttl,
+            endpoint_url=args.endpoint_url,
+            snapshot=args.snapshot,
+        )
+    except InventoryError as err:
+        sys.exit('{}: {}'.format(fn, err))
+    if records is None or (args.designator and not records):
+        if not args.quiet:
+            print('{}: {} not found'.format(
+                fn, args.designator if records is not None else args.vpc,
+            ), file=sys.stderr)
+        sys.exit(1)
+    if args.long_listing:
+        for record in records:
+            print('\t'.join(
+                record[field] or 'None'
+                for field in INVENTORY_LONG_FIELDS[args.resource_type]
+            ))
+    elif args.one_per_line:
+        for record in records:
+            print(record['id'])
+    else:
+        print(' '.join(record['id'] for record in records))
+
+
+# Execute the following when this is run as a script.
+if __name__ == '__main__':
+    main()
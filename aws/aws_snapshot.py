@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+"""aws_snapshot: Take a snapshot of AWS network resources in many regions.
+
+This script fetches the VPCs, subnets, Internet gateways, and route
+tables in each of the specified AWS regions (by default, all regions
+enabled for the account), fetching all of them in parallel, and writes
+them to a single compact JSON file.  Each subnet and route table
+records the VPC it is in, and each Internet gateway the VPC it is
+attached to (if any), as shown by the list_*_aws.sh scripts.
+
+It then prints the number of each type of resource in each region,
+or with the -l option lists each VPC with its subnets, Internet
+gateway, and route tables.  Regions that could not be read (e.g.,
+because they are not enabled) are reported and recorded as such in the
+snapshot.
+
+The snapshot can be used by aws_inventory.py and the list_*_aws.sh
+scripts instead of AWS itself, e.g.
+
+  AWS_INVENTORY_SNAPSHOT=snapshot.json list_subnet_aws.sh -v "My VPC"
+
+Examples:
+
+  # Take a snapshot of all enabled regions
+  aws_snapshot.py -o snapshot.json
+
+  # Take a snapshot of two regions and list their VPCs
+  aws_snapshot.py -l -r us-east-1,us-west-2 -o snapshot.json
+"""
+
+
+# Import the required Python modules.
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+import aws_inventory
+
+
+# Default number of AWS CLI commands to run at once.
+SNAPSHOT_WORKERS = 16
+
+
+def snapshot_regions(endpoint_url=None):
+    """Return names of all regions enabled for the account."""
+    output = aws_inventory.inventory_aws(
+        ['describe-regions'],
+        aws_inventory.inventory_default_region() or 'us-east-1',
+        endpoint_url,
+    )
+    return sorted(region['RegionName']
+                  for region in output.get('Regions', []))
+
+
+def snapshot_take(regions, workers=SNAPSHOT_WORKERS, endpoint_url=None):
+    """Fetch all resources in regions in parallel, return the snapshot."""
+    snapshot = {'created': time.time(), 'regions': {}}
+    jobs = [(region, resource_type)
+            for region in regions
+            for resource_type in sorted(aws_inventory.INVENTORY_TYPES)]
+
+    def fetch(job):
+        (region, resource_type) = job
+        start = time.time()
+        try:
+            records = aws_inventory.inventory_fetch(
+                region, resource_type, endpoint_url,
+            )
+        except aws_inventory.InventoryError as err:
+            return (job, None, str(err), time.time() - start)
+        return (job, records, None, time.time() - start)
+
+    seconds = {}
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers) as executor:
+        for (job, records, error, elapsed) in executor.map(fetch, jobs):
+            (region, resource_type) = job
+            region_snapshot = snapshot['regions'].setdefault(region, {})
+            seconds[region] = max(seconds.get(region, 0.0), elapsed)
+            if error is not None:
+                region_snapshot['error'] = error
+            else:
+                region_snapshot[resource_type] = records
+
+    # Drop what was read from regions that could not all be read.
+    for region_snapshot in snapshot['regions'].values():
+        if 'error' in region_snapshot:
+            for resource_type in aws_inventory.INVENTORY_TYPES:
+                region_snapshot.pop(resource_type, None)
+    return (snapshot, seconds)
+
+
+def snapshot_write(snapshot, output):
+    """Write snapshot to output in compact form."""
+    tmp_path = '{}.{}'.format(output, os.getpid())
+    try:
+        with open(tmp_path, 'w') as snapshot_f:
+            json.dump(snapshot, snapshot_f, separators=(',', ':'))
+        os.replace(tmp_path, output)
+    except OSError as err:
+        sys.exit('Cannot write snapshot {}: {}'.format(output, err))
+
+
+def snapshot_print_summary(snapshot, seconds):
+    """Print the number of resources of each type in each region."""
+    width = max([len('Region')] + [len(region)
+                                   for region in snapshot['regions']])
+    print('{:<{}}  {:>5}  {:>7}  {:>5}  {:>5}  {:>7}'.format(
+        'Region', width, 'VPCs', 'Subnets', 'IGWs', 'RTBs', 'Seconds',
+    ))
+    for (region, region_snapshot) in sorted(snapshot['regions'].items()):
+        if 'error' in region_snapshot:
+            print('{:<{}}  {}'.format(
+                region, width, region_snapshot['error'],
+            ))
+            continue
+        print('{:<{}}  {:>5}  {:>7}  {:>5}  {:>5}  {:>7.1f}'.format(
+            region, width,
+            len(region_snapshot['vpc']),
+            len(region_snapshot['subnet']),
+            len(region_snapshot['igw']),
+            len(region_snapshot['rtb']),
+            seconds[region],
+        ))
+
+
+def snapshot_print_vpcs(snapshot):
+    """Print each VPC with its subnets, gateway, and route tables."""
+    for (region, region_snapshot) in sorted(snapshot['regions'].items()):
+        if 'error' in region_snapshot:
+            print('{}: {}'.format(region, region_snapshot['error']))
+            continue
+        in_vpc = {}
+        for resource_type in ['subnet', 'igw', 'rtb']:
+            for record in region_snapshot[resource_type]:
+                in_vpc.setdefault(
+                    (record['vpc'], resource_type), [],
+                ).append(record)
+        for vpc in region_snapshot['vpc']:
+            print('\t'.join([
+                region, vpc['id'], vpc['cidr'], vpc['name'] or 'None',
+            ]))
+            for record in in_vpc.get((vpc['id'], 'subnet'), []):
+                print('\t'.join([
+                    '', 'subnet', record['id'], record['cidr'],
+                    record['name'] or 'None',
+                ]))
+            for resource_type in ['igw', 'rtb']:
+                for record in in_vpc.get((vpc['id'], resource_type), []):
+                    print('\t'.join([
+                        '', resource_type, record['id'],
+                        record['name'] or 'None',
+                    ]))
+        for record in in_vpc.get(('', 'igw'), []):
+            print('\t'.join([
+                region, record['id'], 'not attached',
+                record['name'] or 'None',
+            ]))
+
+
+def get_args():
+    """Get arguments from command line or user input and return them."""
+    parser = argparse.ArgumentParser(
+        description='Take a snapshot of AWS network resources in regions',
+    )
+    parser.add_argument(
+        '-r',
+        action='store',
+        dest='regions',
+        help='comma-separated AWS regions (default all enabled regions)',
+    )
+    parser.add_argument(
+        '-o',
+        action='store',
+        dest='output',
+        default='aws_snapshot.json',
+        help='file to which to write the snapshot '
+             '(default aws_snapshot.json)',
+    )
+    parser.add_argument(
+        '-l',
+        action='store_true',
+        dest='long_listing',
+        help='list each VPC with its subnets, gateway, and route tables',
+    )
+    parser.add_argument(
+        '--workers',
+        action='store',
+        dest='workers',
+        type=int,
+        default=SNAPSHOT_WORKERS,
+        help='AWS CLI commands to run at once '
+             '(default {})'.format(SNAPSHOT_WORKERS),
+    )
+    parser.add_argument(
+        '--endpoint-url',
+        action='store',
+        dest='endpoint_url',
+        help='URL of EC2 API endpoint to use instead of the default',
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Take a snapshot of AWS network resources."""
+    args = get_args()
+    try:
+        if args.regions:
+            regions = [region for region in args.regions.split(',')
+                       if region]
+        else:
+            regions = snapshot_regions(args.endpoint_url)
+    except aws_inventory.InventoryError as err:
+        sys.exit('Cannot list regions: {}'.format(err))
+    (snapshot, seconds) = snapshot_take(
+        regions,
+        max(args.workers, 1),
+        args.endpoint_url,
+    )
+    snapshot_write(snapshot, args.output)
+    if args.long_listing:
+        snapshot_print_vpcs(snapshot)
+    else:
+        snapshot_print_summary(snapshot, seconds)
+    if any('error' in region_snapshot
+           for region_snapshot in snapshot['regions'].values()):
+        sys.exit(1)
+
+
+# Execute the following when this is run as a script.
+if __name__ == '__main__':
+    main()
@@ -17,9 +17,19 @@ usage() {
 }
 
 # Get default region and creator ID.
-region=`aws configure list | grep '^ *region' | awk '{ print $2 }'`
+# NOTE: Use the region from the environment if set, as the AWS CLI
+# does, since running the AWS CLI is much slower.
+region="${AWS_REGION:-${AWS_DEFAULT_REGION}}"
+[ -z "${region}" ] && region=`aws configure list | grep '^ *region' | awk '{ print $2 }'`
 creator=`whoami`
 
+# Look for existing resources in AWS itself, not in the resources cached
+# by the list scripts, which may be a few minutes out of date, or in a
+# snapshot.
+AWS_INVENTORY_TTL=0
+export AWS_INVENTORY_TTL
+unset AWS_INVENTORY_SNAPSHOT
+
 # Check and extract optional arguments.
 quiet=false
 while getopts "qr:" arg; do
@@ -77,3 +87,8 @@ else
         --tag-specifications "ResourceType=vpc,Tags=[{Key=Name,Value=${vpc_name}},{Key=creator,Value=${creator}}]" \
         --query 'Vpc.VpcId'
 fi
+status=$?
+
+# Make sure later lookups see the new VPC.
+python3 "${dir}"/aws_inventory.py -r "${region}" --invalidate
+exit ${status}
@@ -16,7 +16,17 @@ usage() {
 }
 
 # Get default region.
-region=`aws configure list | grep '^ *region' | awk '{ print $2 }'`
+# NOTE: Use the region from the environment if set, as the AWS CLI
+# does, since running the AWS CLI is much slower.
+region="${AWS_REGION:-${AWS_DEFAULT_REGION}}"
+[ -z "${region}" ] && region=`aws configure list | grep '^ *region' | awk '{ print $2 }'`
+
+# Look for existing resources in AWS itself, not in the resources cached
+# by the list scripts, which may be a few minutes out of date, or in a
+# snapshot.
+AWS_INVENTORY_TTL=0
+export AWS_INVENTORY_TTL
+unset AWS_INVENTORY_SNAPSHOT
 
 # Check and extract optional arguments.
 quiet=false
@@ -60,3 +70,8 @@ case "${existing}" in
         aws ec2 delete-vpc --region "${region}" --vpc-id "${existing}"
         ;;
 esac
+status=$?
+
+# Make sure later lookups see the deleted VPC.
+python3 "${dir}"/aws_inventory.py -r "${region}" --invalidate
+exit ${status}
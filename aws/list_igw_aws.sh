@@ -19,7 +19,10 @@ usage() {
 }
 
 # Get default region.
-region=`aws configure list | grep '^ *region' | awk '{ print $2 }'`
+# NOTE: Use the region from the environment if set, as the AWS CLI
+# does, since running the AWS CLI is much slower.
+region="${AWS_REGION:-${AWS_DEFAULT_REGION}}"
+[ -z "${region}" ] && region=`aws configure list | grep '^ *region' | awk '{ print $2 }'`
 
 # Check and extract optional arguments.
 quiet=false
@@ -58,18 +61,23 @@ case "${vpc}" in
         ;;
 esac
 
+# If a snapshot was given, answer from it rather than from AWS.
+if [ ! -z "${AWS_INVENTORY_SNAPSHOT}" ]; then
+    set -- -r "${region}" -t igw
+    [ "${quiet}" = true ] && set -- "$@" -q
+    [ "${one_per_line}" = true ] && set -- "$@" -1
+    [ "${long_listing}" = true ] && set -- "$@" -l
+    [ ! -z "${vpc}" ] && set -- "$@" -v "${vpc}"
+    [ ! -z "${igw}" ] && set -- "$@" "${igw}"
+    exec python3 "${dir}"/aws_inventory.py "$@"
+fi
+
 # If a VPC was specified, find it by ID, address, or name.
 # NOTE: A search by name or address may return multiple VPC IDs.
 if [ -z "${vpc}" ]; then
     vpc_ids=
 else
-    for vpc_designator in vpc-id cidr tag:Name; do
-        vpc_ids=`aws ec2 describe-vpcs --no-paginate --output text \
-            --region "${region}" \
-            --filters "Name=${vpc_designator},Values=${vpc}" \
-            --query 'Vpcs[].VpcId'`
-        [ ! -z "${vpc_ids}" ] && break
-    done
+    vpc_ids=`python3 "${dir}"/aws_inventory.py -q -r "${region}" -t vpc "${vpc}"`
     if [ -z "${vpc_ids}" ]; then
         [ "${quiet}" = false ] && echo >&2 "${fn}: ${vpc} not found"
         exit 1
@@ -151,33 +159,9 @@ else
     # Try to find the Internet gateway by ID or name.
     # NOTE: A search by name may return multiple gateway IDs.
     if [ -z "${vpc_ids}" ]; then
-        for igw_designator in internet-gateway-id tag:Name; do
-            igw_ids=`aws ec2 describe-internet-gateways \
-                --no-paginate --output text \
-                --region "${region}" \
-                --filters "Name=${igw_designator},Values=${igw}" \
-                --query 'InternetGateways[].InternetGatewayId'`
-            [ ! -z "${igw_ids}" ] && break
-        done
+        igw_ids=`python3 "${dir}"/aws_inventory.py -q -r "${region}" -t igw "${igw}"`
     else
-        igw_ids=
-        for vpc_id in ${vpc_ids}; do
-            for igw_designator in internet-gateway-id tag:Name; do
-                new_igw_ids=`aws ec2 describe-internet-gateways \
-                    --no-paginate --output text \
-                    --region "${region}" \
-                    --filters \
-                        "Name=${igw_designator},Values=${igw}" \
-                        "Name=attachment.vpc-id,Values=${vpc_id}" \
-                    --query 'InternetGateways[].InternetGatewayId'`
-                [ ! -z "${new_igw_ids}" ] && break
-            done
-            if [ -z "$igw_ids" ]; then
-                igw_ids="${new_igw_ids}"
-            else
-                igw_ids="${igw_ids} ${new_igw_ids}"
-            fi
-        done
+        igw_ids=`python3 "${dir}"/aws_inventory.py -q -r "${region}" -t igw -v "${vpc}" "${igw}"`
     fi
     if [ -z "${igw_ids}" ]; then
         [ "${quiet}" = false ] && echo >&2 "${fn}: ${igw} not found"
@@ -19,7 +19,10 @@ usage() {
 }
 
 # Get default region.
-region=`aws configure list | grep '^ *region' | awk '{ print $2 }'`
+# NOTE: Use the region from the environment if set, as the AWS CLI
+# does, since running the AWS CLI is much slower.
+region="${AWS_REGION:-${AWS_DEFAULT_REGION}}"
+[ -z "${region}" ] && region=`aws configure list | grep '^ *region' | awk '{ print $2 }'`
 
 # Check and extract optional arguments.
 quiet=false
@@ -58,18 +61,23 @@ case "${vpc}" in
         ;;
 esac
 
+# If a snapshot was given, answer from it rather than from AWS.
+if [ ! -z "${AWS_INVENTORY_SNAPSHOT}" ]; then
+    set -- -r "${region}" -t rtb
+    [ "${quiet}" = true ] && set -- "$@" -q
+    [ "${one_per_line}" = true ] && set -- "$@" -1
+    [ "${long_listing}" = true ] && set -- "$@" -l
+    [ ! -z "${vpc}" ] && set -- "$@" -v "${vpc}"
+    [ ! -z "${rtb}" ] && set -- "$@" "${rtb}"
+    exec python3 "${dir}"/aws_inventory.py "$@"
+fi
+
 # If a VPC was specified, find it by ID, address, or name.
 # NOTE: A search by name or address may return multiple VPC IDs.
 if [ -z "${vpc}" ]; then
     vpc_ids=
 else
-    for vpc_designator in vpc-id cidr tag:Name; do
-        vpc_ids=`aws ec2 describe-vpcs --no-paginate --output text \
-            --region "${region}" \
-            --filters "Name=${vpc_designator},Values=${vpc}" \
-            --query 'Vpcs[].VpcId'`
-        [ ! -z "${vpc_ids}" ] && break
-    done
+    vpc_ids=`python3 "${dir}"/aws_inventory.py -q -r "${region}" -t vpc "${vpc}"`
     if [ -z "${vpc_ids}" ]; then
         [ "${quiet}" = false ] && echo >&2 "${fn}: ${vpc} not found"
         exit 1
@@ -146,33 +154,9 @@ else
     # Try to find the route table by ID or name.
     # NOTE: A search by name may return multiple route table IDs.
     if [ -z "${vpc_ids}" ]; then
-        for rtb_designator in route-table-id tag:Name; do
-            rtb_ids=`aws ec2 describe-route-tables \
-                --no-paginate --output text \
-                --region "${region}" \
-                --filters "Name=${rtb_designator},Values=${rtb}" \
-                --query 'RouteTables[].RouteTableId'`
-            [ ! -z "${rtb_ids}" ] && break
-        done
+        rtb_ids=`python3 "${dir}"/aws_inventory.py -q -r "${region}" -t rtb "${rtb}"`
     else
-        rtb_ids=
-        for vpc_id in ${vpc_ids}; do
-            for rtb_designator in route-table-id tag:Name; do
-                new_rtb_ids=`aws ec2 describe-route-tables \
-                    --no-paginate --output text \
-                    --region "${region}" \
-                    --filters \
-                        "Name=${rtb_designator},Values=${rtb}" \
-                        "Name=vpc-id,Values=${vpc_id}" \
-                    --query 'RouteTables[].RouteTableId'`
-                [ ! -z "${new_rtb_ids}" ] && break
-            done
-            if [ -z "$rtb_ids" ]; then
-                rtb_ids="${new_rtb_ids}"
-            else
-                rtb_ids="${rtb_ids} ${new_rtb_ids}"
-            fi
-        done
+        rtb_ids=`python3 "${dir}"/aws_inventory.py -q -r "${region}" -t rtb -v "${vpc}" "${rtb}"`
     fi
     if [ -z "${rtb_ids}" ]; then
         [ "${quiet}" = false ] && echo >&2 "${fn}: ${rtb} not found"
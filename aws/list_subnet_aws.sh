@@ -19,7 +19,10 @@ usage() {
 }
 
 # Get default region.
-region=`aws configure list | grep '^ *region' | awk '{ print $2 }'`
+# NOTE: Use the region from the environment if set, as the AWS CLI
+# does, since running the AWS CLI is much slower.
+region="${AWS_REGION:-${AWS_DEFAULT_REGION}}"
+[ -z "${region}" ] && region=`aws configure list | grep '^ *region' | awk '{ print $2 }'`
 
 # Check and extract optional arguments.
 quiet=false
@@ -58,18 +61,23 @@ case "${vpc}" in
         ;;
 esac
 
+# If a snapshot was given, answer from it rather than from AWS.
+if [ ! -z "${AWS_INVENTORY_SNAPSHOT}" ]; then
+    set -- -r "${region}" -t subnet
+    [ "${quiet}" = true ] && set -- "$@" -q
+    [ "${one_per_line}" = true ] && set -- "$@" -1
+    [ "${long_listing}" = true ] && set -- "$@" -l
+    [ ! -z "${vpc}" ] && set -- "$@" -v "${vpc}"
+    [ ! -z "${subnet}" ] && set -- "$@" "${subnet}"
+    exec python3 "${dir}"/aws_inventory.py "$@"
+fi
+
 # If a VPC was specified, find it by ID, address, or name.
 # NOTE: A search by name or address may return multiple VPC IDs.
 if [ -z "${vpc}" ]; then
     vpc_ids=
 else
-    for vpc_designator in vpc-id cidr tag:Name; do
-        vpc_ids=`aws ec2 describe-vpcs --no-paginate --output text \
-            --region "${region}" \
-            --filters "Name=${vpc_designator},Values=${vpc}" \
-            --query 'Vpcs[].VpcId'`
-        [ ! -z "${vpc_ids}" ] && break
-    done
+    vpc_ids=`python3 "${dir}"/aws_inventory.py -q -r "${region}" -t vpc "${vpc}"`
     if [ -z "${vpc_ids}" ]; then
         [ "${quiet}" = false ] && echo >&2 "${fn}: ${vpc} not found"
         exit 1
@@ -137,31 +145,9 @@ else
     # Try to find the subnet by ID, address, or name.
     # NOTE: A search by address or name may return multiple subnet IDs.
     if [ -z "${vpc_ids}" ]; then
-        for subnet_designator in subnet-id cidr tag:Name; do
-            subnet_ids=`aws ec2 describe-subnets --no-paginate --output text \
-                            --region "${region}" \
-                            --filters "Name=${subnet_designator},Values=${subnet}" \
-                            --query 'Subnets[].SubnetId'`
-            [ ! -z "${subnet_ids}" ] && break
-        done
+        subnet_ids=`python3 "${dir}"/aws_inventory.py -q -r "${region}" -t subnet "${subnet}"`
     else
-        subnet_ids=
-        for vpc_id in ${vpc_ids}; do
-            for subnet_designator in subnet-id cidr tag:Name; do
-                new_subnet_ids=`aws ec2 describe-subnets --no-paginate --output text \
-                        --region "${region}" \
-                        --filters \
-                            "Name=vpc-id,Values=${vpc_id}" \
-                            "Name=${subnet_designator},Values=${subnet}" \
-                        --query 'Subnets[].SubnetId'`
-                [ ! -z "${new_subnet_ids}" ] && break
-            done
-            if [ -z "$subnet_ids" ]; then
-                subnet_ids="${new_subnet_ids}"
-            else
-                subnet_ids="${subnet_ids} ${new_subnet_ids}"
-            fi
-        done
+        subnet_ids=`python3 "${dir}"/aws_inventory.py -q -r "${region}" -t subnet -v "${vpc}" "${subnet}"`
     fi
     if [ -z "${subnet_ids}" ]; then
         [ "${quiet}" = false ] && echo >&2 "${fn}: ${subnet} not found"
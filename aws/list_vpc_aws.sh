@@ -18,7 +18,10 @@ usage() {
 }
 
 # Get default region.
-region=`aws configure list | grep '^ *region' | awk '{ print $2 }'`
+# NOTE: Use the region from the environment if set, as the AWS CLI
+# does, since running the AWS CLI is much slower.
+region="${AWS_REGION:-${AWS_DEFAULT_REGION}}"
+[ -z "${region}" ] && region=`aws configure list | grep '^ *region' | awk '{ print $2 }'`
 
 # Check and extract optional arguments.
 quiet=false
@@ -50,6 +53,16 @@ case "${region}" in
         ;;
 esac
 
+# If a snapshot was given, answer from it rather than from AWS.
+if [ ! -z "${AWS_INVENTORY_SNAPSHOT}" ]; then
+    set -- -r "${region}" -t vpc
+    [ "${quiet}" = true ] && set -- "$@" -q
+    [ "${one_per_line}" = true ] && set -- "$@" -1
+    [ "${long_listing}" = true ] && set -- "$@" -l
+    [ ! -z "${vpc}" ] && set -- "$@" "${vpc}"
+    exec python3 "${dir}"/aws_inventory.py "$@"
+fi
+
 # If no <vpc> argument then list all VPCs, optionally displaying one
 # per line and extra info. Otherwise look for the specified VPC(s) by
 # ID, CIDR address, and name, optionally displaying extra info.
@@ -72,13 +85,7 @@ if [ -z "${vpc}" ]; then
 else
     # Try to find the VPC by ID, CIDR-format address, or name.
     # NOTE: A search by address or name may return multiple VPC IDs.
-    for vpc_designator in vpc-id cidr tag:Name; do
-        vpc_ids=`aws ec2 describe-vpcs --no-paginate --output text \
-            --region "${region}" \
-            --filters "Name=${vpc_designator},Values=${vpc}" \
-            --query 'Vpcs[].VpcId'`
-        [ ! -z "${vpc_ids}" ] && break
-    done
+    vpc_ids=`python3 "${dir}"/aws_inventory.py -q -r "${region}" -t vpc "${vpc}"`
     if [ -z "${vpc_ids}" ]; then
         [ "${quiet}" = false ] && echo >&2 "${fn}: ${vpc} not found"
         exit 1
@@ -0,0 +1,500 @@
+#!/usr/bin/python3
+"""run_tests_aws: Run the AWS script tests offline and in parallel.
+
+This script starts a local stand-in for the AWS EC2 API, seeded with
+VPCs, subnets, Internet gateways, and route tables matching the IDs,
+addresses, and names used by the test_list_*_aws.sh scripts (including
+resources with duplicate names and names containing spaces).  It then
+runs each test case in those scripts in parallel, with the AWS CLI
+pointed at the stand-in (via $AWS_ENDPOINT_URL) and dummy credentials,
+and prints the time taken and whether each case passed or failed.
+
+Each test case is the "sh ..." command following an "echo '--- ...'"
+line in a test script.  A case followed by "|| echo '*** failed'" must
+exit successfully, print something, and print no errors; a case
+followed by "&& echo '*** failed'" must exit with an error status.
+
+The script exits with an error status if any case failed.  The AWS CLI
+must be version 1.29 or 2.13 or later, which honor $AWS_ENDPOINT_URL.
+
+Examples:
+
+  # Run all the tests
+  run_tests_aws.py
+
+  # Run the VPC tests only, 4 at a time
+  run_tests_aws.py --workers 4 test_list_vpc_aws.sh
+
+  # Run the EC2 stand-in for use by hand
+  run_tests_aws.py --serve
+"""
+
+
+# Import the required Python modules.
+import argparse
+import concurrent.futures
+import glob
+import http.server
+import os
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from xml.sax.saxutils import escape
+
+
+# Directory containing this script and the scripts it tests.
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Region used when none is given to the scripts under test.
+TESTS_REGION = 'us-east-2'
+
+# Default number of test cases to run at once.
+# NOTE: The cases spend most of their time starting the AWS CLI, so
+# running many more at once than there are CPUs gains nothing.
+TESTS_WORKERS = 2 * (os.cpu_count() or 1)
+
+# Seconds to allow each test case to run.
+TESTS_TIMEOUT = 60
+
+# Resources known to the EC2 stand-in, by region and type, in the form
+# used by aws_inventory.py.
+TESTS_FIXTURES = {
+    'us-east-2': {
+        'vpc': [
+            {'id': 'vpc-0a61f335fa05e57df', 'cidr': '10.192.0.0/20',
+             'name': 'test-vpc'},
+            {'id': 'vpc-0b5e7e1b9a4c2d6f1', 'cidr': '10.192.16.0/20',
+             'name': 'Test VPC'},
+            {'id': 'vpc-0c3d8a7f6e5b4a3d2', 'cidr': '10.192.32.0/20',
+             'name': 'vpc-with-duplicate-name'},
+            {'id': 'vpc-0d4e9b8a7f6c5b4e3', 'cidr': '10.192.48.0/20',
+             'name': 'vpc-with-duplicate-name'},
+            {'id': 'vpc-0e5fac9b8a7d6c5f4', 'cidr': '172.31.0.0/16',
+             'name': ''},
+        ],
+        'subnet': [
+            {'id': 'subnet-07fa0f7e149dca45d', 'cidr': '10.192.0.0/24',
+             'name': 'test-subnet', 'vpc': 'vpc-0a61f335fa05e57df'},
+            {'id': 'subnet-0a1b2c3d4e5f60718', 'cidr': '10.192.1.0/24',
+             'name': 'Test Subnet', 'vpc': 'vpc-0a61f335fa05e57df'},
+            {'id': 'subnet-0b2c3d4e5f6071829', 'cidr': '10.192.2.0/24',
+             'name': 'subnet-with-duplicate-name',
+             'vpc': 'vpc-0a61f335fa05e57df'},
+            {'id': 'subnet-0c3d4e5f607182930', 'cidr': '10.192.3.0/24',
+             'name': 'subnet-with-duplicate-name',
+             'vpc': 'vpc-0a61f335fa05e57df'},
+            {'id': 'subnet-0d4e5f60718293a41', 'cidr': '10.192.16.0/24',
+             'name': 'Test Subnet', 'vpc': 'vpc-0b5e7e1b9a4c2d6f1'},
+            {'id': 'subnet-0e5f60718293a4b52', 'cidr': '172.31.0.0/20',
+             'name': '', 'vpc': 'vpc-0e5fac9b8a7d6c5f4'},
+        ],
+        'igw': [
+            {'id': 'igw-0d22b630817ce49d2', 'name': 'test-igw',
+             'vpc': 'vpc-0a61f335fa05e57df'},
+            {'id': 'igw-01c262ece9b51f75e', 'name': 'Test IGW',
+             'vpc': 'vpc-0b5e7e1b9a4c2d6f1'},
+            {'id': 'igw-02a4c6e8f0b2d4f6a', 'name': 'test-igw-2',
+             'vpc': ''},
+            {'id': 'igw-03b5d7f9a1c3e5a7b', 'name': 'igw-with-duplicate-name',
+             'vpc': 'vpc-0c3d8a7f6e5b4a3d2'},
+            {'id': 'igw-04c6e8a0b2d4f6b8c', 'name': 'igw-with-duplicate-name',
+             'vpc': 'vpc-0d4e9b8a7f6c5b4e3'},
+        ],
+        'rtb': [
+            {'id': 'rtb-0a1b2c3d4e5f6a7b8', 'name': '',
+             'vpc': 'vpc-0a61f335fa05e57df'},
+            {'id': 'rtb-0b2c3d4e5f6a7b8c9', 'name': 'Test RTB',
+             'vpc': 'vpc-0b5e7e1b9a4c2d6f1'},
+        ],
+    },
+    'us-west-1': {
+        'vpc': [
+            {'id': 'vpc-020f5bab08c0d3f43', 'cidr': '10.192.0.0/20',
+             'name': 'test-vpc'},
+        ],
+        'subnet': [],
+        'igw': [],
+        'rtb': [],
+    },
+}
+
+# For each EC2 API action the stand-in supports, the type of resource
+# it describes, the parameter used to give resource IDs, the error
+# code for an unknown ID, and the element containing the resources.
+TESTS_ACTIONS = {
+    'DescribeVpcs': ('vpc', 'VpcId', 'InvalidVpcID.NotFound', 'vpcSet'),
+    'DescribeSubnets': ('subnet', 'SubnetId', 'InvalidSubnetID.NotFound',
+                        'subnetSet'),
+    'DescribeInternetGateways': ('igw', 'InternetGatewayId',
+                                 'InvalidInternetGatewayID.NotFound',
+                                 'internetGatewaySet'),
+    'DescribeRouteTables': ('rtb', 'RouteTableId',
+                            'InvalidRouteTableID.NotFound',
+                            'routeTableSet'),
+}
+
+# For each filter the stand-in supports, the field of a resource it
+# matches on.
+TESTS_FILTERS = {
+    'vpc-id': 'vpc',
+    'attachment.vpc-id': 'vpc',
+    'cidr': 'cidr',
+    'cidr-block': 'cidr',
+    'cidrBlock': 'cidr',
+    'tag:Name': 'name',
+}
+
+# Elements giving the ID and other fields of each type of resource.
+TESTS_ID_ELEMENTS = {
+    'vpc': 'vpcId',
+    'subnet': 'subnetId',
+    'igw': 'internetGatewayId',
+    'rtb': 'routeTableId',
+}
+
+TESTS_XMLNS = 'http://ec2.amazonaws.com/doc/2016-11-15/'
+
+
+# Functions for the EC2 API stand-in.
+def fake_ec2_item(resource_type, record):
+    """Return XML describing a resource."""
+    xml = ['<item>']
+    xml.append('<{0}>{1}</{0}>'.format(
+        TESTS_ID_ELEMENTS[resource_type], record['id'],
+    ))
+    if resource_type == 'igw':
+        xml.append('<attachmentSet>')
+        if record['vpc']:
+            xml.append('<item><vpcId>{}</vpcId>'
+                       '<state>available</state></item>'.format(
+                           record['vpc'],
+                       ))
+        xml.append('</attachmentSet>')
+    elif resource_type != 'vpc':
+        xml.append('<vpcId>{}</vpcId>'.format(record['vpc']))
+    if 'cidr' in record:
+        xml.append('<cidrBlock>{}</cidrBlock>'.format(record['cidr']))
+        xml.append('<state>available</state>')
+    if record['name']:
+        xml.append('<tagSet><item><key>Name</key><value>{}</value></item>'
+                   '</tagSet>'.format(escape(record['name'])))
+    xml.append('</item>')
+    return ''.join(xml)
+
+
+def fake_ec2_describe(action, region, params):
+    """Carry out a Describe action, return (status, XML response)."""
+    (resource_type, id_param, not_found, set_element) = TESTS_ACTIONS[action]
+    records = TESTS_FIXTURES.get(region, {}).get(resource_type, [])
+
+    # Select resources by ID, failing if any ID is unknown as EC2 does.
+    ids = [value for (name, value) in sorted(params.items())
+           if re.match(r'{}\.\d+$'.format(id_param), name)]
+    if ids:
+        known = set(record['id'] for record in records)
+        unknown = [resource_id for resource_id in ids
+                   if resource_id not in known]
+        if unknown:
+            return fake_ec2_error(not_found, "The ID '{}' does not "
+                                  'exist'.format(unknown[0]))
+        records = [record for record in records if record['id'] in ids]
+
+    # Select resources by the filters given.
+    for name in sorted(params):
+        match = re.match(r'Filter\.(\d+)\.Name$', name)
+        if not match:
+            continue
+        field = TESTS_FILTERS.get(params[name])
+        if field is None:
+            return fake_ec2_error(
+                'InvalidParameterValue',
+                'The filter {} is invalid'.format(params[name]),
+            )
+        values = [value for (value_name, value) in params.items()
+                  if value_name.startswith(
+                      'Filter.{}.Value.'.format(match.group(1)),
+                  )]
+        records = [record for record in records
+                   if record.get(field) in values]
+    return (200, '<{0}Response xmlns="{1}"><requestId>fake</requestId>'
+                 '<{2}>{3}</{2}></{0}Response>'.format(
+                     action, TESTS_XMLNS, set_element,
+                     ''.join(fake_ec2_item(resource_type, record)
+                             for record in records),
+                 ))
+
+
+def fake_ec2_regions():
+    """Carry out a DescribeRegions action, return (status, XML)."""
+    return (200, '<DescribeRegionsResponse xmlns="{}">'
+                 '<requestId>fake</requestId><regionInfo>{}</regionInfo>'
+                 '</DescribeRegionsResponse>'.format(
+                     TESTS_XMLNS,
+                     ''.join('<item><regionName>{}</regionName></item>'.format(
+                         region,
+                     ) for region in sorted(TESTS_FIXTURES)),
+                 ))
+
+
+def fake_ec2_error(code, message):
+    """Return (status, XML response) for an EC2 API error."""
+    return (400, '<Response><Errors><Error><Code>{}</Code>'
+                 '<Message>{}</Message></Error></Errors>'
+                 '<RequestID>fake</RequestID></Response>'.format(
+                     code, escape(message),
+                 ))
+
+
+class FakeEc2Handler(http.server.BaseHTTPRequestHandler):
+    """Handle EC2 API requests from the AWS CLI."""
+
+    def do_POST(self):  # pylint: disable=C0103
+        """Answer an EC2 API request."""
+        length = int(self.headers.get('Content-Length', 0))
+        params = dict(urllib.parse.parse_qsl(
+            self.rfile.read(length).decode('utf-8'),
+            keep_blank_values=True,
+        ))
+
+        # NOTE: The AWS CLI signs each request with a credential that
+        # includes the region, e.g. "Credential=KEY/DATE/REGION/ec2/...".
+        match = re.search(r'Credential=[^/]*/[^/]*/([^/]*)/',
+                          self.headers.get('Authorization', ''))
+        region = match.group(1) if match else TESTS_REGION
+        action = params.get('Action', '')
+        self.server.requests = self.server.requests + 1
+        if action in TESTS_ACTIONS:
+            (status, body) = fake_ec2_describe(action, region, params)
+        elif action == 'DescribeRegions':
+            (status, body) = fake_ec2_regions()
+        else:
+            (status, body) = fake_ec2_error(
+                'UnsupportedOperation',
+                'The stand-in does not support {}'.format(action),
+            )
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=W0221
+        """Do not log each request."""
+
+
+def fake_ec2_start():
+    """Start the EC2 API stand-in on a free port, return the server."""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                             FakeEc2Handler)
+    server.daemon_threads = True
+    server.requests = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    return server
+
+
+# Functions for finding and running the test cases.
+def tests_env(url, work_dir):
+    """Return environment in which to run the AWS CLI against url."""
+    env = {name: value for (name, value) in os.environ.items()
+           if not name.startswith('AWS_')}
+    env.update({
+        'AWS_ENDPOINT_URL': url,
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+        'AWS_DEFAULT_REGION': TESTS_REGION,
+        'AWS_CONFIG_FILE': os.path.join(work_dir, 'config'),
+        'AWS_SHARED_CREDENTIALS_FILE': os.path.join(work_dir, 'credentials'),
+        'AWS_EC2_METADATA_DISABLED': 'true',
+        'AWS_PAGER': '',
+        'AWS_INVENTORY_CACHE': os.path.join(work_dir, 'cache'),
+    })
+    return env
+
+
+def tests_read_cases(test_path):
+    """Return list of test cases in a test script.
+
+    Each case is a dictionary with the name of the script, the
+    description of the case, the command to run, and whether the
+    command should succeed.
+    """
+    cases = []
+    description = ''
+    try:
+        with open(test_path, 'r') as test_f:
+            lines = test_f.readlines()
+    except OSError as err:
+        sys.exit('Cannot read {}: {}'.format(test_path, err))
+    for line in lines:
+        line = line.strip()
+        match = re.match(r'echo "--- (.*)"$', line)
+        if match:
+            description = match.group(1)
+            continue
+        if not line.startswith('sh '):
+            continue
+        words = shlex.split(line)
+        for (operator, succeed) in [('||', True), ('&&', False)]:
+            if operator in words:
+                cases.append({
+                    'script': os.path.basename(test_path),
+                    'description': description,
+                    'command': words[:words.index(operator)],
+                    'succeed': succeed,
+                })
+                break
+    return cases
+
+
+def tests_run_case(case, env):
+    """Run a test case, recording its outcome in the case."""
+    start = time.time()
+    try:
+        proc = subprocess.run(
+            case['command'],
+            cwd=TESTS_DIR,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            timeout=TESTS_TIMEOUT,
+            check=False,
+        )
+        (status, stdout, stderr) = (proc.returncode, proc.stdout,
+                                    proc.stderr)
+    except subprocess.TimeoutExpired:
+        (status, stdout, stderr) = (None, '', 'timed out')
+    case['seconds'] = time.time() - start
+    case['stdout'] = stdout
+    case['stderr'] = stderr
+    if status is None:
+        case['passed'] = False
+    elif case['succeed']:
+        case['passed'] = (status == 0 and stdout.strip() != ''
+                          and stderr.strip() == '')
+    else:
+        case['passed'] = status != 0
+    return case
+
+
+def tests_print_case(case):
+    """Print the outcome of a test case, with its output if it failed."""
+    print('{:>6.2f}s  {}  {}: {}'.format(
+        case['seconds'],
+        'PASS' if case['passed'] else 'FAIL',
+        case['script'],
+        case['description'],
+    ))
+    if case['passed']:
+        return
+    print('         $ {}'.format(' '.join(shlex.quote(word)
+                                           for word in case['command'])))
+    for line in (case['stdout'] + case['stderr']).splitlines():
+        print('         {}'.format(line))
+
+
+def tests_check_cli(env):
+    """Exit if the AWS CLI does not use the EC2 API stand-in."""
+    try:
+        proc = subprocess.run(
+            ['aws', 'ec2', 'describe-regions', '--output', 'text'],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            timeout=TESTS_TIMEOUT,
+            check=False,
+        )
+    except (OSError, subprocess.TimeoutExpired) as err:
+        sys.exit('Cannot run AWS CLI: {}'.format(err))
+    if proc.returncode != 0 or TESTS_REGION not in proc.stdout:
+        sys.exit('AWS CLI does not use $AWS_ENDPOINT_URL (version 1.29 or '
+                 '2.13 or later needed):\n{}'.format(proc.stderr.strip()))
+
+
+def get_args():
+    """Get arguments from command line or user input and return them."""
+    parser = argparse.ArgumentParser(
+        description='Run the AWS script tests against a local EC2 stand-in',
+    )
+    parser.add_argument(
+        '--workers',
+        action='store',
+        dest='workers',
+        type=int,
+        default=TESTS_WORKERS,
+        help='test cases to run at once (default {})'.format(TESTS_WORKERS),
+    )
+    parser.add_argument(
+        '--serve',
+        action='store_true',
+        dest='serve',
+        help='only run the EC2 stand-in, until interrupted',
+    )
+    parser.add_argument(
+        action='store',
+        dest='test_scripts',
+        nargs='*',
+        help='test scripts to run (default test_*_aws.sh)',
+    )
+    args = parser.parse_args()
+    if not args.test_scripts:
+        args.test_scripts = sorted(glob.glob(
+            os.path.join(TESTS_DIR, 'test_*_aws.sh'),
+        ))
+    return args
+
+
+def main():
+    """Run the AWS script tests."""
+    args = get_args()
+    server = fake_ec2_start()
+    if args.serve:
+        print('EC2 stand-in listening at {}'.format(server.url))
+        print('Use e.g. AWS_ENDPOINT_URL={} AWS_ACCESS_KEY_ID=testing '
+              'AWS_SECRET_ACCESS_KEY=testing'.format(server.url))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            return
+
+    cases = []
+    for test_path in args.test_scripts:
+        cases.extend(tests_read_cases(test_path))
+    start = time.time()
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = tests_env(server.url, work_dir)
+        tests_check_cli(env)
+
+        # Run the cases in parallel, printing each outcome as it comes.
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(args.workers, 1)) as executor:
+            futures = [executor.submit(tests_run_case, case, env)
+                       for case in cases]
+            for future in concurrent.futures.as_completed(futures):
+                tests_print_case(future.result())
+    server.shutdown()
+
+    failed = [case for case in cases if not case['passed']]
+    print()
+    print('{} cases, {} passed, {} failed in {:.1f} seconds '
+          '({} EC2 API requests)'.format(
+              len(cases), len(cases) - len(failed), len(failed),
+              time.time() - start, server.requests,
+          ))
+    if failed:
+        sys.exit(1)
+
+
+# Execute the following when this is run as a script.
+if __name__ == '__main__':
+    main()
@@ -64,8 +64,8 @@ ami=`aws ec2 describe-images \
 
 # Determine which subnet ID to use based on the specified subnet.
 echo "subnet: ${subnet}"
-subnet_id=`aws ec2 describe-subnets | \
-    jq -r '.Subnets[] | select(.CidrBlock == "'${subnet}'") | .SubnetId'`
+# NOTE: This uses the (cached) lookup script in the aws directory.
+subnet_id=`python3 ../../aws/aws_inventory.py -q -r ${REGION} -t subnet "${subnet}"`
 echo "subnet_id: ${subnet_id}"
 if [ -z $subnet_id ]
 then
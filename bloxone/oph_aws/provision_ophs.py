@@ -0,0 +1,532 @@
+#!/usr/bin/python3
+"""provision_ophs: Launch and register many BloxOne on-prem hosts on AWS.
+
+This script launches an Ubuntu 20.04 AWS EC2 instance for each host
+listed in a manifest, configured by a script passed as user data (by
+default configure_oph.sh), as launch_ubuntu_aws.sh does for one host.
+The AMI and the subnets are looked up once for all hosts, and all the
+instances are launched in parallel.  The script then waits for all the
+instances to boot, checking on all of them with one request, and then
+for all of them to register with BloxOne as on-prem hosts, looking
+them up by IP address a batch at a time.  Finally it can enable
+BloxOne applications on the registered hosts, as oph_manage.py does.
+
+The manifest is a CSV file with a header row and the columns "name"
+(the name tag for the instance), "subnet" (ID, CIDR-format address, or
+name of the subnet) and optionally "instance_type" and "disk_size" (in
+GB), e.g.
+
+  name,subnet,instance_type
+  branch-01,10.192.1.0/24,t2.medium
+  branch-02,10.192.2.0/24,
+
+The AWS region, security group, key pair, and creator tag are taken
+from the REGION, SECURITY_GROUP_ID, KEY_PAIR, and CREATOR environment
+variables (as set by ~/.aws/set-aws-variables.sh) unless specified as
+options.
+
+Example:
+
+  provision_ophs.py --enable dfp --enable dns branches.csv
+"""
+
+
+# Import the required Python modules.
+import argparse
+import concurrent.futures
+import csv
+import os
+import sys
+import time
+
+# NOTE: The AWS lookup and OPH management modules are in other
+# directories of this repository.
+PROVISION_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(PROVISION_DIR, '..', '..', 'aws'))
+sys.path.insert(0, os.path.join(PROVISION_DIR, '..', 'oph_management'))
+import aws_inventory  # pylint: disable=C0413
+import oph_manage  # pylint: disable=C0413
+
+
+# Owner and name pattern of official Canonical Ubuntu 20.04 LTS AMIs.
+UBUNTU_OWNER = '099720109477'
+UBUNTU_AMI_NAME = 'ubuntu/images/hvm-ssd/ubuntu-focal-20.04*'
+
+# Default instance type and disk size (in GB) for hosts.
+PROVISION_INSTANCE_TYPE = 't2.micro'
+PROVISION_DISK_SIZE = 32
+
+# Default number of instances to launch at once.
+PROVISION_WORKERS = 8
+
+# Instance states from which an instance will never boot.
+PROVISION_FAILED_STATES = ['shutting-down', 'terminated', 'stopping',
+                           'stopped']
+
+
+# Functions to read the manifest and look up the AMI and subnets.
+def provision_read_manifest(manifest_path):
+    """Return list of hosts to provision from the manifest."""
+    hosts = []
+    try:
+        with open(manifest_path, 'r', newline='') as manifest_f:
+            for row in csv.DictReader(manifest_f):
+                if not (row.get('name') or '').strip():
+                    continue
+                hosts.append({
+                    'name': row['name'].strip(),
+                    'subnet': (row.get('subnet') or '').strip(),
+                    'instance_type': ((row.get('instance_type') or '').strip()
+                                      or PROVISION_INSTANCE_TYPE),
+                    'disk_size': ((row.get('disk_size') or '').strip()
+                                  or str(PROVISION_DISK_SIZE)),
+                    'instance_id': None,
+                    'ip_address': None,
+                    'state': 'not launched',
+                    'oph': None,
+                    'error': None,
+                    'lookup_error': None,
+                })
+    except (OSError, csv.Error) as err:
+        sys.exit('Cannot read manifest {}: {}'.format(manifest_path, err))
+    if not hosts:
+        sys.exit('No hosts in manifest {}'.format(manifest_path))
+    names = [host['name'] for host in hosts]
+    for host in hosts:
+        if not host['subnet']:
+            sys.exit('{}: no subnet specified'.format(host['name']))
+        if names.count(host['name']) > 1:
+            sys.exit('{}: name used more than once'.format(host['name']))
+    return hosts
+
+
+def provision_find_ami(region, endpoint_url=None):
+    """Return ID of latest Ubuntu 20.04 AMI in region."""
+    output = aws_inventory.inventory_aws(
+        [
+            'describe-images',
+            '--owners', UBUNTU_OWNER,
+            '--filters', 'Name=name,Values={}'.format(UBUNTU_AMI_NAME),
+        ],
+        region,
+        endpoint_url,
+    )
+    images = sorted(output.get('Images', []),
+                    key=lambda image: image.get('CreationDate', ''))
+    if not images:
+        raise aws_inventory.InventoryError(
+            'No Ubuntu 20.04 AMI found in {}'.format(region),
+        )
+    return images[-1]['ImageId']
+
+
+def provision_find_subnets(hosts, region, endpoint_url=None):
+    """Look up the subnet ID for each host, exit if any not found."""
+    index = aws_inventory.inventory_index(aws_inventory.inventory_load(
+        region, 'subnet', endpoint_url=endpoint_url,
+    ))
+    errors = []
+    for host in hosts:
+        subnets = aws_inventory.inventory_resolve(index, host['subnet'])
+        if not subnets:
+            errors.append('{}: subnet {} not found'.format(
+                host['name'], host['subnet'],
+            ))
+        elif len(subnets) > 1:
+            errors.append('{}: multiple subnets {}, use ID'.format(
+                host['name'], host['subnet'],
+            ))
+        else:
+            host['subnet_id'] = subnets[0]['id']
+    if errors:
+        sys.exit('\n'.join(errors))
+
+
+# Functions to launch the instances and wait for them to boot.
+def provision_launch(host, settings):
+    """Launch an instance for host, recording its ID and IP address."""
+    try:
+        output = aws_inventory.inventory_aws(
+            [
+                'run-instances',
+                '--image-id', settings['ami'],
+                '--instance-type', host['instance_type'],
+                '--subnet-id', host['subnet_id'],
+                '--associate-public-ip-address',
+                '--security-group-ids', settings['security_group'],
+                '--block-device-mappings',
+                'DeviceName=/dev/sda1,Ebs={{VolumeSize={},'
+                'VolumeType=gp2}}'.format(host['disk_size']),
+                '--tag-specifications',
+                'ResourceType=instance,Tags=[{{Key=Name,Value={}}},'
+                '{{Key=creator,Value={}}},{{Key=lifecycle,Value=poc}}]'.format(
+                    host['name'], settings['creator'],
+                ),
+                '--key-name', settings['key_pair'],
+                '--user-data', 'file://{}'.format(settings['script']),
+            ],
+            settings['region'],
+            settings['endpoint_url'],
+        )
+        instance = output['Instances'][0]
+    except (aws_inventory.InventoryError, KeyError, IndexError) as err:
+        host['error'] = 'launch failed: {}'.format(err)
+        return
+    host['instance_id'] = instance['InstanceId']
+    host['ip_address'] = instance.get('PrivateIpAddress')
+    host['state'] = instance.get('State', {}).get('Name', 'pending')
+    host['launched'] = time.time()
+    print('{}: launched {}'.format(host['name'], host['instance_id']))
+
+
+def provision_wait_boot(hosts, settings, timeout, poll_interval):
+    """Wait for all launched instances to be running."""
+    deadline = time.time() + timeout
+    while True:
+        pending = {host['instance_id']: host for host in hosts
+                   if host['error'] is None and host['state'] != 'running'}
+        if not pending:
+            return
+        if time.time() > deadline:
+            for host in pending.values():
+                host['error'] = 'did not boot (state {})'.format(
+                    host['state'],
+                )
+            return
+        time.sleep(poll_interval)
+        try:
+            output = aws_inventory.inventory_aws(
+                ['describe-instances', '--instance-ids'] + sorted(pending),
+                settings['region'],
+                settings['endpoint_url'],
+            )
+        except aws_inventory.InventoryError as err:
+            print(err, file=sys.stderr)
+            continue
+        for reservation in output.get('Reservations', []):
+            for instance in reservation.get('Instances', []):
+                host = pending.get(instance['InstanceId'])
+                if host is None:
+                    continue
+                host['state'] = instance['State']['Name']
+                host['ip_address'] = (instance.get('PrivateIpAddress')
+                                      or host['ip_address'])
+                if host['state'] == 'running':
+                    host['booted'] = time.time()
+                    print('{}: running at {}'.format(
+                        host['name'], host['ip_address'],
+                    ))
+                elif host['state'] in PROVISION_FAILED_STATES:
+                    host['error'] = 'instance {}'.format(host['state'])
+
+
+# Functions to wait for the hosts to register and enable applications.
+# NOTE: The oph_manage functions exit on any BloxOne API error, so we
+# turn that into an error for the hosts concerned, rather than lose
+# track of the instances already launched.
+def provision_get_ophs(b1_handle, get_filter):
+    """Return on-prem hosts matching filter, and error if any."""
+    try:
+        return (oph_manage.b1_get_ophs(b1_handle, get_filter), None)
+    except (SystemExit, OSError) as err:
+        return ([], str(err))
+
+
+def provision_wait_register(hosts, b1_handle, timeout, poll_interval):
+    """Wait for all running instances to register as on-prem hosts.
+
+    A failed lookup is retried at the next poll, and its error is
+    reported for the hosts still not found if they never register.
+    """
+
+    # NOTE: Hosts are matched by IP address, so one without an address
+    # can never be found.
+    for host in hosts:
+        if (host['error'] is None and host['oph'] is None
+                and not host['ip_address']):
+            host['error'] = 'no private IP address to register with'
+    deadline = time.time() + timeout
+    while True:
+        pending = {host['ip_address']: host for host in hosts
+                   if host['error'] is None and host['oph'] is None}
+        if not pending:
+            return
+        if time.time() > deadline:
+            for host in pending.values():
+                host['error'] = 'did not register with BloxOne'
+                if host['lookup_error']:
+                    host['error'] = '{} ({})'.format(
+                        host['error'], host['lookup_error'],
+                    )
+            return
+        time.sleep(poll_interval)
+
+        # Look up all the hosts not yet registered, several per request.
+        errors = []
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=oph_manage.B1_LOOKUP_WORKERS) as executor:
+            for (ophs, error) in executor.map(
+                    lambda get_filter: provision_get_ophs(
+                        b1_handle, get_filter,
+                    ),
+                    oph_manage.b1_filter_chunks(sorted(pending))):
+                if error is not None:
+                    errors.append(error)
+                for oph in ophs:
+                    host = pending.get(oph.get('ip_address'))
+                    if host is not None and host['oph'] is None:
+                        host['oph'] = oph
+                        host['registered'] = time.time()
+                        print('{}: registered as {}'.format(
+                            host['name'], oph.get('display_name'),
+                        ))
+
+        # Note the latest lookup error for hosts still not found.
+        if errors:
+            print('Error looking up on-prem hosts, will retry: {}'.format(
+                errors[-1],
+            ), file=sys.stderr)
+            for host in pending.values():
+                if host['oph'] is None:
+                    host['lookup_error'] = errors[-1]
+
+
+def provision_enable(hosts, b1_handle, apps):
+    """Enable applications on all registered on-prem hosts."""
+    for host in hosts:
+        if host['oph'] is None:
+            continue
+        for app in apps:
+            try:
+                enabled = oph_manage.b1_enable_app(
+                    oph_manage.B1_APP_NAME_TO_TYPE[app],
+                    b1_handle,
+                    ip_address=host['ip_address'],
+                    oph=host['oph'],
+                )
+            except (SystemExit, OSError) as err:
+                host['error'] = 'could not enable {}: {}'.format(app, err)
+                break
+            if not enabled:
+                host['error'] = 'could not enable {}'.format(app)
+                break
+
+
+def provision_report(hosts, start):
+    """Print the outcome for each host."""
+    width = max([len('Host')] + [len(host['name']) for host in hosts])
+    print()
+    print('{:<{}}  {:<20}  {:<15}  {:>6}  {:>8}  {}'.format(
+        'Host', width, 'Instance', 'IP address', 'Boot', 'Register',
+        'Result',
+    ))
+    for host in hosts:
+        boot = ''
+        if 'booted' in host:
+            boot = '{:.0f}'.format(host['booted'] - start)
+        register = ''
+        if 'registered' in host:
+            register = '{:.0f}'.format(host['registered'] - start)
+        print('{:<{}}  {:<20}  {:<15}  {:>6}  {:>8}  {}'.format(
+            host['name'], width,
+            host['instance_id'] or '',
+            host['ip_address'] or '',
+            boot,
+            register,
+            host['error'] or 'ok',
+        ))
+
+
+def get_args():
+    """Get arguments from command line or user input and return them."""
+    parser = argparse.ArgumentParser(
+        description='Launch and register BloxOne on-prem hosts on AWS',
+    )
+    parser.add_argument(
+        '-c',
+        '--config',
+        action='store',
+        dest='config',
+        help='file with BloxOne API credentials, related information',
+    )
+    parser.add_argument(
+        '-r',
+        '--region',
+        action='store',
+        dest='region',
+        default=os.environ.get('REGION'),
+        help='AWS region (default $REGION)',
+    )
+    parser.add_argument(
+        '--security-group',
+        action='store',
+        dest='security_group',
+        default=os.environ.get('SECURITY_GROUP_ID'),
+        help='security group ID for instances (default $SECURITY_GROUP_ID)',
+    )
+    parser.add_argument(
+        '--key-pair',
+        action='store',
+        dest='key_pair',
+        default=os.environ.get('KEY_PAIR'),
+        help='key pair name for instances (default $KEY_PAIR)',
+    )
+    parser.add_argument(
+        '--creator',
+        action='store',
+        dest='creator',
+        default=os.environ.get('CREATOR', ''),
+        help='value of creator tag for instances (default $CREATOR)',
+    )
+    parser.add_argument(
+        '--script',
+        action='store',
+        dest='script',
+        default=os.path.join(PROVISION_DIR, 'configure_oph.sh'),
+        help='script to configure each host (default configure_oph.sh)',
+    )
+    parser.add_argument(
+        '--enable',
+        action='append',
+        dest='apps',
+        choices=sorted(oph_manage.B1_APP_NAME_TO_TYPE),
+        default=[],
+        help='BloxOne application to enable on each registered host '
+             '(may be given more than once)',
+    )
+    parser.add_argument(
+        '--no-register',
+        action='store_true',
+        dest='no_register',
+        help='do not wait for hosts to register with BloxOne',
+    )
+    parser.add_argument(
+        '--workers',
+        action='store',
+        dest='workers',
+        type=int,
+        default=PROVISION_WORKERS,
+        help='instances to launch at once '
+             '(default {})'.format(PROVISION_WORKERS),
+    )
+    parser.add_argument(
+        '--boot-timeout',
+        action='store',
+        dest='boot_timeout',
+        type=int,
+        default=600,
+        help='seconds to wait for instances to boot (default 600)',
+    )
+    parser.add_argument(
+        '--register-timeout',
+        action='store',
+        dest='register_timeout',
+        type=int,
+        default=1800,
+        help='seconds to wait for hosts to register (default 1800)',
+    )
+    parser.add_argument(
+        '--poll-interval',
+        action='store',
+        dest='poll_interval',
+        type=float,
+        default=15,
+        help='seconds between checks on instances and hosts (default 15)',
+    )
+    parser.add_argument(
+        '--endpoint-url',
+        action='store',
+        dest='endpoint_url',
+        help='URL of EC2 API endpoint to use instead of the default',
+    )
+    parser.add_argument(
+        'manifest',
+        action='store',
+        help='CSV file listing the hosts to launch',
+    )
+    args = parser.parse_args()
+    if args.apps and args.no_register:
+        parser.error('--enable cannot be used with --no-register')
+
+    # Check that the AWS settings needed to launch instances are known.
+    args.region = args.region or aws_inventory.inventory_default_region()
+    for (value, name) in [(args.region, 'region'),
+                          (args.security_group, 'security group'),
+                          (args.key_pair, 'key pair')]:
+        if not value:
+            parser.print_usage(sys.stderr)
+            sys.exit('No AWS {} specified'.format(name))
+    if not os.path.isfile(args.script):
+        sys.exit('Cannot find script {}'.format(args.script))
+
+    # If none specified, look for a default configuration file.
+    if not args.config:
+        if sys.platform.startswith('win32'):
+            args.config = os.path.expanduser('bloxone.ini')
+        else:
+            args.config = os.path.expanduser('~/.bloxone.ini')
+    return args
+
+
+def main():
+    """Launch and register BloxOne on-prem hosts."""
+    args = get_args()
+    start = time.time()
+    hosts = provision_read_manifest(args.manifest)
+
+    # Look up the AMI and subnets once for all hosts.
+    try:
+        ami = provision_find_ami(args.region, args.endpoint_url)
+        provision_find_subnets(hosts, args.region, args.endpoint_url)
+    except aws_inventory.InventoryError as err:
+        sys.exit(err)
+    settings = {
+        'ami': ami,
+        'region': args.region,
+        'security_group': args.security_group,
+        'key_pair': args.key_pair,
+        'creator': args.creator,
+        'script': os.path.abspath(args.script),
+        'endpoint_url': args.endpoint_url,
+    }
+
+    # Once any instances are launched, always report their IDs.
+    try:
+        # Launch all the instances and wait for them to boot.
+        print('Launching {} hosts from AMI {}'.format(len(hosts), ami))
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(args.workers, 1)) as executor:
+            list(executor.map(lambda host: provision_launch(host, settings),
+                              hosts))
+        provision_wait_boot(
+            hosts,
+            settings,
+            args.boot_timeout,
+            args.poll_interval,
+        )
+
+        # Wait for the hosts to register and enable applications.
+        if not args.no_register:
+            oph_manage.import_modules()
+            b1_handle = oph_manage.bloxone.b1oph(cfg_file=args.config)
+            provision_wait_register(
+                hosts,
+                b1_handle,
+                args.register_timeout,
+                args.poll_interval,
+            )
+            provision_enable(hosts, b1_handle, args.apps)
+    except BaseException:
+        for host in hosts:
+            if host['error'] is None:
+                host['error'] = 'provisioning stopped'
+        raise
+    finally:
+        provision_report(hosts, start)
+    if any(host['error'] for host in hosts):
+        sys.exit(1)
+
+
+# Execute the following when this is run as a script.
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,42 @@
 #!/usr/bin/python3
-"""oph_manage: Manage a BloxOne on-prem host."""
+"""oph_manage: Manage BloxOne on-prem hosts.
+
+One or more hosts may be given, by display name or IP address, on the
+command line or in a file (one per line).  A single host is looked up
+by itself.  Several hosts are looked up with a few requests, each
+combining many names and addresses in one filter and sent in parallel,
+and if many hosts are given the full list of on-prem hosts is fetched
+instead.
+
+Several configuration files (one per CSP account, or tenant) may be
+given, in which case the action is done for each tenant in parallel,
+with output labeled by tenant and a summary of the results at the end.
+API calls to each tenant are then limited to --max-rate calls per
+second (a single tenant is not limited unless --max-rate is given).
+"""
 
 
 # Import the required Python modules.
 import argparse
+import concurrent.futures
 import sys
 import os
 import json
-import bloxone
+import threading
+import time
+import urllib.parse
+
+# NOTE: The functions for recording timings and labeling output are
+# shared with the NIOS CSV scripts, in another directory of this
+# repository.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', 'nios', 'csv_scripts'))
+import trace_output  # pylint: disable=C0413
+
+# NOTE: The bloxone module takes much longer to import than the others,
+# so is only imported when first needed (see import_modules), keeping
+# --help, --version and argument errors fast.
+bloxone = None  # pylint: disable=C0103
 
 
 # BloxOne constants.
@@ -38,6 +67,19 @@ B1_APP_NAME_TO_TYPE = {
     'dns': B1_DNS_APP_TYPE,
 }
 
+# Limits for looking up several on-prem hosts at once: the maximum
+# length of each URL-encoded filter, the number of lookups to do in
+# parallel, the number of hosts above which all hosts are fetched
+# instead, and the number of hosts to fetch per request when doing so.
+B1_MAX_FILTER_LEN = 1500
+B1_LOOKUP_WORKERS = 8
+B1_INVENTORY_THRESHOLD = 200
+B1_PAGE_SIZE = 1000
+
+# Default maximum number of API calls per second for each tenant, when
+# doing several tenants at once.
+B1_MAX_RATE = 10
+
 
 # Helper functions for BloxOne API error reporting.
 def is_ipv4_address(addr):
@@ -123,15 +165,126 @@ def b1_find_oph(b1_handle, ip_address='', name=''):
     return oph
 
 
-def b1_enable_app(app_type, b1_handle, ip_address='', name=''):
+def b1_host_filter(host):
+    """Return filter term matching host by IP address or display name."""
+    if is_ipv4_address(host):
+        return 'ip_address=="{}"'.format(host)
+    return 'display_name=="{}"'.format(host)
+
+
+def b1_filter_chunks(hosts):
+    """Yield OR-combined filters matching hosts, each not too long."""
+    terms = []
+    length = 0
+    for host in hosts:
+        term = b1_host_filter(host)
+        term_len = len(urllib.parse.quote(' or ' + term))
+        if terms and length + term_len > B1_MAX_FILTER_LEN:
+            yield ' or '.join(terms)
+            terms = []
+            length = 0
+        terms.append(term)
+        length = length + term_len
+    if terms:
+        yield ' or '.join(terms)
+
+
+def b1_get_ophs(b1_handle, get_filter):
+    """Return list of on-prem hosts matching filter."""
+    resp = b1_handle.get('/on_prem_hosts', _filter=get_filter)
+    if resp.status_code != 200:
+        b1_error_exit('b1_find_ophs: error finding on-prem host(s)', resp)
+    if resp.text == '{}':
+        return []
+    return resp.json().get('result', [])
+
+
+def b1_get_all_ophs(b1_handle):
+    """Return list of all on-prem hosts, fetched a page at a time."""
+    ophs = []
+    while True:
+        resp = b1_handle.get(
+            '/on_prem_hosts',
+            _limit=B1_PAGE_SIZE,
+            _offset=len(ophs),
+        )
+        if resp.status_code != 200:
+            b1_error_exit('b1_find_ophs: error listing on-prem hosts', resp)
+        page = [] if resp.text == '{}' else resp.json().get('result', [])
+        ophs.extend(page)
+        if len(page) < B1_PAGE_SIZE:
+            return ophs
+
+
+def b1_find_ophs(b1_handle, hosts):
+    """Find on-prem hosts by (display) name or IP address.
+
+    Return a dictionary mapping each host to its on-prem host, or to {}
+    if no host or more than one host matched.
+    """
+
+    # Must have a valid BloxOne handle.
+    if not isinstance(b1_handle, bloxone.b1oph):
+        sys.exit('b1_find_ophs: First argument must be bloxone handle')
+
+    # Look for a single host by itself, all hosts if there are many of
+    # them, and otherwise look for several hosts per request, with the
+    # requests made in parallel.
+    if len(hosts) == 1:
+        host = hosts[0]
+        if is_ipv4_address(host):
+            return {host: b1_find_oph(b1_handle, ip_address=host)}
+        return {host: b1_find_oph(b1_handle, name=host)}
+    if len(hosts) > B1_INVENTORY_THRESHOLD:
+        ophs = b1_get_all_ophs(b1_handle)
+    else:
+        ophs = []
+        # Label output and timings of the lookups as for the tenant.
+        tenant = {
+            name: getattr(trace_output.LABEL_THREAD, name)
+            for name in ['label', 'tid']
+            if hasattr(trace_output.LABEL_THREAD, name)
+        }
+
+        def lookup(get_filter):
+            for (name, value) in tenant.items():
+                setattr(trace_output.LABEL_THREAD, name, value)
+            return b1_get_ophs(b1_handle, get_filter)
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=B1_LOOKUP_WORKERS) as executor:
+            for chunk_ophs in executor.map(lookup, b1_filter_chunks(hosts)):
+                ophs.extend(chunk_ophs)
+
+    # Match the hosts found against the names and IP addresses given.
+    matches = {}
+    for oph in ophs:
+        for key in [oph.get('display_name'), oph.get('ip_address')]:
+            if key and oph not in matches.setdefault(key, []):
+                matches[key].append(oph)
+    found = {}
+    for host in hosts:
+        host_ophs = matches.get(host, [])
+        found[host] = {}
+        if not host_ophs:
+            print('{}: no on-prem hosts match'.format(host), file=sys.stderr)
+        elif len(host_ophs) > 1:
+            print('{}: multiple hosts match'.format(host), file=sys.stderr)
+        else:
+            found[host] = host_ophs[0]
+    return found
+
+
+def b1_enable_app(app_type, b1_handle, ip_address='', name='', oph=None):
     """Enable an application on an on-prem host."""
 
     # Must be for a supported application type.
     if app_type not in B1_SUPPORTED_APP_TYPES:
         sys.exit('b1_enable_app: unsupported application type')
 
-    # Look for the on-prem host.
-    oph = b1_find_oph(b1_handle, ip_address, name)
+    # Look for the on-prem host, unless already found.
+    if oph is None:
+        oph = b1_find_oph(b1_handle, ip_address, name)
     if oph == {}:
         return False
 
@@ -168,15 +321,16 @@ def b1_enable_app(app_type, b1_handle, ip_address='', name=''):
     return True
 
 
-def b1_disable_app(app_type, b1_handle, ip_address='', name=''):
+def b1_disable_app(app_type, b1_handle, ip_address='', name='', oph=None):
     """Disable an application on an on-prem host."""
 
     # Must be for a supported application type.
     if app_type not in B1_SUPPORTED_APP_TYPES:
         sys.exit('b1_disable_app: unsupported application type')
 
-    # Look for the on-prem host.
-    oph = b1_find_oph(b1_handle, ip_address, name)
+    # Look for the on-prem host, unless already found.
+    if oph is None:
+        oph = b1_find_oph(b1_handle, ip_address, name)
     if oph == {}:
         return False
 
@@ -218,15 +372,16 @@ def b1_disable_app(app_type, b1_handle, ip_address='', name=''):
     return True
 
 
-def b1_start_app(app_type, b1_handle, ip_address='', name=''):
+def b1_start_app(app_type, b1_handle, ip_address='', name='', oph=None):
     """Start an (already-enabled) application on an on-prem host."""
 
     # Must be for a supported application type.
     if app_type not in B1_SUPPORTED_APP_TYPES:
         sys.exit('b1_enable_app: unsupported application type')
 
-    # Look for the on-prem host.
-    oph = b1_find_oph(b1_handle, ip_address, name)
+    # Look for the on-prem host, unless already found.
+    if oph is None:
+        oph = b1_find_oph(b1_handle, ip_address, name)
     if oph == {}:
         return False
 
@@ -269,15 +424,16 @@ def b1_start_app(app_type, b1_handle, ip_address='', name=''):
     return True
 
 
-def b1_stop_app(app_type, b1_handle, ip_address='', name=''):
+def b1_stop_app(app_type, b1_handle, ip_address='', name='', oph=None):
     """Stop (but not disable) an application on an on-prem host."""
 
     # Must be for a supported application type.
     if app_type not in B1_SUPPORTED_APP_TYPES:
         sys.exit('b1_enable_app: unsupported application type')
 
-    # Look for the on-prem host.
-    oph = b1_find_oph(b1_handle, ip_address, name)
+    # Look for the on-prem host, unless already found.
+    if oph is None:
+        oph = b1_find_oph(b1_handle, ip_address, name)
     if oph == {}:
         return False
 
@@ -321,12 +477,101 @@ def b1_stop_app(app_type, b1_handle, ip_address='', name=''):
     return True
 
 
+# Functions to do an action for several tenants at once.
+def limit_handle(b1_handle, max_rate):
+    """Limit API calls made using b1_handle to max_rate per second."""
+    if not max_rate:
+        return
+    lock = threading.Lock()
+    state = {'next': time.time()}
+
+    def limited(method):
+        def call(objpath, *args, **kwargs):
+            with lock:
+                now = time.time()
+                wait = state['next'] - now
+                state['next'] = max(now, state['next']) + 1.0 / max_rate
+            if wait > 0:
+                time.sleep(wait)
+            return method(objpath, *args, **kwargs)
+        return call
+
+    for method_name in ['get', 'create', 'update', 'delete']:
+        method = getattr(b1_handle, method_name, None)
+        if method is not None:
+            setattr(b1_handle, method_name, limited(method))
+
+
+def tenant_name(config_file):
+    """Return a short name for the tenant using config_file."""
+    return os.path.splitext(os.path.basename(config_file))[0].lstrip('.')
+
+
+def manage_tenants(tenants, action, app, hosts, max_rate):
+    """Do an action for each tenant in parallel, and report the results.
+
+    Return True if the action succeeded for all hosts of all tenants.
+    """
+    import_modules()  # Once, rather than in each thread
+    names = [name for (name, _) in tenants]
+    width = max([len('Tenant')] + [len(name) for name in names])
+
+    def run(index, tenant):
+        (name, config_file) = tenant
+        trace_output.LABEL_THREAD.label = '[{:<{}}] '.format(name, width)
+        trace_output.LABEL_THREAD.tid = index + 1
+        trace_output.TRACE['threads'][index + 1] = name
+        start = time.time()
+        try:
+            results = manage_app(config_file, action, app, hosts, max_rate)
+            done = sum(1 for success in results.values() if success)
+            result = '{} of {} hosts done'.format(done, len(results))
+            ok = done == len(results)
+        except SystemExit as err:
+            result = 'error: {}'.format(err.code)
+            ok = False
+        except Exception as err:  # pylint: disable=broad-except
+            # Report the error for this tenant, and keep going for the
+            # others.
+            result = 'error: {!r}'.format(err)
+            ok = False
+        return (result, time.time() - start, ok)
+
+    # Label the output for each tenant with the tenant's name.
+    (stdout, stderr) = (sys.stdout, sys.stderr)
+    sys.stdout = trace_output.LabeledOutput(stdout)
+    sys.stderr = trace_output.LabeledOutput(stderr)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(tenants)) as executor:
+            results = list(executor.map(run, range(len(tenants)), tenants))
+    finally:
+        (sys.stdout, sys.stderr) = (stdout, stderr)
+
+    # Show the results for each tenant.
+    print()
+    print('{:<{}}  {:>8}  {}'.format('Tenant', width, 'Seconds', 'Result'))
+    for (name, (result, seconds, _)) in zip(names, results):
+        print('{:<{}}  {:>8.1f}  {}'.format(name, width, seconds, result))
+    return all(ok for (_, _, ok) in results)
+
+
+def import_modules():
+    """Import the bloxone module, if not already done."""
+    global bloxone  # pylint: disable=C0103,W0603
+    if bloxone is not None:
+        return
+    with trace_output.trace_span('import modules', 'startup',
+                                 modules='bloxone'):
+        import bloxone  # pylint: disable=C0415,W0621
+
+
 def get_args():
     """Get arguments from command line or user input and return them."""
 
     # Prepare to parse the command line options (if present).
     parser = argparse.ArgumentParser(
-        description='Enable/disable/start/stop app on a BloxOne on-prem host',
+        description='Enable/disable/start/stop app on BloxOne on-prem hosts',
     )
 
     # Add an option to print the version of the script.
@@ -341,12 +586,46 @@ def get_args():
     parser.add_argument(
         '-c',
         '--config',
+        action='append',
+        dest='configs',
+        help='BloxOne configuration file with API key, optionally as '
+             'NAME=FILE to name the tenant (repeat for several tenants)',
+    )
+    parser.add_argument(
+        '--max-rate',
+        action='store',
+        dest='max_rate',
+        type=float,
+        # No default, value of None means limit only several tenants.
+        help='maximum API calls per second per tenant, 0 for no limit '
+             '(default {} with several tenants, otherwise no '
+             'limit)'.format(B1_MAX_RATE),
+    )
+
+    # Add options for recording timings and profiling the script.
+    parser.add_argument(
+        '--profile',
+        action='store',
+        dest='profile',
+        help='file in which to write a trace of phase and API call timings',
+    )
+    parser.add_argument(
+        '--profile-stats',
         action='store',
-        dest='config',
-        help='file with BloxOne API credentials, related information',
+        dest='profile_stats',
+        help='file in which to write cProfile statistics',
     )
 
-    # Add positional options for action, app, and host.
+    # Add an option for reading host names or IP addresses from a file.
+    parser.add_argument(
+        '-f',
+        '--hosts-file',
+        action='store',
+        dest='hosts_file',
+        help='file with display names or IP addresses, one per line',
+    )
+
+    # Add positional options for action, app, and hosts.
     parser.add_argument(
         'action',
         action='store',
@@ -358,9 +637,10 @@ def get_args():
         help='BloxOne application (DFP, CDC, DHCP, DNS)',
     )
     parser.add_argument(
-        'host',
+        'hosts',
         action='store',
-        help='display name or IP address of the on-prem host',
+        nargs='*',
+        help='display names or IP addresses of the on-prem hosts',
     )
 
     # Parse the command line according to the definitions above.
@@ -381,72 +661,106 @@ def get_args():
         sys.exit(1)
 
     # If none specified, look for a default configuration file.
-    if args.config:
-        config_file = args.config
+    if args.configs:
+        configs = args.configs
     elif sys.platform.startswith('win32'):
-        config_file = os.path.expanduser('bloxone.ini')
-    else:
-        config_file = os.path.expanduser('~/.bloxone.ini')
-
-    # Figure out whether the host was specified as name or IP address.
-    if is_ipv4_address(args.host):
-        ip_address = args.host
-        name = ''
+        configs = [os.path.expanduser('bloxone.ini')]
     else:
-        ip_address = ''
-        name = args.host
-    return (config_file, action, app, name, ip_address)
+        configs = [os.path.expanduser('~/.bloxone.ini')]
+
+    # Name each tenant, by default after its configuration file.
+    tenants = []
+    for config in configs:
+        (name, sep, config_file) = config.partition('=')
+        if not sep:
+            (name, config_file) = (tenant_name(config), config)
+        if name in [tenant for (tenant, _) in tenants]:
+            print('Duplicate tenant name {}'.format(name))
+            parser.print_usage()
+            sys.exit(1)
+        tenants.append((name, config_file))
+
+    # Limit API calls only when doing several tenants, unless asked.
+    max_rate = args.max_rate
+    if max_rate is None:
+        max_rate = B1_MAX_RATE if len(tenants) > 1 else 0
+
+    # Get the hosts from the command line and/or the hosts file,
+    # dropping any duplicates.
+    hosts = list(args.hosts)
+    if args.hosts_file:
+        try:
+            with open(args.hosts_file, 'r') as hosts_f:
+                hosts.extend(line.strip() for line in hosts_f)
+        except OSError as err:
+            print(err, file=sys.stderr)
+            sys.exit('Cannot read hosts file {}'.format(args.hosts_file))
+    hosts = list(dict.fromkeys(host for host in hosts if host))
+    if not hosts:
+        print('No on-prem hosts specified')
+        parser.print_usage()
+        sys.exit(1)
+    return (tenants, action, app, hosts, max_rate,
+            args.profile, args.profile_stats)
 
 
 # Main program.
-def main():
-    """Enable/disable a BloxOne app on an on-prem host"""
-    (config_file, action, app, name, ip_address) = get_args()
-    b1_handle = bloxone.b1oph(cfg_file=config_file)
-    if action == 'enable':
-        success = b1_enable_app(
-            B1_APP_NAME_TO_TYPE[app],
-            b1_handle,
-            name=name,
-            ip_address=ip_address,
-        )
-        if success:
-            print('{}{}: {} enabled'.format(name, ip_address, app))
+def manage_app(config_file, action, app, hosts, max_rate=None):
+    """Enable/disable/start/stop a BloxOne app on on-prem hosts.
+
+    Return a dictionary mapping each host to True if successful.
+    """
+    import_modules()
+    with trace_output.trace_span('read config'):
+        b1_handle = bloxone.b1oph(cfg_file=config_file)
+    trace_output.trace_handle(b1_handle)
+    limit_handle(b1_handle, max_rate)
+    with trace_output.trace_span('find hosts', hosts=len(hosts)):
+        ophs = b1_find_ophs(b1_handle, hosts)
+    (b1_action, done) = {
+        'enable': (b1_enable_app, 'enabled'),
+        'disable': (b1_disable_app, 'disabled'),
+        'start': (b1_start_app, 'started'),
+        'stop': (b1_stop_app, 'stopped'),
+    }[action]
+    results = {}
+    for host in hosts:
+        # Figure out whether the host was specified as name or IP address.
+        if is_ipv4_address(host):
+            (name, ip_address) = ('', host)
         else:
-            print('{}{}: could not enable {}'.format(name, ip_address, app))
-    elif action == 'disable':
-        success = b1_disable_app(
+            (name, ip_address) = (host, '')
+        success = b1_action(
             B1_APP_NAME_TO_TYPE[app],
             b1_handle,
             name=name,
             ip_address=ip_address,
+            oph=ophs[host],
         )
         if success:
-            print('{}{}: {} disabled'.format(name, ip_address, app))
+            print('{}: {} {}'.format(host, app, done))
         else:
-            print('{}{}: could not disable {}'.format(name, ip_address, app))
-    elif action == 'start':
-        success = b1_start_app(
-            B1_APP_NAME_TO_TYPE[app],
-            b1_handle,
-            name=name,
-            ip_address=ip_address,
-        )
-        if success:
-            print('{}{}: {} started'.format(name, ip_address, app))
-        else:
-            print('{}{}: could not start {}'.format(name, ip_address, app))
-    elif action == 'stop':
-        success = b1_stop_app(
-            B1_APP_NAME_TO_TYPE[app],
-            b1_handle,
-            name=name,
-            ip_address=ip_address,
-        )
-        if success:
-            print('{}{}: {} stopped'.format(name, ip_address, app))
-        else:
-            print('{}{}: could not stop {}'.format(name, ip_address, app))
+            print('{}: could not {} {}'.format(host, action, app))
+        results[host] = success
+    return results
+
+
+def main():
+    """Enable/disable a BloxOne app on on-prem hosts"""
+    (tenants, action, app, hosts, max_rate,
+     trace_path, stats_path) = get_args()
+    profiler = trace_output.trace_start(trace_path, stats_path)
+    try:
+        with trace_output.trace_span('{} {}'.format(action, app)):
+            if len(tenants) == 1:
+                results = manage_app(tenants[0][1], action, app, hosts,
+                                     max_rate)
+                if not all(results.values()):
+                    sys.exit(1)
+            elif not manage_tenants(tenants, action, app, hosts, max_rate):
+                sys.exit(1)
+    finally:
+        trace_output.trace_finish(trace_path, stats_path, profiler)
 
 
 # Execute the following when this is run as a script.
@@ -7,7 +7,17 @@ import argparse
 import sys
 import os
 import json
-import bloxone
+
+# NOTE: The functions for recording timings are shared with the NIOS
+# CSV scripts, in another directory of this repository.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', 'nios', 'csv_scripts'))
+import trace_output  # pylint: disable=C0413
+
+# NOTE: The bloxone module takes much longer to import than the others,
+# so is only imported when first needed (see import_modules), keeping
+# --help, --version and argument errors fast.
+bloxone = None  # pylint: disable=C0103
 
 
 # BloxOne constants.
@@ -150,6 +160,16 @@ def b1_rename_oph(b1_handle, ip_address='', name='', newname=''):
     return True
 
 
+def import_modules():
+    """Import the bloxone module, if not already done."""
+    global bloxone  # pylint: disable=C0103,W0603
+    if bloxone is not None:
+        return
+    with trace_output.trace_span('import modules', 'startup',
+                                 modules='bloxone'):
+        import bloxone  # pylint: disable=C0415,W0621
+
+
 def get_args():
     """Get arguments from command line or user input and return them."""
 
@@ -175,6 +195,20 @@ def get_args():
         help='file with BloxOne API credentials, related information',
     )
 
+    # Add options for recording timings and profiling the script.
+    parser.add_argument(
+        '--profile',
+        action='store',
+        dest='profile',
+        help='file in which to write a trace of phase and API call timings',
+    )
+    parser.add_argument(
+        '--profile-stats',
+        action='store',
+        dest='profile_stats',
+        help='file in which to write cProfile statistics',
+    )
+
     # Add positional options for host IP address/old name and new name.
     parser.add_argument(
         'host',
@@ -209,14 +243,17 @@ def get_args():
     # Get the new name.
     newname = args.newname
 
-    return (config_file, name, ip_address, newname)
+    return (config_file, name, ip_address, newname,
+            args.profile, args.profile_stats)
 
 
 # Main program.
-def main():
-    """Rename an on-prem host"""
-    (config_file, name, ip_address, newname) = get_args()
-    b1_handle = bloxone.b1oph(cfg_file=config_file)
+def rename_host(config_file, name, ip_address, newname):
+    """Rename an on-prem host."""
+    import_modules()
+    with trace_output.trace_span('read config'):
+        b1_handle = bloxone.b1oph(cfg_file=config_file)
+    trace_output.trace_handle(b1_handle)
     success = b1_rename_oph(
             b1_handle,
             name=name,
@@ -229,6 +266,18 @@ def main():
         print('{}{}: could not rename to {}'.format(name, ip_address, newname))
 
 
+def main():
+    """Rename an on-prem host"""
+    (config_file, name, ip_address, newname,
+     trace_path, stats_path) = get_args()
+    profiler = trace_output.trace_start(trace_path, stats_path)
+    try:
+        with trace_output.trace_span('rename host'):
+            rename_host(config_file, name, ip_address, newname)
+    finally:
+        trace_output.trace_finish(trace_path, stats_path, profiler)
+
+
 # Execute the following when this is run as a script.
 if __name__ == '__main__':
     main()
@@ -0,0 +1,514 @@
+"""Import Infoblox data objects from CSV files using asyncio.
+
+This module provides asynchronous versions of the CSV import functions
+in import_csv.py, for use by programs that need to run several CSV
+imports at once, against one grid or several, from a single event
+loop.  Unlike the functions in import_csv.py, these functions raise
+exceptions (IbError or one of its subclasses) instead of exiting.
+
+A typical use looks like this:
+
+  grid = await ib_async_init(None, 'alice')
+  result = await ib_async_csv_import(grid, 'networks.csv')
+  if result['error_log']:
+      print('See {} for errors'.format(result['error_log']))
+
+All imports for a given grid share the grid's HTTP session, and thus
+its pool of keep-alive connections.  The blocking HTTP calls are run in
+the event loop's default executor (or a caller-supplied one), while the
+waits between progress checks are done with asyncio.sleep(), so that
+an import can be cancelled at any time.  (Cancelling an import stops
+this module from tracking it, but does not stop the import task on the
+grid.)
+
+When run as a script, this module imports several CSV files at once
+into the same grid.  It uses the same Infoblox configuration file as
+import_csv.py.
+"""
+
+# Import the required Python modules.
+import argparse
+import csv
+import functools
+import json
+import os
+import tempfile
+import import_csv
+
+# NOTE: The asyncio and requests modules take much longer to import
+# than the others, so are only imported when first needed (see
+# import_modules), keeping --help, --version and argument errors fast.
+# NOTE: Must disable pylint E1101 error when checking requests.codes.
+asyncio = None  # pylint: disable=C0103
+requests = None  # pylint: disable=C0103
+
+
+# Define exceptions raised by the functions below.
+class IbError(Exception):
+    """Error connecting to a grid or reported by the grid."""
+
+    def __init__(self, msg, rsp=None):
+        if rsp is not None:
+            msg = '{}: HTTP error {} ({}): {}'.format(
+                msg,
+                rsp.status_code,
+                rsp.reason,
+                import_csv.ib_api_error_msg(rsp),
+            )
+        super().__init__(msg)
+        self.rsp = rsp
+
+
+class IbTimeoutError(IbError):
+    """CSV import task did not complete in the time allowed."""
+
+    def __init__(self, msg, import_ref, import_id):
+        super().__init__(msg)
+        self.import_ref = import_ref
+        self.import_id = import_id
+
+
+# Define asynchronous Infoblox WAPI-related functions.
+async def ib_async_call(grid, func, *args, **kwargs):
+    """Run blocking func in grid's executor, return its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        grid['executor'],
+        functools.partial(func, *args, **kwargs),
+    )
+
+
+async def ib_async_authenticate(grid):
+    """Access grid, save auth cookie and reference for later use."""
+    try:
+        rsp = await ib_async_call(grid, import_csv.ib_login, grid)
+    except requests.exceptions.RequestException as err:
+        raise IbError(
+            'Error connecting to grid at "{}": {}'.format(grid['url'], err)
+        ) from err
+    if rsp.status_code != requests.codes.ok:  # pylint: disable=E1101
+        raise IbError(
+            'Cannot connect to grid at "{}"'.format(grid['url']),
+            rsp,
+        )
+    grid['auth_cookie'] = rsp.cookies['ibapauth']
+    grid['ref'] = rsp.json()[0]['_ref']
+    import_csv.ib_set_auth_cookie(grid)
+    await ib_async_call(grid, import_csv.ib_write_auth_cache, grid)
+
+
+async def ib_async_request(grid, msg, method, url, **kwargs):
+    """Make a WAPI request in grid's session, return the response.
+
+    Raise IbError with msg if the request fails.  If the grid rejects
+    the auth cookie then authenticate again and retry the request once.
+    """
+    cookie = grid['auth_cookie']
+    try:
+        rsp = await ib_async_call(
+            grid,
+            grid['session'].request,
+            method,
+            url,
+            **kwargs
+        )
+        # pylint: disable=E1101
+        if rsp.status_code == requests.codes.unauthorized:
+            rsp.close()
+
+            # Only one request needs to log in again for all of them.
+            async with grid['auth_lock']:
+                if grid['auth_cookie'] == cookie:
+                    await ib_async_authenticate(grid)
+            rsp = await ib_async_call(
+                grid,
+                grid['session'].request,
+                method,
+                url,
+                **kwargs
+            )
+    except requests.exceptions.RequestException as err:
+        raise IbError('{}: {}'.format(msg, err)) from err
+    return rsp
+
+
+def import_modules():
+    """Import the asyncio and requests modules, if not already done."""
+    global asyncio, requests  # pylint: disable=C0103,W0603
+    if asyncio is None:
+        import asyncio  # pylint: disable=C0415,W0621
+    import_csv.import_modules()
+    requests = import_csv.requests
+
+
+async def ib_async_init(ib_config, ib_profile, auth_cache=None,
+                        executor=None):
+    """Make first WAPI call, return grid object for future use."""
+    import_modules()
+
+    # NOTE: The configuration file functions exit on error, so we turn
+    # that into an exception.
+    try:
+        config_file = import_csv.ib_get_config_location(ib_config)
+        grid = import_csv.ib_get_config_info(config_file, ib_profile)
+    except SystemExit as err:
+        raise IbError(str(err.code)) from err
+    grid['auth_cache'] = auth_cache
+    grid['executor'] = executor
+    grid['auth_lock'] = asyncio.Lock()
+    grid['session'] = import_csv.ib_session(grid)
+
+    # Reuse a cached auth cookie if we have one, otherwise log in.
+    (grid['auth_cookie'], grid['ref']) = import_csv.ib_read_auth_cache(grid)
+    if grid['auth_cookie'] is None:
+        await ib_async_authenticate(grid)
+    else:
+        import_csv.ib_set_auth_cookie(grid)
+    return grid
+
+
+async def ib_async_csv_upload(grid, csv_path):
+    """Upload csv_path to grid, return the upload token."""
+
+    # Make sure the CSV import file (or its parts) exist.
+    try:
+        upload_body = import_csv.CsvUploadBody(csv_path)
+    except OSError as err:
+        raise IbError(
+            'Error opening CSV file {}: {}'.format(csv_path, err)
+        ) from err
+
+    # Initiate a file upload operation.
+    req_params = {
+        '_function': 'uploadinit',
+        'filename': upload_body.filename,
+    }
+    rsp = await ib_async_request(
+        grid,
+        'Error initiating upload of CSV file {}'.format(csv_path),
+        'POST',
+        grid['url'] + 'fileop',
+        params=req_params,
+    )
+    if rsp.status_code != requests.codes.ok:  # pylint: disable=E1101
+        raise IbError(
+            'Cannot initiate upload of CSV file {}'.format(csv_path),
+            rsp,
+        )
+    # NOTE: This WAPI call returns a single dictionary.
+    result = rsp.json()
+
+    # Perform the actual upload, streaming the file data as form data
+    # rather than building the whole request body in memory.
+    # NOTE: This WAPI call does NOT return a JSON result.
+    try:
+        rsp = await ib_async_request(
+            grid,
+            'Error uploading CSV file {}'.format(csv_path),
+            'POST',
+            result['url'],
+            params={'name': upload_body.filename},
+            data=upload_body,
+            headers={'Content-Type': upload_body.content_type},
+        )
+    except OSError as err:
+        raise IbError(
+            'Error reading CSV file {}: {}'.format(csv_path, err)
+        ) from err
+    if rsp.status_code != requests.codes.ok:  # pylint: disable=E1101
+        raise IbError('Cannot upload CSV file {}'.format(csv_path), rsp)
+    return result['token']
+
+
+async def ib_async_csv_start(grid, upload_token, operation='INSERT'):
+    """Start import of uploaded file, return import task ref and ID."""
+    req_params = {
+        'token': upload_token,
+        'doimport': True,
+        'on_error': 'CONTINUE',
+        'operation': operation,
+        'update_method': 'OVERRIDE'
+    }
+    rsp = await ib_async_request(
+        grid,
+        'Error starting CSV import',
+        'POST',
+        grid['url'] + 'fileop?_function=csv_import',
+        params=req_params,
+    )
+    if rsp.status_code != requests.codes.ok:  # pylint: disable=E1101
+        raise IbError('Cannot start CSV import', rsp)
+    # NOTE: This WAPI call returns a single dictionary.
+    result = rsp.json()
+    return (
+        result['csv_import_task']['_ref'],
+        result['csv_import_task']['import_id'],
+    )
+
+
+async def ib_async_import_progress(grid, import_ref, import_id, timeout,
+                                   poll_interval=30, progress=None):
+    """Wait for import_ref to complete, return the final task status.
+
+    If progress is not None, call it with the task status (a dictionary
+    of csvimporttask fields) each time it is checked.  Raise
+    IbTimeoutError if the task does not complete in timeout seconds.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        rsp = await ib_async_request(
+            grid,
+            'Error checking CSV task {}'.format(import_ref),
+            'GET',
+            grid['url'] + import_ref,
+        )
+        if rsp.status_code != requests.codes.ok:  # pylint: disable=E1101
+            raise IbError(
+                'Cannot check status of CSV task {}'.format(import_ref),
+                rsp,
+            )
+        # NOTE: This WAPI call returns a single dictionary.
+        result = rsp.json()
+        if progress is not None:
+            progress(result)
+        if 'end_time' in result:
+            return result
+        if loop.time() + poll_interval > deadline:
+            raise IbTimeoutError(
+                'Import did not complete in {} seconds'.format(timeout),
+                import_ref,
+                import_id,
+            )
+        await asyncio.sleep(poll_interval)
+
+
+def ib_download_error_log(grid, csv_url):
+    """Stream CSV error log at csv_url to disk, return its pathname."""
+    req_headers = {'Content-type': 'application/force-download'}
+    rsp = grid['session'].get(csv_url, headers=req_headers, stream=True)
+    try:
+        if rsp.status_code != requests.codes.ok:  # pylint: disable=E1101
+            raise IbError('Cannot download CSV error log', rsp)
+        (csv_fd, csv_fn) = tempfile.mkstemp('.csv')
+        with os.fdopen(csv_fd, 'wb') as csv_output:
+            summary = import_csv.csv_analyze_error_log(
+                rsp.iter_content(chunk_size=import_csv.IB_CHUNK_SIZE),
+                csv_output,
+                import_csv.csv_retry_path(csv_fn),
+            )
+    finally:
+        rsp.close()
+    return (csv_fn, summary)
+
+
+async def ib_async_csv_error_log(grid, import_id):
+    """Download CSV error log for import_id, return pathname and summary.
+
+    The pathname is blank if no error log was produced.  The summary
+    maps (object type, error message) to the number of failed rows.
+    """
+
+    # Request download of the CSV error log.
+    rsp = await ib_async_request(
+        grid,
+        'Error requesting error log for CSV import {}'.format(import_id),
+        'POST',
+        grid['url'] + 'fileop',
+        params={'_function': 'csv_error_log'},
+        data=json.dumps({'import_id': import_id}),
+    )
+    if rsp.status_code == requests.codes.not_found:  # pylint: disable=E1101
+        return ('', {})  # No error log was produced
+    if rsp.status_code != requests.codes.ok:  # pylint: disable=E1101
+        raise IbError(
+            'Cannot request error log for CSV import {}'.format(import_id),
+            rsp,
+        )
+    # NOTE: This WAPI call returns a single dictionary.
+    result = rsp.json()
+
+    # Download the error log contents using the provided URL.
+    try:
+        (csv_fn, summary) = await ib_async_call(
+            grid,
+            ib_download_error_log,
+            grid,
+            result['url'],
+        )
+    except (OSError, csv.Error, ValueError,
+            requests.exceptions.RequestException) as err:
+        raise IbError(
+            'Error downloading error log for CSV import {}: {}'.format(
+                import_id,
+                err,
+            )
+        ) from err
+
+    # Tell Infoblox system the download is complete.
+    rsp = await ib_async_request(
+        grid,
+        'Error completing error log download for CSV import {}'.format(
+            import_id,
+        ),
+        'POST',
+        grid['url'] + 'fileop',
+        params={'_function': 'downloadcomplete'},
+        data=json.dumps({'token': result['token']}),
+    )
+    if rsp.status_code != requests.codes.ok:  # pylint: disable=E1101
+        raise IbError(
+            ('Cannot complete error log download for '
+             'CSV import {}').format(import_id),
+            rsp,
+        )
+    return (csv_fn, summary)
+
+
+async def ib_async_csv_import(grid, csv_path, timeout=1800,
+                              operation='INSERT', poll_interval=30,
+                              progress=None):
+    """Import contents of csv_path into grid, return the results.
+
+    The results are a dictionary with the import ID, the number of
+    lines processed and failed, the pathname of the CSV error log (blank
+    if there were no errors), and a summary of the errors.
+    """
+    upload_token = await ib_async_csv_upload(grid, csv_path)
+    (import_ref, import_id) = await ib_async_csv_start(
+        grid,
+        upload_token,
+        operation,
+    )
+    status = await ib_async_import_progress(
+        grid,
+        import_ref,
+        import_id,
+        timeout,
+        poll_interval,
+        progress,
+    )
+    results = {
+        'import_id': import_id,
+        'lines_processed': status['lines_processed'],
+        'lines_failed': status['lines_failed'],
+        'error_log': '',
+        'error_summary': {},
+    }
+    if status['lines_failed'] > 0:
+        (results['error_log'], results['error_summary']) = (
+            await ib_async_csv_error_log(grid, import_id)
+        )
+    return results
+
+
+def get_cmd_args():
+    """Get arguments from command line or user input and return them."""
+    parser = argparse.ArgumentParser(
+        description='Import several CSV files into a grid at once',
+    )
+
+    # Add an option to print the version of the script.
+    parser.add_argument(
+        '-v',
+        '--version',
+        action='version',
+        version='%(prog)s 0.9',
+    )
+
+    # Add options for specifying the location of the configuration file
+    # and the user profile to be used within the configuration file.
+    parser.add_argument(
+        '--ib-config',
+        action='store',
+        dest='ib_config',
+        # No default, value of None means look for the file.
+        help='file with Infoblox credentials and WAPI info',
+    )
+    parser.add_argument(
+        '--ib-profile',
+        action='store',
+        dest='ib_profile',
+        # No default, value of None means use first section
+        # (other than the DEFAULT section, if present).
+        help='profile in Infoblox configuration file',
+    )
+    parser.add_argument(
+        '--auth-cache',
+        action='store',
+        dest='auth_cache',
+        # No default, value of None means do not cache the auth cookie.
+        help='file in which to cache the WAPI authentication cookie',
+    )
+
+    parser.add_argument(
+        '--timeout',
+        action='store',
+        dest='timeout',
+        type=int,
+        default=1800,
+        help='maximum time to let each job run (default 1800 seconds)',
+    )
+
+    # Add positional argument for specifying the CSV import files.
+    parser.add_argument(
+        action='store',
+        dest='csv_paths',
+        nargs='+',
+        help='Pathnames of CSV import files',
+    )
+
+    # Parse the command line and return argument values as a dictionary.
+    args = parser.parse_args()
+    return vars(args)
+
+
+async def async_main(cmd_args):
+    """Import the CSV files concurrently, return # of failed imports."""
+    grid = await ib_async_init(
+        cmd_args['ib_config'],
+        cmd_args['ib_profile'],
+        cmd_args['auth_cache'],
+    )
+    results = await asyncio.gather(
+        *[
+            ib_async_csv_import(grid, csv_path, cmd_args['timeout'])
+            for csv_path in cmd_args['csv_paths']
+        ],
+        return_exceptions=True,
+    )
+    grid['session'].close()
+
+    # Report the results for each file.
+    failures = 0
+    for (csv_path, result) in zip(cmd_args['csv_paths'], results):
+        if isinstance(result, Exception):
+            print('{}: {}'.format(csv_path, result))
+            failures = failures + 1
+            continue
+        print('{}: imported {} lines ({} failed)'.format(
+            csv_path,
+            result['lines_processed'],
+            result['lines_failed'],
+        ))
+        if import_csv.is_nonblank_string(result['error_log']):
+            import_csv.csv_print_error_summary(result['error_summary'])
+            print('See {} for CSV import errors'.format(result['error_log']))
+    return failures
+
+
+def main():
+    """Main program."""
+    cmd_args = get_cmd_args()
+    import_modules()
+    try:
+        failures = asyncio.run(async_main(cmd_args))
+    except IbError as err:
+        import_csv.error_exit(str(err))
+    if failures:
+        import_csv.error_exit('{} imports failed'.format(failures))
+
+
+# Execute the following when this is run as a script.
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+"""Write Infoblox data objects from a CSV file directly via the WAPI.
+
+This module is the batch mode of import_csv.py: rather than uploading
+a (small) CSV file to the grid's CSV job manager, it converts each row
+to the WAPI object it describes and creates, updates, or deletes the
+objects directly, in batches of several objects per WAPI multi-object
+request, sent in parallel.  Failed rows are reported in an error log
+and retry file in the same format as for CSV imports.
+
+Only commonly used object types and fields are supported (see
+IB_BATCH_OBJECTS); files containing others are imported as CSV jobs.
+"""
+
+# Import the required Python modules.
+import concurrent.futures
+import csv
+import ipaddress
+import json
+import os
+import tempfile
+import import_csv
+
+
+# WAPI object type and fields to use for each CSV object type when
+# writing objects directly, and the WAPI fields that identify an object.
+# NOTE: Values for other CSV fields (except extensible attributes) are
+# not supported; files containing them are imported as CSV jobs.
+IB_BATCH_OBJECTS = {
+    'arecord': (
+        'record:a',
+        {'fqdn': 'name', 'address': 'ipv4addr', 'view': 'view',
+         'comment': 'comment', 'ttl': 'ttl', 'disabled': 'disable'},
+        ['name', 'ipv4addr', 'view'],
+    ),
+    'aaaarecord': (
+        'record:aaaa',
+        {'fqdn': 'name', 'address': 'ipv6addr', 'view': 'view',
+         'comment': 'comment', 'ttl': 'ttl', 'disabled': 'disable'},
+        ['name', 'ipv6addr', 'view'],
+    ),
+    'cnamerecord': (
+        'record:cname',
+        {'fqdn': 'name', 'canonical_name': 'canonical', 'view': 'view',
+         'comment': 'comment', 'ttl': 'ttl', 'disabled': 'disable'},
+        ['name', 'view'],
+    ),
+    'fixedaddress': (
+        'fixedaddress',
+        {'ip_address': 'ipv4addr', 'mac_address': 'mac', 'name': 'name',
+         'network_view': 'network_view', 'comment': 'comment',
+         'disabled': 'disable'},
+        ['ipv4addr', 'network_view'],
+    ),
+    'hostrecord': (
+        'record:host',
+        {'fqdn': 'name', 'view': 'view', 'addresses': 'ipv4addrs',
+         'configure_for_dns': 'configure_for_dns', 'comment': 'comment',
+         'ttl': 'ttl', 'disabled': 'disable'},
+        ['name', 'view'],
+    ),
+    'network': (
+        'network',
+        {'address': 'network', 'netmask': 'network',
+         'network_view': 'network_view', 'comment': 'comment'},
+        ['network', 'network_view'],
+    ),
+    'networkcontainer': (
+        'networkcontainer',
+        {'address': 'network', 'netmask': 'network',
+         'network_view': 'network_view', 'comment': 'comment'},
+        ['network', 'network_view'],
+    ),
+    'txtrecord': (
+        'record:txt',
+        {'fqdn': 'name', 'text': 'text', 'view': 'view',
+         'comment': 'comment', 'ttl': 'ttl', 'disabled': 'disable'},
+        ['name', 'view'],
+    ),
+}
+
+# WAPI fields with boolean and integer values.
+IB_BATCH_BOOLEAN_FIELDS = ['configure_for_dns', 'disable']
+IB_BATCH_INTEGER_FIELDS = ['ttl']
+
+
+# Define functions for writing objects directly via the WAPI.
+def batch_init(grid, mode, threshold, batch_size, workers):
+    """Set up grid for importing small files in batches of requests."""
+    grid['batch'] = {
+        'mode': mode,
+        'threshold': threshold,
+        'batch_size': batch_size,
+        'workers': workers,
+    }
+
+
+def batch_object(obj_type, header, row):
+    """Return WAPI object type, data, and key fields for a CSV row.
+
+    Raise ValueError if the row cannot be written directly.
+    """
+    if obj_type not in IB_BATCH_OBJECTS:
+        raise ValueError('unsupported object type {}'.format(obj_type))
+    (wapi_type, field_map, key_names) = IB_BATCH_OBJECTS[obj_type]
+    values = {}
+    data = {}
+    for (idx, field) in enumerate(header[1:], start=1):
+        value = row[idx].strip() if idx < len(row) else ''
+        if not value:
+            continue
+        name = import_csv.csv_field_name(field)
+        if name.startswith('ea-'):
+            data.setdefault('extattrs', {})[field.strip()[3:].rstrip('*')] = {
+                'value': value,
+            }
+        elif name in field_map:
+            values[name] = value
+        else:
+            raise ValueError('unsupported {} field {}'.format(obj_type, name))
+
+    # Convert the CSV values to WAPI values.
+    for (name, value) in values.items():
+        wapi_name = field_map[name]
+        if wapi_name in IB_BATCH_BOOLEAN_FIELDS:
+            data[wapi_name] = value.upper() == 'TRUE'
+        elif wapi_name in IB_BATCH_INTEGER_FIELDS:
+            data[wapi_name] = int(value)
+        elif wapi_name == 'ipv4addrs':
+            data[wapi_name] = [
+                {'ipv4addr': addr.strip()}
+                for addr in value.split(',') if addr.strip()
+            ]
+        elif name == 'netmask':
+            continue  # Combined with address below
+        elif name == 'address' and wapi_name == 'network':
+            data[wapi_name] = str(ipaddress.ip_network(
+                '{}/{}'.format(value, values.get('netmask', '32')),
+            ))
+        else:
+            data[wapi_name] = value
+    keys = {name: data[name] for name in key_names if name in data}
+    if not keys:
+        raise ValueError('no key fields for {}'.format(obj_type))
+    return (wapi_type, data, keys)
+
+
+def batch_requests(idx, obj_type, header, row, operation):
+    """Return list of WAPI requests to insert, update, or delete a row.
+
+    Updates and deletes look up the object's reference by its key
+    fields and save it as state variable "ref<idx>" for use by the
+    following request.
+    """
+    (wapi_type, data, keys) = batch_object(obj_type, header, row)
+    if operation == 'INSERT':
+        return [{'method': 'POST', 'object': wapi_type, 'data': data}]
+    lookup = {
+        'method': 'GET',
+        'object': wapi_type,
+        'data': keys,
+        'assign_state': {'ref{}'.format(idx): '_ref'},
+        'discard': True,
+    }
+    change = {
+        'object': '##STATE:ref{}:##'.format(idx),
+        'enable_substitution': True,
+        'discard': True,
+    }
+    if operation == 'UPDATE':
+        change['method'] = 'PUT'
+        change['data'] = {
+            name: value for (name, value) in data.items() if name not in keys
+        }
+    elif operation == 'DELETE':
+        change['method'] = 'DELETE'
+    else:
+        raise ValueError('unsupported operation {}'.format(operation))
+    return [lookup, change]
+
+
+def batch_plan(grid, csv_path, operation):
+    """Return rows of csv_path and their WAPI requests for batch mode.
+
+    Return None if the file should be imported as a CSV job instead.
+    """
+    settings = grid.get('batch')
+    if settings is None or settings['mode'] == 'csv':
+        return None
+    batch_rows = []
+    try:
+        with import_csv.csv_open(csv_path) as csv_in:
+            for (obj_type, header, row) in import_csv.csv_data_rows(csv_in):
+                if (settings['mode'] == 'auto'
+                        and len(batch_rows) >= settings['threshold']):
+                    return None
+                idx = len(batch_rows)
+                batch_rows.append((
+                    obj_type,
+                    header,
+                    row,
+                    batch_requests(idx, obj_type, header, row, operation),
+                ))
+    except ValueError as err:
+        if settings['mode'] == 'auto':
+            return None
+        import_csv.error_exit(
+            'Cannot import {} in batch mode: {}'.format(csv_path, err),
+        )
+    except OSError as err:
+        import_csv.error_exit(
+            'Error opening CSV file {}'.format(csv_path),
+            err,
+        )
+    return batch_rows
+
+
+def batch_send(grid, batch):
+    """Send requests for a batch of rows in one WAPI request.
+
+    Return list of (row index, error message) for rows that failed.
+    NOTE: The grid executes all requests in a batch or none of them, so
+    if a batch fails we split it in half and try each half, until we
+    find the rows that fail.
+    """
+    requests = import_csv.requests
+    body = []
+    for (_, requests_for_row) in batch:
+        body.extend(requests_for_row)
+    try:
+        rsp = import_csv.ib_request(
+            grid,
+            'POST',
+            grid['url'] + 'request',
+            data=json.dumps(body),
+        )
+        # pylint: disable=E1101
+        if rsp.status_code in (requests.codes.ok, requests.codes.created):
+            return []
+        msg = import_csv.ib_api_error_msg(rsp)
+    except requests.exceptions.RequestException as err:
+        msg = str(err)
+    if len(batch) == 1:
+        return [(batch[0][0], msg)]
+    half = len(batch) // 2
+    return batch_send(grid, batch[:half]) + batch_send(grid, batch[half:])
+
+
+def batch_import(grid, batch_rows):
+    """Write rows directly to grid, return name of error log.
+
+    The error log is in the same format as that for a CSV import, and
+    its name is blank if no errors occurred.
+    """
+    settings = grid['batch']
+    batches = [
+        [(idx, batch_rows[idx][3])
+         for idx in range(start, min(start + settings['batch_size'],
+                                     len(batch_rows)))]
+        for start in range(0, len(batch_rows), settings['batch_size'])
+    ]
+    print('Writing {} rows in {} batches of up to {}'.format(
+        len(batch_rows),
+        len(batches),
+        settings['batch_size'],
+    ))
+    import_csv.ib_progress_event(grid, 'batch', rows=len(batch_rows),
+                                 batches=len(batches))
+    failures = {}
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=settings['workers'],
+    ) as executor:
+        try:
+            for batch_failures in executor.map(
+                    lambda batch: batch_send(grid, batch),
+                    batches,
+            ):
+                failures.update(batch_failures)
+        except SystemExit:
+            # Logging in again failed: don't send the remaining batches.
+            executor.shutdown(cancel_futures=True)
+            raise
+    print('Imported {} lines ({} failed)'.format(
+        len(batch_rows),
+        len(failures),
+    ))
+    if not failures:
+        return ''
+
+    # Write an error log and a file of failed rows, and summarize them.
+    (log_fd, log_fn) = tempfile.mkstemp('.csv')
+    summary = {}
+    with os.fdopen(log_fd, 'w', newline='', encoding='utf-8') as log_f, \
+            open(import_csv.csv_retry_path(log_fn), 'w', newline='',
+                 encoding='utf-8') as retry_f:
+        log_writer = csv.writer(log_f)
+        retry_writer = csv.writer(retry_f)
+        log_headers = {}
+        retry_headers = {}
+        for idx in sorted(failures):
+            (obj_type, header, row, _) = batch_rows[idx]
+            msg = failures[idx]
+            import_csv.csv_writerow(log_writer, log_headers, obj_type,
+                                    header, row + [msg])
+            import_csv.csv_writerow(retry_writer, retry_headers, obj_type,
+                                    header, row)
+            summary[(obj_type, msg)] = summary.get((obj_type, msg), 0) + 1
+    import_csv.csv_print_error_summary(summary)
+    return log_fn
@@ -0,0 +1,240 @@
+"""Benchmark import_csv.py end to end against the fake WAPI.
+
+This script generates CSV import files of various sizes, runs
+fake_wapi.py as a stand-in for a grid, and runs import_csv.py against
+it for each file, measuring the wall clock time and peak memory use
+(maximum resident set size) of import_csv.py, and the number of
+requests and connections it made to the fake WAPI.  This allows
+changes to how files are uploaded, how progress is checked, and how
+error logs are downloaded to be judged without a real grid.
+
+Example:
+
+  bench_import.py --rows 1000,100000 --rate 50000 --fail-every 100
+
+Any arguments after "--" are passed to import_csv.py, e.g.
+
+  bench_import.py --rows 100000 -- --retry 1
+
+Generated CSV files are kept in the work directory (by default
+./bench_data) and reused by later runs.
+"""
+
+# Import the required Python modules.
+import argparse
+import ipaddress
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+
+# Directory containing this script and the scripts it runs.
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def bench_csv_file(work_dir, rows):
+    """Return pathname of CSV file with rows networks, creating it."""
+    csv_path = os.path.join(work_dir, 'networks_{}.csv'.format(rows))
+    if os.path.exists(csv_path):
+        return csv_path
+    tmp_path = csv_path + '.tmp'
+    base = int(ipaddress.IPv4Address('10.0.0.0'))
+    with open(tmp_path, 'w', newline='') as csv_out:
+        csv_out.write('header-network,address*,netmask*,comment\r\n')
+        for row in range(rows):
+            csv_out.write('network,{},255.255.255.255,bench row {}\r\n'.format(
+                ipaddress.IPv4Address(base + row),
+                row,
+            ))
+    os.replace(tmp_path, csv_path)
+    return csv_path
+
+
+def bench_start_fake(cmd_args):
+    """Start fake WAPI, return the process and the WAPI URL."""
+    fake = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(BENCH_DIR, 'fake_wapi.py'),
+            '--port', '0',
+            '--rate', str(cmd_args['rate']),
+            '--queue-delay', str(cmd_args['queue_delay']),
+            '--fail-every', str(cmd_args['fail_every']),
+        ],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    line = fake.stdout.readline()
+    if not line.startswith('Listening on '):
+        fake.kill()
+        sys.exit('Could not start fake WAPI')
+    return (fake, line.split()[-1])
+
+
+def bench_stop_fake(fake, url):
+    """Get request counts from fake WAPI, then stop it."""
+    stats_url = url.split('/wapi/')[0] + '/_stats'
+    with urllib.request.urlopen(stats_url) as rsp:
+        stats = json.load(rsp)
+    fake.send_signal(signal.SIGINT)
+    fake.communicate()
+    return stats
+
+
+def bench_run(cmd_args, rows):
+    """Run one benchmark, return its results."""
+    csv_path = bench_csv_file(cmd_args['work_dir'], rows)
+    (fake, url) = bench_start_fake(cmd_args)
+    try:
+        config_path = os.path.join(cmd_args['work_dir'], 'bench.ini')
+        with open(config_path, 'w') as config_f:
+            config_f.write(
+                '[bench]\nurl = {}\nuserid = admin\npassword = infoblox\n'
+                .format(url)
+            )
+
+        # Run the import, getting its resource usage when it exits.
+        start = time.monotonic()
+        importer = subprocess.Popen(
+            [
+                sys.executable,
+                os.path.join(BENCH_DIR, 'import_csv.py'),
+                '--ib-config', config_path,
+                '--poll-interval', str(cmd_args['poll_interval']),
+            ] + cmd_args['import_args'] + [csv_path],
+            stdout=subprocess.DEVNULL if cmd_args['quiet'] else None,
+        )
+        (_, status, rusage) = os.wait4(importer.pid, 0)
+        importer.returncode = os.waitstatus_to_exitcode(status)
+        wall = time.monotonic() - start
+    finally:
+        stats = bench_stop_fake(fake, url)
+
+    # NOTE: ru_maxrss is in kilobytes on Linux but bytes on MacOS.
+    peak_rss = rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return {
+        'rows': rows,
+        'file_size': os.path.getsize(csv_path),
+        'exit_status': importer.returncode,
+        'wall_seconds': wall,
+        'peak_rss_bytes': peak_rss,
+        'requests': sum(stats['requests'].values()),
+        'requests_by_type': stats['requests'],
+        'connections': stats['connections'],
+    }
+
+
+def bench_print(results):
+    """Print table of benchmark results."""
+    print('{:>10} {:>10} {:>9} {:>10} {:>8} {:>6} {:>6}'.format(
+        'rows', 'MB', 'seconds', 'peak RSS', 'requests', 'conns', 'exit',
+    ))
+    for result in results:
+        print('{:>10} {:>10.1f} {:>9.2f} {:>9.1f}M {:>8} {:>6} {:>6}'.format(
+            result['rows'],
+            result['file_size'] / 1e6,
+            result['wall_seconds'],
+            result['peak_rss_bytes'] / 2**20,
+            result['requests'],
+            result['connections'],
+            result['exit_status'],
+        ))
+
+
+def get_cmd_args():
+    """Get arguments from command line or user input and return them."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark import_csv.py against a fake WAPI',
+    )
+    parser.add_argument(
+        '--rows',
+        action='store',
+        dest='rows',
+        default='1000,100000,10000000',
+        help='comma-separated CSV file sizes (default 1000,100000,10000000)',
+    )
+    parser.add_argument(
+        '--rate',
+        action='store',
+        dest='rate',
+        type=float,
+        default=100000.0,
+        help='lines per second processed by fake WAPI (default 100000)',
+    )
+    parser.add_argument(
+        '--queue-delay',
+        action='store',
+        dest='queue_delay',
+        type=float,
+        default=0.0,
+        help='seconds each import waits in the fake queue (default 0)',
+    )
+    parser.add_argument(
+        '--fail-every',
+        action='store',
+        dest='fail_every',
+        type=int,
+        default=1000,
+        help='make every Nth data row fail (default 1000)',
+    )
+    parser.add_argument(
+        '--poll-interval',
+        action='store',
+        dest='poll_interval',
+        type=int,
+        default=1,
+        help='seconds between progress checks (default 1)',
+    )
+    parser.add_argument(
+        '--work-dir',
+        action='store',
+        dest='work_dir',
+        default='bench_data',
+        help='directory for generated CSV files (default bench_data)',
+    )
+    parser.add_argument(
+        '--json',
+        action='store',
+        dest='json_path',
+        help='file in which to save results as JSON',
+    )
+    parser.add_argument(
+        '--quiet',
+        action='store_true',
+        dest='quiet',
+        help='suppress output of import_csv.py',
+    )
+    parser.add_argument(
+        'import_args',
+        nargs='*',
+        help='arguments (after --) to pass to import_csv.py',
+    )
+
+    # Parse the command line and return argument values as a dictionary.
+    args = parser.parse_args()
+    cmd_args = vars(args)
+    try:
+        cmd_args['rows'] = [int(rows) for rows in args.rows.split(',')]
+    except ValueError:
+        parser.error('--rows must be a comma-separated list of numbers')
+    return cmd_args
+
+
+def main():
+    """Main program."""
+    cmd_args = get_cmd_args()
+    os.makedirs(cmd_args['work_dir'], exist_ok=True)
+    results = [bench_run(cmd_args, rows) for rows in cmd_args['rows']]
+    bench_print(results)
+    if cmd_args['json_path']:
+        with open(cmd_args['json_path'], 'w') as json_f:
+            json.dump(results, json_f, indent=2)
+
+
+# Execute the following when this is run as a script.
+if __name__ == '__main__':
+    main()
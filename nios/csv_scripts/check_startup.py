@@ -0,0 +1,179 @@
+"""Check that scripts start up quickly, using python -X importtime.
+
+This script runs each script to be checked as "python -X importtime
+SCRIPT --version" several times, and adds up the time taken to import
+the modules the script imports itself (i.e., not counting modules that
+Python imports when starting up).  It prints the median of these times
+and the modules that took longest to import, and exits with an error
+status if the median time for any script is over the budget, or if
+any script imported a module that it should only import when first
+needed (by default requests, urllib3 and bloxone), so that it can be
+used as a regression test.
+
+By default it checks the CSV scripts built on the WAPI (import_csv.py,
+export_csv.py, async_import.py and import_queue.py) and the BloxOne
+on-prem host management scripts oph_manage.py and oph_rename.py.
+
+Examples:
+
+  check_startup.py
+  check_startup.py --budget 50 --runs 10 import_csv.py
+"""
+
+# Import the required Python modules.
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+# Directory containing this script and the scripts it checks.
+CHECK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Scripts to check by default.
+CHECK_SCRIPTS = [
+    os.path.join(CHECK_DIR, 'import_csv.py'),
+    os.path.join(CHECK_DIR, 'export_csv.py'),
+    os.path.join(CHECK_DIR, 'async_import.py'),
+    os.path.join(CHECK_DIR, 'import_queue.py'),
+    os.path.join(CHECK_DIR, '..', '..', 'bloxone', 'oph_management',
+                 'oph_manage.py'),
+    os.path.join(CHECK_DIR, '..', '..', 'bloxone', 'oph_management',
+                 'oph_rename.py'),
+]
+
+# Number of slowest modules to show for each script.
+CHECK_SLOWEST = 5
+
+
+def check_import_times(args):
+    """Run Python with -X importtime and args, return import times.
+
+    The result is a list of (module, microseconds) for each module
+    imported at the top level, in the order imported.
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + args,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=False,
+    )
+    if proc.returncode != 0:
+        sys.exit('Error running {}:\n{}'.format(' '.join(args), proc.stderr))
+    times = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue  # Skip the heading
+        # NOTE: Modules imported by other modules are indented.
+        if fields[2].startswith('  '):
+            continue
+        times.append((fields[2].strip(), int(fields[1])))
+    return times
+
+
+def check_script(script, runs, baseline, forbidden):
+    """Check startup of script, return (median ms, slowest, forbidden).
+
+    Modules in baseline are imported by Python itself and not counted.
+    """
+    totals = []
+    slowest = {}
+    imported = set()
+    for _ in range(runs):
+        times = [
+            (module, usecs)
+            for (module, usecs) in check_import_times([script, '--version'])
+            if module not in baseline
+        ]
+        totals.append(sum(usecs for (_, usecs) in times) / 1000.0)
+        for (module, usecs) in times:
+            slowest[module] = max(slowest.get(module, 0), usecs)
+            imported.add(module.split('.')[0])
+    slowest = sorted(slowest.items(), key=lambda item: -item[1])
+    return (
+        statistics.median(totals),
+        slowest[:CHECK_SLOWEST],
+        sorted(imported & set(forbidden)),
+    )
+
+
+def get_cmd_args():
+    """Get arguments from command line or user input and return them."""
+    parser = argparse.ArgumentParser(
+        description='Check that scripts start up within a time budget',
+    )
+    parser.add_argument(
+        '--budget',
+        action='store',
+        dest='budget',
+        type=float,
+        default=100.0,
+        help='maximum milliseconds spent importing modules (default 100)',
+    )
+    parser.add_argument(
+        '--runs',
+        action='store',
+        dest='runs',
+        type=int,
+        default=5,
+        help='number of times to run each script (default 5)',
+    )
+    parser.add_argument(
+        '--forbid',
+        action='store',
+        dest='forbid',
+        default='requests,urllib3,bloxone',
+        help='comma-separated modules that must not be imported at '
+             'startup (default requests,urllib3,bloxone)',
+    )
+    parser.add_argument(
+        action='store',
+        dest='scripts',
+        nargs='*',
+        help='scripts to check (default {})'.format(', '.join(
+            os.path.basename(script) for script in CHECK_SCRIPTS
+        )),
+    )
+    args = vars(parser.parse_args())
+    args['scripts'] = args['scripts'] or CHECK_SCRIPTS
+    args['forbid'] = [module for module in args['forbid'].split(',')
+                      if module]
+    return args
+
+
+def main():
+    """Main program."""
+    cmd_args = get_cmd_args()
+    baseline = set(module for (module, _) in check_import_times(['-c', '']))
+    failed = []
+    for script in cmd_args['scripts']:
+        (median, slowest, forbidden) = check_script(
+            script,
+            cmd_args['runs'],
+            baseline,
+            cmd_args['forbid'],
+        )
+        name = os.path.basename(script)
+        print('{}: {:.1f} ms importing modules (budget {:.1f} ms)'.format(
+            name, median, cmd_args['budget'],
+        ))
+        for (module, usecs) in slowest:
+            print('  {:>8.1f} ms  {}'.format(usecs / 1000.0, module))
+        if median > cmd_args['budget']:
+            failed.append('{} is over budget'.format(name))
+        if forbidden:
+            failed.append('{} imports {} at startup'.format(
+                name, ', '.join(forbidden),
+            ))
+    if failed:
+        sys.exit('\n'.join(failed))
+
+
+# Execute the following when this is run as a script.
+if __name__ == '__main__':
+    main()
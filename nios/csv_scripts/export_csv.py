@@ -0,0 +1,465 @@
+"""Export Infoblox data objects to a CSV file.
+
+This script uses the Infoblox Web API to export objects of one or more
+types (e.g., network, record:a) using the grid's CSV export function,
+in the same format accepted by import_csv.py.  It uses the same
+Infoblox configuration file as import_csv.py.
+
+Each export is streamed to disk as it is downloaded, rather than being
+read into memory, and is compressed with gzip if the output file name
+ends in ".gz".  By default the exports of all object types are written
+to a single file; the --split option writes each object type to its
+own file instead (e.g., export_network.csv, export_record_a.csv).
+
+If the --index option is used, the script also writes an index of the
+exported rows: one line per row, containing the key identifying the
+object (as used by the --delta option of import_csv.py) and a hash of
+the row's contents, sorted by key.  The --compare option compares the
+new index against one from a previous export, reads both files only
+once, prints the number of objects added, removed, and changed (with
+some examples), and exits with an error status if there were any
+differences.
+
+The --profile and --profile-stats options work as for import_csv.py,
+recording a trace of phase and HTTP request timings and cProfile
+statistics respectively.
+
+Examples:
+
+  # Nightly backup of networks and host records, compressed
+  export_csv.py -o nightly.csv.gz network record:host
+
+  # Check for drift since the last export
+  export_csv.py --index new.idx --compare last.idx network
+"""
+
+# Import the required Python modules.
+import argparse
+import codecs
+import gzip
+import heapq
+import json
+import os
+import tempfile
+import import_csv
+import trace_output
+
+# NOTE: The requests module takes much longer to import than the
+# others, so is only imported when first needed (see import_modules),
+# keeping --help, --version and argument errors fast.
+# NOTE: Must disable pylint E1101 error when checking requests.codes.
+requests = None  # pylint: disable=C0103
+
+
+# Number of example keys to print for each kind of difference.
+EXPORT_EXAMPLES = 10
+
+# Number of index entries to sort in memory at once, after which they
+# are written to a temporary file, to be merged with the others when
+# the index is written.
+EXPORT_INDEX_RUN = 500000
+
+
+# Define functions for exporting objects.
+def export_open(path):
+    """Open output file for writing bytes, compressing if needed."""
+    try:
+        if path.lower().endswith('.gz'):
+            return gzip.open(path, 'wb')
+        return open(path, 'wb')
+    except OSError as err:
+        import_csv.error_exit('Error opening output file {}'.format(path), err)
+
+
+def export_split_path(output, wapi_object):
+    """Return name of output file for one object type."""
+    (base, ext) = os.path.splitext(output)
+    if ext.lower() == '.gz':
+        (base, csv_ext) = os.path.splitext(base)
+        ext = csv_ext + ext
+    return '{}_{}{}'.format(base, wapi_object.replace(':', '_'), ext)
+
+
+def export_fileop(grid, function, req_data, msg):
+    """Call a fileop function with req_data, return its result."""
+    try:
+        rsp = import_csv.ib_request(
+            grid,
+            'POST',
+            grid['url'] + 'fileop',
+            params={'_function': function},
+            data=json.dumps(req_data),
+        )
+    except requests.exceptions.RequestException as err:
+        import_csv.error_exit('Error: {}'.format(msg), err)
+    if rsp.status_code != requests.codes.ok:  # pylint: disable=E1101
+        import_csv.ib_error_exit('Cannot {}'.format(msg), rsp)
+    # NOTE: These WAPI calls return a single dictionary.
+    return rsp.json()
+
+
+def export_chunks(chunks, state):
+    """Yield chunks of a downloaded export, without a leading BOM.
+
+    Also record in state whether the last chunk ended with a newline.
+    """
+    first = True
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if first and chunk.startswith(codecs.BOM_UTF8):
+            chunk = chunk[len(codecs.BOM_UTF8):]
+        first = False
+        state['newline'] = chunk.endswith(b'\n')
+        yield chunk
+
+
+def export_object(grid, wapi_object, out_f, index):
+    """Export objects of type wapi_object to out_f, return # of rows.
+
+    If index is not None, add an index entry to it for each row.
+    """
+    result = export_fileop(
+        grid,
+        'csv_export',
+        {'_object': wapi_object},
+        'start export of {} objects'.format(wapi_object),
+    )
+
+    # Download the export, writing it out and indexing its rows as it
+    # arrives.
+    req_headers = {'Content-type': 'application/force-download'}
+    try:
+        rsp = import_csv.ib_request(
+            grid,
+            'GET',
+            result['url'],
+            headers=req_headers,
+            stream=True,
+        )
+    except requests.exceptions.RequestException as err:
+        import_csv.error_exit(
+            'Error downloading export of {} objects'.format(wapi_object),
+            err,
+        )
+    if rsp.status_code != requests.codes.ok:  # pylint: disable=E1101
+        import_csv.ib_error_exit(
+            'Cannot download export of {} objects'.format(wapi_object),
+            rsp,
+        )
+    rows = 0
+    state = {'newline': True}
+    try:
+        lines = import_csv.csv_stream_lines(
+            export_chunks(
+                rsp.iter_content(chunk_size=import_csv.IB_CHUNK_SIZE),
+                state,
+            ),
+            out_f,
+        )
+        for (obj_type, header, row) in import_csv.csv_data_rows(lines):
+            rows = rows + 1
+            if index is not None:
+                export_index_add(index, '{}\t{}'.format(
+                    import_csv.csv_row_key(obj_type, header, row),
+                    import_csv.csv_row_hash(header, row),
+                ))
+        if not state['newline']:
+            out_f.write(b'\n')  # Keep the next export on its own line
+    except (OSError, requests.exceptions.RequestException) as err:
+        import_csv.error_exit(
+            'Error downloading export of {} objects'.format(wapi_object),
+            err,
+        )
+    finally:
+        rsp.close()
+
+    # Tell Infoblox system the download is complete.
+    export_fileop(
+        grid,
+        'downloadcomplete',
+        {'token': result['token']},
+        'complete download of {} objects'.format(wapi_object),
+    )
+    return rows
+
+
+# Define functions for writing and comparing indexes.
+def export_index_new():
+    """Return a new (empty) index of exported rows."""
+    return {'entries': [], 'runs': []}
+
+
+def export_index_add(index, entry):
+    """Add an entry to index, writing sorted entries out if too many."""
+    index['entries'].append(entry)
+    if len(index['entries']) >= EXPORT_INDEX_RUN:
+        export_index_spill(index)
+
+
+def export_index_spill(index):
+    """Write the index entries in memory to a sorted temporary file."""
+    index['entries'].sort()
+    try:
+        # NOTE: The file is deleted when closed, or when the script exits.
+        run_f = tempfile.TemporaryFile('w+', encoding='utf-8')
+        for entry in index['entries']:
+            run_f.write(entry + '\n')
+        run_f.seek(0)
+    except OSError as err:
+        import_csv.error_exit('Error writing temporary index file', err)
+    index['runs'].append(run_f)
+    index['entries'] = []
+
+
+def export_write_index(index_path, index):
+    """Write index entries to index_path, sorted by key.
+
+    The entries in memory are sorted and merged with those written to
+    temporary files, so that only one line of each file is in memory.
+    """
+    index['entries'].sort()
+    runs = [(line.rstrip('\n') for line in run_f)
+            for run_f in index['runs']]
+    try:
+        with open(index_path, 'w', encoding='utf-8') as index_f:
+            for entry in heapq.merge(index['entries'], *runs):
+                index_f.write(entry + '\n')
+    except OSError as err:
+        import_csv.error_exit(
+            'Error writing index {}'.format(index_path),
+            err,
+        )
+    finally:
+        for run_f in index['runs']:
+            run_f.close()
+
+
+def export_read_index(index_f):
+    """Yield (key, hash) for each entry in a sorted index file."""
+    for line in index_f:
+        (key, _, row_hash) = line.rstrip('\n').rpartition('\t')
+        yield (key, row_hash)
+
+
+def export_compare_index(old_path, new_path):
+    """Compare two sorted indexes, return differences by kind.
+
+    The result maps "added", "removed", and "changed" to a list of the
+    count of such keys and some example keys.
+    """
+    diffs = {'added': [0, []], 'removed': [0, []], 'changed': [0, []]}
+
+    def note(kind, key):
+        diffs[kind][0] = diffs[kind][0] + 1
+        if len(diffs[kind][1]) < EXPORT_EXAMPLES:
+            diffs[kind][1].append(key)
+
+    # Walk through both indexes in key order at the same time.
+    try:
+        with open(old_path, 'r', encoding='utf-8') as old_f, \
+                open(new_path, 'r', encoding='utf-8') as new_f:
+            old_entries = export_read_index(old_f)
+            new_entries = export_read_index(new_f)
+            old = next(old_entries, None)
+            new = next(new_entries, None)
+            while old is not None or new is not None:
+                if new is None or (old is not None and old[0] < new[0]):
+                    note('removed', old[0])
+                    old = next(old_entries, None)
+                elif old is None or new[0] < old[0]:
+                    note('added', new[0])
+                    new = next(new_entries, None)
+                else:
+                    if old[1] != new[1]:
+                        note('changed', new[0])
+                    old = next(old_entries, None)
+                    new = next(new_entries, None)
+    except OSError as err:
+        import_csv.error_exit(
+            'Error comparing index {} with {}'.format(new_path, old_path),
+            err,
+        )
+    return diffs
+
+
+def get_cmd_args():
+    """Get arguments from command line or user input and return them."""
+    parser = argparse.ArgumentParser(
+        description='Export Infoblox data objects to a CSV file',
+    )
+
+    # Add an option to print the version of the script.
+    parser.add_argument(
+        '-v',
+        '--version',
+        action='version',
+        version='%(prog)s 0.9',
+    )
+
+    # Add options for specifying the location of the configuration file
+    # and the user profile to be used within the configuration file.
+    parser.add_argument(
+        '--ib-config',
+        action='store',
+        dest='ib_config',
+        # No default, value of None means look for the file.
+        help='file with Infoblox credentials and WAPI info',
+    )
+    parser.add_argument(
+        '--ib-profile',
+        action='store',
+        dest='ib_profile',
+        # No default, value of None means use first section
+        # (other than the DEFAULT section, if present).
+        help='profile in Infoblox configuration file',
+    )
+    parser.add_argument(
+        '--auth-cache',
+        action='store',
+        dest='auth_cache',
+        # No default, value of None means do not cache the auth cookie.
+        help='file in which to cache the WAPI authentication cookie',
+    )
+
+    parser.add_argument(
+        '-o',
+        '--output',
+        action='store',
+        dest='output',
+        default='export.csv',
+        help='output file, compressed if name ends in .gz '
+             '(default export.csv)',
+    )
+    parser.add_argument(
+        '--split',
+        action='store_true',
+        dest='split',
+        help='write each object type to its own file',
+    )
+    parser.add_argument(
+        '--index',
+        action='store',
+        dest='index_path',
+        # No default, value of None means do not write an index.
+        help='file in which to write an index of exported rows',
+    )
+    parser.add_argument(
+        '--compare',
+        action='store',
+        dest='compare_path',
+        # No default, value of None means do not compare indexes.
+        help='index of a previous export to compare against',
+    )
+
+    parser.add_argument(
+        '--profile',
+        action='store',
+        dest='profile',
+        # No default, value of None means do not record a trace.
+        help='file in which to write a trace of phase and request timings',
+    )
+    parser.add_argument(
+        '--profile-stats',
+        action='store',
+        dest='profile_stats',
+        # No default, value of None means do not run cProfile.
+        help='file in which to write cProfile statistics',
+    )
+
+    # Add positional argument for specifying the object types.
+    parser.add_argument(
+        action='store',
+        dest='wapi_objects',
+        nargs='+',
+        help='WAPI object types to export (e.g., network record:a)',
+    )
+
+    # Parse the command line and return argument values as a dictionary.
+    args = parser.parse_args()
+    return vars(args)
+
+
+def import_modules():
+    """Import the requests module, if not already done."""
+    global requests  # pylint: disable=C0103,W0603
+    import_csv.import_modules()
+    requests = import_csv.requests
+
+
+def export_main(cmd_args):
+    """Export objects as specified by the command line arguments."""
+    if cmd_args['compare_path'] and not cmd_args['index_path']:
+        import_csv.error_exit('The --compare option requires --index')
+
+    # Initialize WAPI connections for read access.
+    import_modules()
+    grid = import_csv.ib_init(
+        cmd_args['ib_config'],
+        cmd_args['ib_profile'],
+        cmd_args['auth_cache'],
+    )
+
+    # Export each object type, to one file or to a file per type.
+    index = export_index_new() if cmd_args['index_path'] else None
+    out_f = None
+    if not cmd_args['split']:
+        out_f = export_open(cmd_args['output'])
+    for wapi_object in cmd_args['wapi_objects']:
+        path = cmd_args['output']
+        if cmd_args['split']:
+            path = export_split_path(cmd_args['output'], wapi_object)
+            out_f = export_open(path)
+        with trace_output.trace_span('export', wapi_object=wapi_object):
+            rows = export_object(grid, wapi_object, out_f, index)
+        print('Exported {} {} objects to {}'.format(rows, wapi_object, path))
+        if cmd_args['split']:
+            out_f.close()
+    if not cmd_args['split']:
+        out_f.close()
+    grid['session'].close()
+
+    # Write the index and compare it to the previous one if requested.
+    if index is None:
+        return
+    with trace_output.trace_span('write index'):
+        export_write_index(cmd_args['index_path'], index)
+    if not cmd_args['compare_path']:
+        return
+    diffs = export_compare_index(
+        cmd_args['compare_path'],
+        cmd_args['index_path'],
+    )
+    for kind in ['added', 'removed', 'changed']:
+        (count, examples) = diffs[kind]
+        print('{} objects {}'.format(count, kind))
+        for key in examples:
+            print('  {}'.format(key))
+    if any(count for (count, _) in diffs.values()):
+        import_csv.error_exit('Objects differ from those in {}'.format(
+            cmd_args['compare_path'],
+        ))
+
+
+def main():
+    """Main program."""
+    cmd_args = get_cmd_args()
+
+    # Record phase timings and profile the script if requested.
+    profiler = trace_output.trace_start(
+        cmd_args['profile'],
+        cmd_args['profile_stats'],
+    )
+    try:
+        export_main(cmd_args)
+    finally:
+        trace_output.trace_finish(
+            cmd_args['profile'],
+            cmd_args['profile_stats'],
+            profiler,
+        )
+
+
+# Execute the following when this is run as a script.
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,684 @@
+"""Run a local stand-in for the Infoblox WAPI CSV import functions.
+
+This script implements just enough of the Infoblox WAPI to exercise
+import_csv.py and related scripts without a real grid: logging in via
+the grid object, the fileop functions uploadinit, csv_import,
+csv_error_log, and downloadcomplete, the upload and download URLs that
+they return, and csvimporttask objects for checking import progress.
+
+Uploaded CSV files are stored on disk (not in memory) and "processed"
+at a configurable rate in lines per second, after an optional delay to
+simulate the import waiting in the grid's queue.  Every Nth data row
+can be made to fail, in which case an error log is produced containing
+the header rows and failed rows with an error message appended.
+
+The fileop function csv_export is also supported, exporting the data
+rows of the requested type (e.g., "network" or "record:a") from all
+files imported so far, with duplicate rows removed.
+
+The script also accepts multi-object requests (the WAPI "request"
+object) as used to write small numbers of objects directly.  A batch
+fails as a whole if any of its objects fails, and about one in N
+objects (chosen by their contents, so the same object always fails)
+fails when --fail-every N is specified.  No objects are actually
+stored.
+
+The auth cookie can also be made to expire after a given time, to exercise
+reauthentication.
+
+The script counts the requests it receives (by function) and the
+connections made to it; these counts can be retrieved as JSON from
+the /_stats URL and are printed when the script exits.
+
+Example:
+
+  fake_wapi.py --port 8080 --rate 50000 --fail-every 100
+
+accepts the configuration file entry
+
+  [fake]
+  url = http://127.0.0.1:8080/wapi/v2.11/
+  userid = admin
+  password = infoblox
+"""
+
+# Import the required Python modules.
+import argparse
+import base64
+import collections
+import http.server
+import json
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import zlib
+
+
+# Prefix for WAPI URLs served by this script.
+FAKE_WAPI_PATH = '/wapi/v2.11/'
+
+# Size of chunks in which to read and write files.
+FAKE_CHUNK_SIZE = 64 * 1024
+
+
+def fake_new_state(cmd_args):
+    """Return object holding the state of the fake grid."""
+    return {
+        'options': cmd_args,
+        'lock': threading.Lock(),
+        'dir': tempfile.mkdtemp(prefix='fake_wapi_'),
+        'cookies': {},
+        'uploads': {},
+        'tasks': {},
+        'downloads': {},
+        'next_id': 1,
+        'requests': collections.Counter(),
+        'connections': 0,
+    }
+
+
+def fake_count_lines(csv_path, fail_every):
+    """Return number of lines and failed data rows in csv_path."""
+    lines = 0
+    failed = 0
+    data_rows = 0
+    with open(csv_path, 'rb') as csv_in:
+        for line in csv_in:
+            if not line.strip():
+                continue
+            lines = lines + 1
+            if line.lstrip(b'"').lower().startswith(b'header-'):
+                continue
+            data_rows = data_rows + 1
+            if fail_every > 0 and data_rows % fail_every == 0:
+                failed = failed + 1
+    return (lines, failed)
+
+
+def fake_write_error_log(csv_path, log_path, fail_every):
+    """Write error log with header rows and failed rows of csv_path."""
+    data_rows = 0
+    with open(csv_path, 'rb') as csv_in, open(log_path, 'wb') as log_out:
+        for line in csv_in:
+            if not line.strip():
+                continue
+            if line.lstrip(b'"').lower().startswith(b'header-'):
+                log_out.write(line.rstrip(b'\r\n') + b'\n')
+                continue
+            data_rows = data_rows + 1
+            if fail_every > 0 and data_rows % fail_every == 0:
+                log_out.write(
+                    line.rstrip(b'\r\n') + b',"Simulated import failure"\n'
+                )
+
+
+def fake_write_export(state, wapi_object, export_path):
+    """Write CSV export of wapi_object rows from all imported files."""
+    csv_type = wapi_object.lower().encode()
+    if csv_type.startswith(b'record:'):
+        csv_type = csv_type[len(b'record:'):] + b'record'
+    with state['lock']:
+        csv_paths = [
+            state['tasks'][import_id]['csv_path']
+            for import_id in sorted(state['tasks'])
+        ]
+    header = None
+    rows = {}
+    for csv_path in csv_paths:
+        with open(csv_path, 'rb') as csv_in:
+            for line in csv_in:
+                line = line.rstrip(b'\r\n') + b'\n'
+                obj_type = line.split(b',', 1)[0].strip(b'"').lower()
+                if obj_type == b'header-' + csv_type:
+                    header = line
+                elif obj_type == csv_type:
+                    rows[line] = None
+    with open(export_path, 'wb') as export_out:
+        if header is not None:
+            export_out.write(header)
+        for line in rows:
+            export_out.write(line)
+
+
+def fake_task_status(state, task):
+    """Return csvimporttask object for task as of now."""
+    options = state['options']
+    elapsed = time.time() - task['start_time'] - options['queue_delay']
+    status = {
+        '_ref': task['_ref'],
+        'import_id': task['import_id'],
+        'file_name': task['file_name'],
+        'file_size': task['file_size'],
+        'operation': task['operation'],
+        'start_time': int(task['start_time']),
+        'lines_warning': 0,
+    }
+    if elapsed < 0:
+        status['status'] = 'PENDING'
+        status['lines_processed'] = 0
+        status['lines_failed'] = 0
+        return status
+    processed = min(task['lines'], int(elapsed * options['rate']))
+    status['lines_processed'] = processed
+    status['lines_failed'] = (
+        task['failed'] * processed // task['lines'] if task['lines'] else 0
+    )
+    if processed < task['lines']:
+        status['status'] = 'RUNNING'
+    else:
+        status['status'] = 'COMPLETED'
+        status['end_time'] = int(
+            task['start_time'] + options['queue_delay']
+            + task['lines'] / options['rate']
+        )
+    return status
+
+
+class FakeWapiHandler(http.server.BaseHTTPRequestHandler):
+    """Handle requests for the fake WAPI."""
+
+    # Use HTTP/1.1 so that clients can keep connections alive.
+    protocol_version = 'HTTP/1.1'
+
+    # Set by fake_serve() to the state of the fake grid.
+    state = None
+
+    def setup(self):
+        """Count each new connection."""
+        super().setup()
+        with self.state['lock']:
+            self.state['connections'] = self.state['connections'] + 1
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        """Log requests only if running verbosely."""
+        if self.state['options']['verbose']:
+            super().log_message(format, *args)
+
+    def send_json(self, status, result, headers=None):
+        """Send result as a JSON response."""
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, text):
+        """Send an error response in the style of the WAPI."""
+        self.send_json(status, {'Error': text, 'text': text})
+
+    def count(self, name):
+        """Count a request of a given type."""
+        with self.state['lock']:
+            self.state['requests'][name] += 1
+
+    def read_body(self, out_f=None):
+        """Read request body, copying it to out_f or returning it."""
+        chunks = []
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunk = self.rfile.read(size)
+                self.rfile.readline()
+                if out_f is None:
+                    chunks.append(chunk)
+                else:
+                    out_f.write(chunk)
+        else:
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, FAKE_CHUNK_SIZE))
+                if not chunk:
+                    break
+                remaining = remaining - len(chunk)
+                if out_f is None:
+                    chunks.append(chunk)
+                else:
+                    out_f.write(chunk)
+        return b''.join(chunks)
+
+    def authorized(self):
+        """Return True if the request has a valid auth cookie."""
+        cookies = self.headers.get('Cookie', '')
+        for cookie in cookies.split(';'):
+            (name, _, value) = cookie.strip().partition('=')
+            if name != 'ibapauth':
+                continue
+            with self.state['lock']:
+                expires = self.state['cookies'].get(value)
+            if expires is not None and expires > time.time():
+                return True
+        self.count('unauthorized')
+        self.send_error_json(401, 'Authorization Required')
+        return False
+
+    def do_GET(self):  # pylint: disable=C0103
+        """Handle login, task status, download, and statistics requests."""
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/_stats':
+            with self.state['lock']:
+                stats = {
+                    'requests': dict(self.state['requests']),
+                    'connections': self.state['connections'],
+                }
+            self.send_json(200, stats)
+        elif url.path == FAKE_WAPI_PATH + 'grid':
+            self.do_login()
+        elif url.path.startswith(FAKE_WAPI_PATH + 'csvimporttask/'):
+            if self.authorized():
+                self.do_task_status(url.path[len(FAKE_WAPI_PATH):])
+        elif url.path.startswith('/http_direct_file_io/download/'):
+            if self.authorized():
+                self.do_download(url.path.rsplit('/', 1)[-1])
+        else:
+            self.count('unknown')
+            self.send_error_json(404, 'Unknown object type')
+
+    def do_POST(self):  # pylint: disable=C0103
+        """Handle fileop and upload requests."""
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        if url.path.startswith('/http_direct_file_io/upload/'):
+            self.do_upload(url.path.rsplit('/', 1)[-1])
+            return
+        if url.path == FAKE_WAPI_PATH + 'request':
+            body = self.read_body()
+            if self.authorized():
+                self.do_request(body)
+            return
+        if url.path != FAKE_WAPI_PATH + 'fileop':
+            self.read_body()
+            self.count('unknown')
+            self.send_error_json(404, 'Unknown object type')
+            return
+        body = self.read_body()
+        if not self.authorized():
+            return
+        try:
+            data = json.loads(body) if body.strip() else {}
+        except ValueError:
+            self.send_error_json(400, 'Invalid JSON body')
+            return
+        params.update(data)
+        function = params.get('_function')
+        if function == 'uploadinit':
+            self.do_uploadinit()
+        elif function == 'csv_import':
+            self.do_csv_import(params)
+        elif function == 'csv_error_log':
+            self.do_csv_error_log(params)
+        elif function == 'csv_export':
+            self.do_csv_export(params)
+        elif function == 'downloadcomplete':
+            self.do_downloadcomplete(params)
+        else:
+            self.count('unknown')
+            self.send_error_json(400, 'Unknown function')
+
+    def do_login(self):
+        """Check basic auth credentials, return grid and auth cookie."""
+        self.count('login')
+        options = self.state['options']
+        expected = base64.b64encode(
+            '{}:{}'.format(options['userid'], options['password']).encode()
+        ).decode()
+        if self.headers.get('Authorization', '') == 'Basic ' + expected:
+            cookie = secrets.token_hex(16)
+            with self.state['lock']:
+                self.state['cookies'][cookie] = (
+                    time.time() + options['cookie_lifetime']
+                )
+            self.send_json(
+                200,
+                [{'_ref': 'grid/b25lLmNsdXN0ZXIkMA:Infoblox'}],
+                {'Set-Cookie': 'ibapauth={}; path=/'.format(cookie)},
+            )
+        elif self.authorized():
+            self.send_json(200, [{'_ref': 'grid/b25lLmNsdXN0ZXIkMA:Infoblox'}])
+
+    def do_request(self, body):
+        """Perform (simulated) multi-object request."""
+        self.count('request')
+        try:
+            requests = json.loads(body)
+            if not isinstance(requests, list):
+                raise ValueError('not a list')
+        except ValueError:
+            self.send_error_json(400, 'Invalid multi-object request')
+            return
+        fail_every = self.state['options']['fail_every']
+        with self.state['lock']:
+            self.state['requests']['request_objects'] += len(requests)
+        results = []
+        for request in requests:
+            data = json.dumps(request.get('data', {}), sort_keys=True)
+            if (fail_every > 0 and request.get('method') != 'GET'
+                    and zlib.crc32(data.encode()) % fail_every == 0):
+                self.send_error_json(400, 'Simulated write failure')
+                return
+            if not request.get('discard'):
+                results.append('{}/ZG5zLmZha2U:fake'.format(
+                    request.get('object', 'unknown'),
+                ))
+        self.send_json(201, results)
+
+    def do_uploadinit(self):
+        """Return a URL and token for uploading a file."""
+        self.count('uploadinit')
+        token = secrets.token_hex(16)
+        with self.state['lock']:
+            self.state['uploads'][token] = None
+        self.send_json(200, {
+            'url': 'http://{}/http_direct_file_io/upload/{}'.format(
+                self.headers.get('Host'),
+                token,
+            ),
+            'token': token,
+        })
+
+    def do_upload(self, token):
+        """Save uploaded (multipart/form-data) file to disk."""
+        self.count('upload')
+        with self.state['lock']:
+            if token not in self.state['uploads']:
+                token = None
+        raw_path = os.path.join(
+            self.state['dir'],
+            'raw_' + secrets.token_hex(8),
+        )
+        with open(raw_path, 'wb') as raw_f:
+            self.read_body(raw_f)
+        if not self.authorized():
+            os.remove(raw_path)
+            return
+        if token is None:
+            os.remove(raw_path)
+            self.send_error_json(400, 'Invalid upload token')
+            return
+
+        # Extract the file data from the multipart body.
+        csv_path = os.path.join(self.state['dir'], 'upload_' + token)
+        boundary = b'--' + self.headers.get_param('boundary', '').encode()
+        with open(raw_path, 'rb') as raw_f, open(csv_path, 'wb') as csv_f:
+            line = raw_f.readline()
+            while line and not line.startswith(boundary):
+                line = raw_f.readline()
+            line = raw_f.readline()
+            while line and line.strip():
+                line = raw_f.readline()  # Skip part headers
+            pending = b''
+            for line in raw_f:
+                if line.startswith(boundary):
+                    break
+                csv_f.write(pending)
+                pending = line
+            csv_f.write(pending[:-2] if pending.endswith(b'\r\n') else pending)
+        os.remove(raw_path)
+        with self.state['lock']:
+            self.state['uploads'][token] = csv_path
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_csv_import(self, params):
+        """Start a (simulated) CSV import task."""
+        self.count('csv_import')
+        with self.state['lock']:
+            csv_path = self.state['uploads'].get(params.get('token'))
+        if csv_path is None:
+            self.send_error_json(400, 'Invalid upload token')
+            return
+        (lines, failed) = fake_count_lines(
+            csv_path,
+            self.state['options']['fail_every'],
+        )
+        with self.state['lock']:
+            import_id = self.state['next_id']
+            self.state['next_id'] = import_id + 1
+            task = {
+                '_ref': 'csvimporttask/ZG5zLmNzdl9pbXBvcnQkMQ:{}'.format(
+                    import_id,
+                ),
+                'import_id': import_id,
+                'file_name': os.path.basename(csv_path),
+                'file_size': os.path.getsize(csv_path),
+                'operation': params.get('operation', 'INSERT'),
+                'csv_path': csv_path,
+                'start_time': time.time(),
+                'lines': lines,
+                'failed': failed,
+            }
+            self.state['tasks'][import_id] = task
+        self.send_json(200, {'csv_import_task': fake_task_status(
+            self.state,
+            task,
+        )})
+
+    def do_task_status(self, ref):
+        """Return status of a CSV import task."""
+        self.count('csvimporttask')
+        try:
+            import_id = int(ref.rsplit(':', 1)[-1])
+            task = self.state['tasks'][import_id]
+        except (ValueError, KeyError):
+            self.send_error_json(404, 'Reference not found')
+            return
+        self.send_json(200, fake_task_status(self.state, task))
+
+    def do_csv_error_log(self, params):
+        """Return a URL and token for downloading an error log."""
+        self.count('csv_error_log')
+        try:
+            task = self.state['tasks'][int(params.get('import_id'))]
+        except (TypeError, ValueError, KeyError):
+            self.send_error_json(404, 'Import not found')
+            return
+        if task['failed'] == 0:
+            self.send_error_json(404, 'No error log')
+            return
+        token = secrets.token_hex(16)
+        log_path = os.path.join(self.state['dir'], 'errors_' + token)
+        fake_write_error_log(
+            task['csv_path'],
+            log_path,
+            self.state['options']['fail_every'],
+        )
+        with self.state['lock']:
+            self.state['downloads'][token] = log_path
+        self.send_json(200, {
+            'url': 'http://{}/http_direct_file_io/download/{}'.format(
+                self.headers.get('Host'),
+                token,
+            ),
+            'token': token,
+        })
+
+    def do_csv_export(self, params):
+        """Return a URL and token for downloading exported objects."""
+        self.count('csv_export')
+        token = secrets.token_hex(16)
+        export_path = os.path.join(self.state['dir'], 'export_' + token)
+        fake_write_export(self.state, params.get('_object', ''), export_path)
+        with self.state['lock']:
+            self.state['downloads'][token] = export_path
+        self.send_json(200, {
+            'url': 'http://{}/http_direct_file_io/download/{}'.format(
+                self.headers.get('Host'),
+                token,
+            ),
+            'token': token,
+        })
+
+    def do_download(self, token):
+        """Send a file prepared for download."""
+        self.count('download')
+        with self.state['lock']:
+            log_path = self.state['downloads'].get(token)
+        if log_path is None:
+            self.send_error_json(404, 'Invalid download token')
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/force-download')
+        self.send_header('Content-Length', str(os.path.getsize(log_path)))
+        self.end_headers()
+        with open(log_path, 'rb') as log_f:
+            shutil.copyfileobj(log_f, self.wfile, FAKE_CHUNK_SIZE)
+
+    def do_downloadcomplete(self, params):
+        """Discard a file that has been downloaded."""
+        self.count('downloadcomplete')
+        with self.state['lock']:
+            log_path = self.state['downloads'].pop(params.get('token'), None)
+        if log_path is not None:
+            os.remove(log_path)
+        self.send_json(200, {})
+
+
+def fake_serve(cmd_args, ready=None):
+    """Run the fake WAPI until interrupted, return request counts.
+
+    If ready is not None, it is called with the server's URL once the
+    server is listening.
+    """
+    state = fake_new_state(cmd_args)
+    FakeWapiHandler.state = state
+    try:
+        server = http.server.ThreadingHTTPServer(
+            (cmd_args['host'], cmd_args['port']),
+            FakeWapiHandler,
+        )
+    except OSError as err:
+        print(err, file=sys.stderr)
+        sys.exit('Cannot listen on port {}'.format(cmd_args['port']))
+    server.daemon_threads = True
+    url = 'http://{}:{}{}'.format(
+        cmd_args['host'],
+        server.server_address[1],
+        FAKE_WAPI_PATH,
+    )
+    if ready is not None:
+        ready(url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    shutil.rmtree(state['dir'], ignore_errors=True)
+    return {
+        'requests': dict(state['requests']),
+        'connections': state['connections'],
+    }
+
+
+def get_cmd_args():
+    """Get arguments from command line or user input and return them."""
+    parser = argparse.ArgumentParser(
+        description='Run a local stand-in for the WAPI CSV import functions',
+    )
+
+    # Add an option to print the version of the script.
+    parser.add_argument(
+        '-v',
+        '--version',
+        action='version',
+        version='%(prog)s 0.9',
+    )
+
+    parser.add_argument(
+        '--host',
+        action='store',
+        dest='host',
+        default='127.0.0.1',
+        help='address on which to listen (default 127.0.0.1)',
+    )
+    parser.add_argument(
+        '--port',
+        action='store',
+        dest='port',
+        type=int,
+        default=8080,
+        help='port on which to listen (default 8080, 0 for any)',
+    )
+    parser.add_argument(
+        '--userid',
+        action='store',
+        dest='userid',
+        default='admin',
+        help='userid to accept (default admin)',
+    )
+    parser.add_argument(
+        '--password',
+        action='store',
+        dest='password',
+        default='infoblox',
+        help='password to accept (default infoblox)',
+    )
+    parser.add_argument(
+        '--rate',
+        action='store',
+        dest='rate',
+        type=float,
+        default=10000.0,
+        help='lines per second to process (default 10000)',
+    )
+    parser.add_argument(
+        '--queue-delay',
+        action='store',
+        dest='queue_delay',
+        type=float,
+        default=0.0,
+        help='seconds an import waits before processing (default 0)',
+    )
+    parser.add_argument(
+        '--fail-every',
+        action='store',
+        dest='fail_every',
+        type=int,
+        default=0,
+        help='make every Nth data row fail (default 0, no failures)',
+    )
+    parser.add_argument(
+        '--cookie-lifetime',
+        action='store',
+        dest='cookie_lifetime',
+        type=float,
+        default=600.0,
+        help='seconds until auth cookies expire (default 600)',
+    )
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        dest='verbose',
+        help='log each request',
+    )
+
+    # Parse the command line and return argument values as a dictionary.
+    args = parser.parse_args()
+    if args.rate <= 0:
+        parser.error('--rate must be positive')
+    return vars(args)
+
+
+def main():
+    """Main program."""
+    cmd_args = get_cmd_args()
+    stats = fake_serve(
+        cmd_args,
+        lambda url: print('Listening on {}'.format(url), flush=True),
+    )
+    print(json.dumps(stats, indent=2))
+
+
+# Execute the following when this is run as a script.
+if __name__ == '__main__':
+    main()
@@ -19,6 +19,75 @@ from an Infoblox configuration file in INI format as follows:
 valid TLS/SSL certificate as opposed to a self-signed certificate.
 The other parameters should be self-explanatory.)
 
+All WAPI calls for a grid are made through a single HTTP session, so
+that the connection to the grid is kept alive and reused rather than
+reestablished for every call.  If the --auth-cache option is used, the
+WAPI authentication cookie is saved in the specified file (readable
+only by its owner) and reused by later runs of the script until the
+grid rejects it, at which point the script authenticates again.
+
+If the --delta option is used, the script keeps an index of the rows
+it has successfully imported, identified by object type and key fields
+(e.g., address and netmask for a network) along with a hash of their
+contents.  On later runs only rows that are new, changed, or no longer
+present are sent to the grid, using CSV imports with the INSERT,
+UPDATE, and DELETE operations respectively.
+
+If any rows fail to import, the script downloads the CSV error log,
+prints a summary of the failures by object type and error message, and
+writes a "retry" CSV file containing only the failed rows (with their
+header rows).  The --retry option causes the script to import the
+failed rows again, up to the specified number of times.
+
+Small imports (by default, up to 500 rows of commonly used object
+types) are done by creating, updating, or deleting the objects
+directly, in batches of several objects per WAPI request sent in
+parallel, rather than by uploading the file to the grid's CSV job
+manager.  This avoids the fixed overhead of a CSV import job (upload,
+waiting in the job queue, checking progress, and downloading the error
+log).  The --mode option can be used to force one method or the other.
+
+If the --profile option is used, the script writes a trace of how long
+each phase of its work took (importing modules, reading the
+configuration file, authenticating, uploading, waiting between
+progress checks, and so on) and each HTTP request to the grid, in the
+Chrome trace event format.  The file can be viewed using the Perfetto
+UI (https://ui.perfetto.dev/) or chrome://tracing.  The --profile-stats
+option also profiles the script's main thread using cProfile and saves
+the statistics (for use with the pstats module) in the specified file.
+
+The --max-upload-rate option limits the rate at which the CSV file is
+uploaded to the grid (e.g., "500K" or "2M" bytes per second), so that
+large imports do not crowd out other traffic to the grid.  With the
+--adaptive-upload option the script also measures the round-trip time
+to the grid while uploading, and slows the upload down while that time
+is well above what it was before the upload started.
+
+The --rows and --section options import only part of the file (e.g.,
+to re-run the part of a large import that stalled or failed): rows
+START to END of the file, counting from 1, and/or the sections of the
+file for one object type, each beginning with its "header-<type>" row.
+Rows are numbered by line, counting header rows, as in the number of
+lines processed reported by the grid and the row shown in progress
+messages.
+The script indexes where each row and section of the file starts, in a
+single pass over the memory-mapped file, and then reads and uploads
+only the selected rows, each preceded by the header row of its
+section.  The same index is used to show which section and row of the
+file an import has reached each time its progress is checked.  (Other
+imports index the whole file for this only if --progress-json or
+--stats is used, since those count its lines anyway.)
+
+If the --progress-json option is used, the script also writes a stream
+of progress events to the specified file (or standard output, if the
+file is "-"), one JSON object per line.  Each event includes the time,
+the number of lines processed and failed so far, the current and
+average lines processed per second, the estimated time to completion,
+and upload and download rates in bytes per second.  The final event
+for each import summarizes the time spent uploading the file, waiting
+in the grid's queue, processing the file, and downloading the error
+log.
+
 On Linux/Unix/MacOS by default the script will look for the file
 ~/.infoblox.  On Microsoft Windows by default it will look for the
 file infoblox.ini in the user's home directory.  You can also specify
@@ -38,14 +107,146 @@ should work with earlier releases.
 
 # Import the required Python modules.
 import argparse
+import array
+import bisect
+import codecs
+import concurrent.futures
 import configparser
+import contextlib
+import csv
+import glob
+import gzip
+import hashlib
+import io
+import ipaddress
+import itertools
 import tempfile
 import json
+import math
+import mmap
+import operator
 import os
+import re
+import shutil
+import socket
+import struct
 import sys
+import threading
 import time
-import urllib3
-import requests  # NOTE: Must disable pylint E1101 error when checking codes
+import urllib.parse
+import uuid
+import zipfile
+import trace_output
+
+# NOTE: The requests and urllib3 modules take much longer to import
+# than the others, so are only imported when first needed (see
+# import_modules), keeping --help, --version and argument errors fast.
+# NOTE: Must disable pylint E1101 error when checking requests.codes.
+requests = None  # pylint: disable=C0103
+urllib3 = None  # pylint: disable=C0103
+
+
+# Maximum number of connections to keep open to a single grid.
+IB_POOL_MAXSIZE = 10
+
+# Size of chunks in which to download files from the grid.
+IB_CHUNK_SIZE = 64 * 1024
+
+# Settings for limiting upload bandwidth: the number of round-trip time
+# measurements to take before an upload starts, the time between and
+# the timeout for each measurement during the upload, how much higher
+# than before the upload (by factor and in seconds) the round-trip time
+# must be to slow the upload down, and the lowest fraction of the
+# maximum rate to which the upload is slowed.
+UPLOAD_BASELINE_PROBES = 3
+UPLOAD_PROBE_INTERVAL = 1.0
+UPLOAD_PROBE_TIMEOUT = 5.0
+UPLOAD_RTT_FACTOR = 2.0
+UPLOAD_RTT_SLACK = 0.01
+UPLOAD_MIN_FRACTION = 0.05
+
+# Suffixes allowed for upload rates, with their multipliers.
+UPLOAD_RATE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+# Lock serializing updates to the auth cache file by parallel imports.
+IB_AUTH_CACHE_LOCK = threading.Lock()
+
+# Lock serializing updates to the import state file by parallel imports.
+STATE_LOCK = threading.Lock()
+
+# Set if an import to several grids is interrupted, to stop checking
+# the progress of the imports still running.
+FANOUT_STOP = threading.Event()
+
+# Rows of CSV files selected by --rows or --section, by pathname (see
+# rows_slice); only these rows are read and uploaded.
+ROWS_SLICES = {}
+
+# Size of the blocks in which a CSV file is scanned to index its rows.
+ROWS_BLOCK_SIZE = 1024 * 1024
+
+# Pattern matching a "header-<type>" row after the end of a line.
+# NOTE: This is much faster to search for than a multi-line pattern.
+ROWS_HEADER_RE = re.compile(rb'\nheader-([^,\r\n]*)', re.IGNORECASE)
+
+# Fields identifying an object of a given type in a CSV import file.
+# NOTE: For object types not listed here the required fields (marked
+# with an asterisk in the header row) are used, or failing that all
+# fields in the row.
+IB_CSV_KEY_FIELDS = {
+    'arecord': ['fqdn', 'address', 'view'],
+    'aaaarecord': ['fqdn', 'address', 'view'],
+    'authzone': ['fqdn', 'view'],
+    'cnamerecord': ['fqdn', 'view'],
+    'dhcprange': ['start_address', 'end_address', 'network_view'],
+    'fixedaddress': ['ip_address', 'network_view'],
+    'forwardzone': ['fqdn', 'view'],
+    'hostrecord': ['fqdn', 'view'],
+    'ipv6fixedaddress': ['ipv6_address', 'network_view'],
+    'ipv6network': ['address', 'cidr', 'network_view'],
+    'ipv6networkcontainer': ['address', 'cidr', 'network_view'],
+    'mxrecord': ['fqdn', 'mx', 'view'],
+    'network': ['address', 'netmask', 'network_view'],
+    'networkcontainer': ['address', 'netmask', 'network_view'],
+    'networkview': ['name'],
+    'ptrrecord': ['dname', 'address', 'view'],
+    'reservedrange': ['start_address', 'end_address', 'network_view'],
+    'srvrecord': ['fqdn', 'priority', 'weight', 'port', 'target', 'view'],
+    'txtrecord': ['fqdn', 'text', 'view'],
+    'view': ['name'],
+}
+
+
+# Timeout for imports when there are no past imports to go on, the
+# factor by which to multiply the predicted duration of an import to
+# get its timeout, and the minimum such timeout (all in seconds).
+STATS_DEFAULT_TIMEOUT = 1800
+STATS_TIMEOUT_FACTOR = 3
+STATS_MIN_TIMEOUT = 300
+
+# Factor by which an import must exceed its predicted duration to be
+# reported as slow, and number of past imports to base predictions on.
+STATS_SLOW_FACTOR = 2
+STATS_HISTORY = 50
+
+# CSV fields containing IP addresses (or lists of them), MAC addresses,
+# and domain names, to be put in a standard form when removing
+# duplicate rows.
+DEDUP_ADDRESS_FIELDS = [
+    'address', 'addresses', 'end_address', 'ip_address', 'ipv4addr',
+    'ipv6_address', 'ipv6addr', 'netmask', 'start_address',
+]
+DEDUP_MAC_FIELDS = ['mac', 'mac_address']
+DEDUP_FQDN_FIELDS = ['canonical_name', 'dname', 'fqdn', 'mx', 'target']
+
+# Number of distinct rows to remember in memory when removing duplicate
+# rows, after which they are spilled to this many files on disk.
+DEDUP_MAX_KEYS = 1000000
+DEDUP_PARTITIONS = 64
+
+# Format of the records spilled to disk: hash of the row's key, hash of
+# its contents, and row number.
+DEDUP_RECORD = struct.Struct('>16s16sQ')
 
 
 # Define generic helper functions.
@@ -106,11 +307,167 @@ def get_cmd_args():
     )
     parser.add_argument(
         '--ib-profile',
-        action='store',
-        dest='ib_profile',
+        action='append',
+        dest='ib_profiles',
         # No default, value of None means use first section
         # (other than the DEFAULT section, if present).
-        help='profile in Infoblox configuration file',
+        help='profile in Infoblox configuration file (may be repeated '
+             'to import into several grids at once)',
+    )
+
+    parser.add_argument(
+        '--auth-cache',
+        action='store',
+        dest='auth_cache',
+        # No default, value of None means do not cache the auth cookie.
+        help='file in which to cache the WAPI authentication cookie',
+    )
+
+    parser.add_argument(
+        '--delta',
+        action='store',
+        dest='delta_index',
+        # No default, value of None means import the entire file.
+        help='index file of previously imported rows; import only changes',
+    )
+
+    parser.add_argument(
+        '--retry',
+        action='store',
+        dest='retries',
+        type=int,
+        default=0,
+        help='number of times to retry importing failed rows (default 0)',
+    )
+
+    parser.add_argument(
+        '--dedup',
+        action='store_true',
+        dest='dedup',
+        help='remove duplicate rows (comparing addresses and names in '
+             'normalized form) before importing',
+    )
+    parser.add_argument(
+        '--normalize',
+        action='store_true',
+        dest='normalize',
+        help='also import addresses and names in normalized form '
+             '(requires --dedup)',
+    )
+
+    parser.add_argument(
+        '--mode',
+        action='store',
+        dest='mode',
+        choices=['auto', 'csv', 'batch'],
+        default='auto',
+        help='import as CSV job, in batches of WAPI requests, or '
+             'choose automatically (default auto)',
+    )
+    parser.add_argument(
+        '--batch-threshold',
+        action='store',
+        dest='batch_threshold',
+        type=int,
+        default=500,
+        help='most rows to import in batches in auto mode (default 500)',
+    )
+    parser.add_argument(
+        '--batch-size',
+        action='store',
+        dest='batch_size',
+        type=int,
+        default=50,
+        help='objects per WAPI request in batch mode (default 50)',
+    )
+    parser.add_argument(
+        '--workers',
+        action='store',
+        dest='workers',
+        type=int,
+        default=4,
+        help='parallel WAPI requests in batch mode (default 4)',
+    )
+
+    parser.add_argument(
+        '--max-upload-rate',
+        action='store',
+        dest='max_upload_rate',
+        type=upload_parse_rate,
+        # No default, value of None means do not limit the upload rate.
+        help='maximum upload rate in bytes per second, optionally with '
+             'suffix K, M or G (e.g., 500K)',
+    )
+    parser.add_argument(
+        '--adaptive-upload',
+        action='store_true',
+        dest='adaptive_upload',
+        help='also slow the upload while round-trip time to the grid '
+             'is high (requires --max-upload-rate)',
+    )
+
+    parser.add_argument(
+        '--rows',
+        action='store',
+        dest='rows',
+        type=rows_parse_range,
+        # No default, value of None means import all rows.
+        help='import only lines START to END of the file, counting from 1 '
+             'and including header rows, as in progress messages (e.g., '
+             '1001-2000, or 5001- for the rest of the file)',
+    )
+    parser.add_argument(
+        '--section',
+        action='store',
+        dest='section',
+        # No default, value of None means import all sections.
+        help='import only the sections of the file for an object type '
+             '(e.g., network), each with its header row',
+    )
+
+    parser.add_argument(
+        '--progress-json',
+        action='store',
+        dest='progress_json',
+        # No default, value of None means no progress events.
+        help='file to which to write progress events ("-" for stdout)',
+    )
+
+    parser.add_argument(
+        '--state',
+        action='store',
+        dest='state_path',
+        # No default, value of None means imports cannot be resumed.
+        help='file in which to save import state for resuming imports',
+    )
+
+    parser.add_argument(
+        '--stats',
+        action='store',
+        dest='stats_path',
+        # No default, value of None means keep no import statistics.
+        help='file of past import statistics used to predict durations',
+    )
+    parser.add_argument(
+        '--estimate',
+        action='store_true',
+        dest='estimate',
+        help='predict import duration from --stats file, do not import',
+    )
+
+    parser.add_argument(
+        '--profile',
+        action='store',
+        dest='profile',
+        # No default, value of None means do not record a trace.
+        help='file in which to write a trace of phase and request timings',
+    )
+    parser.add_argument(
+        '--profile-stats',
+        action='store',
+        dest='profile_stats',
+        # No default, value of None means do not run cProfile.
+        help='file in which to write cProfile statistics',
     )
 
     parser.add_argument(
@@ -118,8 +475,17 @@ def get_cmd_args():
         action='store',
         dest='timeout',
         type=int,
-        default=1800,
-        help='maximum time to let job run (default 1800 seconds)',
+        # No default, value of None means set timeout from statistics.
+        help='maximum time to let job run (default based on past '
+             'imports, or 1800 seconds)',
+    )
+    parser.add_argument(
+        '--poll-interval',
+        action='store',
+        dest='poll_interval',
+        type=int,
+        default=30,
+        help='time between checks of job progress (default 30 seconds)',
     )
 
     # Add positional argument for specifying the CSV import file.
@@ -132,12 +498,38 @@ def get_cmd_args():
 
     # Parse the command line according to the definitions above.
     args = parser.parse_args()
+    if args.poll_interval < 1:
+        parser.error('--poll-interval must be at least 1 second')
 
     # Return argument values as a dictionary.
     cmd_args = {}
     cmd_args['ib_config'] = args.ib_config
-    cmd_args['ib_profile'] = args.ib_profile
+    cmd_args['ib_profiles'] = args.ib_profiles or [None]
+    cmd_args['auth_cache'] = args.auth_cache
+    cmd_args['delta_index'] = args.delta_index
+    cmd_args['retries'] = args.retries
+    cmd_args['dedup'] = args.dedup
+    cmd_args['normalize'] = args.normalize
     cmd_args['timeout'] = args.timeout
+    cmd_args['poll_interval'] = args.poll_interval
+    cmd_args['progress_json'] = args.progress_json
+    cmd_args['profile'] = args.profile
+    cmd_args['profile_stats'] = args.profile_stats
+    cmd_args['state_path'] = args.state_path
+    cmd_args['stats_path'] = args.stats_path
+    cmd_args['estimate'] = args.estimate
+    cmd_args['mode'] = args.mode
+    cmd_args['batch_threshold'] = args.batch_threshold
+    cmd_args['batch_size'] = max(args.batch_size, 1)
+    cmd_args['workers'] = max(args.workers, 1)
+    cmd_args['max_upload_rate'] = args.max_upload_rate
+    cmd_args['adaptive_upload'] = args.adaptive_upload
+    cmd_args['rows'] = args.rows
+    cmd_args['section'] = None
+    if args.section is not None:
+        cmd_args['section'] = args.section.strip().lower()
+        if cmd_args['section'].startswith('header-'):
+            cmd_args['section'] = cmd_args['section'][len('header-'):]
     cmd_args['csv_path'] = args.csv_path
     return cmd_args
 
@@ -227,6 +619,7 @@ def ib_get_config_info(config_file, ib_profile):
     # Look for WAPI access info, supply defaults if needed.
     profile_values = config[profile]
     grid = {}
+    grid['profile'] = profile
     grid['url'] = profile_values.get(
         'url',
         'https://gm.example.com/wapi/v1.1/',
@@ -237,16 +630,121 @@ def ib_get_config_info(config_file, ib_profile):
     return grid
 
 
-def ib_authenticate(grid):
-    """Access grid, return auth cookie and reference for later use."""
+def import_modules():
+    """Import the requests and urllib3 modules, if not already done."""
+    global requests, urllib3  # pylint: disable=C0103,W0603
+    if requests is not None:
+        return
+    with trace_output.trace_span('import modules', 'startup',
+                                 modules='requests, urllib3'):
+        import urllib3  # pylint: disable=C0415,W0621
+        import requests  # pylint: disable=C0415,W0621
+
+
+def ib_session(grid):
+    """Return a session with a pool of keep-alive connections to grid."""
+    import_modules()
     if not grid['valid_cert']:
         urllib3.disable_warnings()
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=IB_POOL_MAXSIZE,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.verify = grid['valid_cert']
+    session.hooks['response'].append(trace_output.trace_response)
+    return session
+
+
+def ib_auth_cache_key(grid):
+    """Return the key under which grid's auth cookie is cached."""
+    return '{} {}'.format(grid['url'], grid['userid'])
+
+
+def ib_read_auth_cache(grid):
+    """Return cached auth cookie and grid reference, or Nones if none."""
+    if not is_nonblank_string(grid.get('auth_cache')):
+        return (None, None)
     try:
-        rsp = requests.get(
+        with open(grid['auth_cache'], 'r') as cache_f:
+            cache = json.load(cache_f)
+        entry = cache[ib_auth_cache_key(grid)]
+        return (entry['auth_cookie'], entry['ref'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return (None, None)  # Missing, unreadable, or no entry for grid
+
+
+def ib_write_auth_cache(grid):
+    """Save grid's auth cookie to the auth cache file, if any."""
+    if not is_nonblank_string(grid.get('auth_cache')):
+        return
+
+    # Preserve entries for other grids and users, if present.
+    with IB_AUTH_CACHE_LOCK:
+        try:
+            with open(grid['auth_cache'], 'r') as cache_f:
+                cache = json.load(cache_f)
+            if not isinstance(cache, dict):
+                cache = {}
+        except (OSError, ValueError):
+            cache = {}
+        cache[ib_auth_cache_key(grid)] = {
+            'auth_cookie': grid['auth_cookie'],
+            'ref': grid['ref'],
+        }
+
+        # Make sure only the owner can read the cookie, even if the file
+        # already existed with looser permissions.
+        # NOTE: Failure to cache the cookie is not fatal.
+        try:
+            cache_fd = os.open(
+                grid['auth_cache'],
+                os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                0o600,
+            )
+            os.chmod(grid['auth_cache'], 0o600)
+            with os.fdopen(cache_fd, 'w') as cache_f:
+                json.dump(cache, cache_f)
+        except OSError as err:
+            print(err, file=sys.stderr)
+            print(
+                'Could not cache auth cookie in {}'.format(
+                    grid['auth_cache'],
+                ),
+                file=sys.stderr,
+            )
+
+
+def ib_set_auth_cookie(grid):
+    """Use grid's (cached) auth cookie for requests in grid's session."""
+    grid['session'].cookies.set(
+        'ibapauth',
+        grid['auth_cookie'],
+        domain=urllib.parse.urlsplit(grid['url']).hostname,
+        path='/',
+    )
+
+
+def ib_login(grid):
+    """Log in to grid with userid and password, return the response.
+
+    NOTE: The login uses a session of its own so that a stale auth
+    cookie is not sent with it, without clearing the cookie from grid's
+    session while other threads may be making requests in it.
+    """
+    with ib_session(grid) as session:
+        return session.get(
             grid['url'] + 'grid',
             auth=(grid['userid'], grid['password']),
-            verify=grid['valid_cert'],
         )
+
+
+def ib_authenticate(grid):
+    """Access grid, return auth cookie and reference for later use."""
+    try:
+        rsp = ib_login(grid)
     except requests.exceptions.RequestException as err:
         error_exit(
             'Error connecting to grid at "{}"'.format(grid['url']),
@@ -260,42 +758,313 @@ def ib_authenticate(grid):
     return rsp.cookies['ibapauth'], rsp.json()[0]['_ref']
 
 
-def ib_init(ib_config, ib_profile):
+def ib_reauthenticate(grid):
+    """Get a new auth cookie for grid and update the auth cache."""
+    with trace_output.trace_span('authenticate'):
+        (grid['auth_cookie'], grid['ref']) = ib_authenticate(grid)
+    ib_set_auth_cookie(grid)
+    ib_write_auth_cache(grid)
+
+
+def ib_request(grid, method, url, **kwargs):
+    """Make a WAPI request in grid's session, return the response.
+
+    If the grid rejects the auth cookie (e.g., because a cached cookie
+    has expired) then authenticate again and retry the request once.
+    """
+    cookie = grid['auth_cookie']
+    rsp = grid['session'].request(method, url, **kwargs)
+    if rsp.status_code != requests.codes.unauthorized:  # pylint: disable=E1101
+        return rsp
+    rsp.close()
+
+    # Only one thread needs to log in again for all of them.
+    with grid['auth_lock']:
+        if grid['auth_cookie'] == cookie:
+            ib_reauthenticate(grid)
+
+    # Rewind any file being uploaded before sending it again.
+    for file_obj in kwargs.get('files', {}).values():
+        if hasattr(file_obj, 'seek'):
+            file_obj.seek(0)
+    return grid['session'].request(method, url, **kwargs)
+
+
+def ib_init(ib_config, ib_profile, auth_cache=None):
     """Make first WAPI call, return grid object for future use."""
     config_file = ib_get_config_location(ib_config)
-    grid = ib_get_config_info(config_file, ib_profile)
-    (grid['auth_cookie'], grid['ref']) = ib_authenticate(grid)
+    with trace_output.trace_span('read config'):
+        grid = ib_get_config_info(config_file, ib_profile)
+    grid['auth_cache'] = auth_cache
+    grid['auth_lock'] = threading.Lock()
+    grid['session'] = ib_session(grid)
+
+    # Reuse a cached auth cookie if we have one, otherwise log in.
+    (grid['auth_cookie'], grid['ref']) = ib_read_auth_cache(grid)
+    if grid['auth_cookie'] is None:
+        ib_reauthenticate(grid)
+    else:
+        ib_set_auth_cookie(grid)
     return grid
 
 
-def ib_csv_import(grid, csv_path, timeout):
-    """Import contents of csv_path into grid, return name of error log."""
+def ib_progress_jsonl(out_f):
+    """Return progress callback that writes events to out_f as JSON."""
+    lock = threading.Lock()
+
+    def write_event(event):
+        with lock:
+            out_f.write(json.dumps(event) + '\n')
+            out_f.flush()
+    return write_event
+
+
+def ib_progress_init(grid, callback):
+    """Report CSV import progress for grid by calling callback.
+
+    The callback is passed a dictionary for each event; the "event" key
+    contains the type of event.
+    """
+    grid['progress'] = {
+        'callback': callback,
+        'marks': {},
+        'total_lines': None,
+        'sample': None,
+    }
+
+
+def ib_progress_begin(grid, csv_path):
+    """Start tracking progress of an import of csv_path."""
+    progress = grid.get('progress')
+    if progress is None:
+        return
+    progress['marks'] = {'start': time.time()}
+    progress['sample'] = None
 
-    # Open the CSV import file and make sure it exists.
+    # Count lines in the file so that we can estimate time to complete,
+    # using the index of its rows if there is one.
+    if grid.get('rows') is not None:
+        lines = rows_count(grid['rows'])
+    else:
+        lines = 0
+        try:
+            for chunk in csv_input_chunks(csv_path):
+                lines = lines + chunk.count(b'\n')
+        except OSError:
+            lines = None
+    progress['total_lines'] = lines
+    ib_progress_event(grid, 'begin', file=csv_path, total_lines=lines)
+
+
+def ib_progress_mark(grid, name):
+    """Record the time at which the import first reached a given point."""
+    progress = grid.get('progress')
+    if progress is not None and name not in progress['marks']:
+        progress['marks'][name] = time.time()
+
+
+def ib_progress_event(grid, event, **fields):
+    """Report a progress event with the given fields, if requested."""
+    progress = grid.get('progress')
+    if progress is None:
+        return
+    now = time.time()
+    fields['event'] = event
+    fields['profile'] = grid.get('profile')
+    fields['time'] = now
+    fields['elapsed'] = now - progress['marks'].get('start', now)
+    progress['callback'](fields)
+
+
+def ib_progress_rate(count, seconds):
+    """Return count per second, or None if seconds is zero."""
+    if seconds <= 0:
+        return None
+    return count / seconds
+
+
+def ib_progress_status(grid, result):
+    """Report progress of an import task given its status."""
+    progress = grid.get('progress')
+    if progress is None:
+        return
+    now = time.time()
+    processed = result['lines_processed']
+    if processed > 0 or result['status'] not in ('PENDING', 'QUEUED'):
+        ib_progress_mark(grid, 'dequeued')
+    if 'end_time' in result:
+        ib_progress_mark(grid, 'processed')
+
+    # Compute processing rates since the last check and overall.
+    instant_rate = None
+    if progress['sample'] is not None:
+        (last_time, last_processed) = progress['sample']
+        instant_rate = ib_progress_rate(processed - last_processed,
+                                        now - last_time)
+    progress['sample'] = (now, processed)
+    average_rate = None
+    if 'dequeued' in progress['marks']:
+        average_rate = ib_progress_rate(processed,
+                                        now - progress['marks']['dequeued'])
+    eta = None
+    if progress['total_lines'] and average_rate:
+        eta = max(progress['total_lines'] - processed, 0) / average_rate
+    position = {}
+    if grid.get('rows'):
+        position = rows_position(grid['rows'], processed)
+    ib_progress_event(
+        grid,
+        'progress',
+        status=result['status'],
+        lines_processed=processed,
+        lines_failed=result['lines_failed'],
+        total_lines=progress['total_lines'],
+        lines_per_second=instant_rate,
+        average_lines_per_second=average_rate,
+        eta_seconds=eta,
+        **position
+    )
+
+
+def ib_progress_summary(grid, lines_processed, lines_failed):
+    """Report how long each phase of the import took."""
+    progress = grid.get('progress')
+    if progress is None:
+        return
+    marks = progress['marks']
+    now = time.time()
+    phases = [
+        ('upload', 'start', 'uploaded'),
+        ('queue', 'import_started', 'dequeued'),
+        ('processing', 'dequeued', 'processed'),
+        ('error_log', 'processed', 'downloaded'),
+    ]
+    seconds = {}
+    for (phase, begin, end) in phases:
+        if begin in marks:
+            seconds[phase + '_seconds'] = marks.get(end, now) - marks[begin]
+    ib_progress_event(
+        grid,
+        'summary',
+        lines_processed=lines_processed,
+        lines_failed=lines_failed,
+        total_seconds=now - marks['start'],
+        **seconds
+    )
+
+
+def ib_csv_import(grid, csv_path, timeout, operation='INSERT',
+                  poll_interval=30):
+    """Import contents of csv_path into grid, return name of error log.
+
+    The name is blank if no errors occurred, and None if the import did
+    not complete within timeout seconds (or if timeout is None, a time
+    based on past imports).  Progress is checked every poll_interval
+    seconds.
+    """
+
+    # Write the objects directly if batch mode was chosen.
+    import batch_import  # pylint: disable=C0415
+    batch_rows = batch_import.batch_plan(grid, csv_path, operation)
+    if batch_rows is not None:
+        with trace_output.trace_span('batch import', file=csv_path):
+            return batch_import.batch_import(grid, batch_rows)
+
+    # Predict how long the import should take from past imports.
+    with trace_output.trace_span('count rows'):
+        rows = stats_count_rows(grid, csv_path)
+    predicted = stats_predict(grid, rows, operation)
+    if timeout is None:
+        timeout = stats_timeout(predicted)
+    if predicted is not None:
+        print('Predicted import time {:.0f} seconds (timeout {})'.format(
+            predicted,
+            timeout,
+        ))
+
+    # Index the rows of the file to show which section is being imported,
+    # if rows were selected or progress is being tracked.
+    with trace_output.trace_span('index rows'):
+        grid['rows'] = rows_init(grid, csv_path)
+
+    # Reattach to an import task already started for this file, if any.
+    with trace_output.trace_span('hash file'):
+        state_key = state_file_key(grid, csv_path, operation)
+    task = state_reattach(grid, state_key, csv_path, operation)
+    resumed = task is not None
+    ib_progress_begin(grid, csv_path)
+    if task is None:
+        with trace_output.trace_span('upload', file=csv_path):
+            upload_token = ib_csv_upload(grid, csv_path)
+        state_save(grid, state_key, csv_path, upload_token=upload_token)
+        with trace_output.trace_span('start import', file=csv_path):
+            task = ib_csv_start(grid, csv_path, upload_token, operation)
+        if task is None:
+            error_exit('Cannot import CSV file {}'.format(csv_path))
+        state_save(grid, state_key, csv_path, upload_token=upload_token,
+                   import_ref=task[0], import_id=task[1])
+    else:
+        ib_progress_mark(grid, 'uploaded')
+    (import_ref, import_id) = task
+    ib_progress_mark(grid, 'import_started')
+    ib_progress_event(grid, 'import', import_id=import_id)
+
+    # Display ongoing status of CSV import.
+    (processed, failed, completed) = ib_display_import_progress(
+        grid,
+        import_ref,
+        timeout,
+        poll_interval,
+    )
+
+    # Return pathname of CSV error log if any errors occurred.
+    error_log = ''
+    if not completed:
+        error_log = None
+    elif failed > 0:
+        with trace_output.trace_span('download error log',
+                                     import_id=import_id):
+            error_log = ib_get_csv_error_log(grid, import_id)
+    if completed:
+        state_clear(grid, state_key)
+    ib_progress_summary(grid, processed, failed)
+    stats_record(grid, csv_path, operation, rows, predicted,
+                 (processed, failed, completed), resumed)
+    return error_log
+
+
+def ib_csv_upload(grid, csv_path):
+    """Upload csv_path to grid and return the upload token."""
+
+    # Make sure the CSV import file (or its parts) exist.
+    limiter = None
+    if grid.get('upload') is not None:
+        limiter = UploadLimiter(
+            grid['url'],
+            grid['upload']['max_rate'],
+            grid['upload']['adaptive'],
+        )
     try:
-        csv_in = open(csv_path, 'rb')
+        upload_body = CsvUploadBody(csv_path, limiter)
     except OSError as err:
         error_exit(
             'Error opening CSV file {}'.format(csv_path),
             err,
         )
 
-    # Authentication info for the grid.
-    req_cookies = {'ibapauth': grid['auth_cookie']}
-
     # Initiate a file upload operation, providing a filename (with
     # alphanumeric, underscore, or periods only) for use by the CSV
     # job manager.
     req_params = {
         '_function': 'uploadinit',
-        'filename': sanitized_filename(csv_path),
+        'filename': upload_body.filename,
         }
     try:
-        rsp = requests.post(
+        rsp = ib_request(
+            grid,
+            'POST',
             grid['url'] + 'fileop',
             params=req_params,
-            cookies=req_cookies,
-            verify=grid['valid_cert'],
         )
     except requests.exceptions.RequestException as err:
         error_exit(
@@ -314,23 +1083,22 @@ def ib_csv_import(grid, csv_path, timeout):
     upload_url = result['url']
     upload_token = result['token']
 
-    # Specify a file handle for the file data to be uploaded.
-    req_files = {'filedata': csv_in}
-
     # Specify the name of the file (not used?).
-    req_params = {'name': sanitized_filename(csv_path)}
+    req_params = {'name': upload_body.filename}
 
-    # Perform the actual upload.
+    # Perform the actual upload, streaming the file data as form data.
     # NOTE: This WAPI call does NOT return a JSON result.
+    upload_start = time.time()
     try:
-        rsp = requests.post(
+        rsp = ib_request(
+            grid,
+            'POST',
             upload_url,
             params=req_params,
-            files=req_files,
-            cookies=req_cookies,
-            verify=grid['valid_cert'],
+            data=upload_body,
+            headers={'Content-Type': upload_body.content_type},
         )
-    except requests.exceptions.RequestException as err:
+    except (requests.exceptions.RequestException, OSError) as err:
         error_exit(
             'Error uploading CSV file {}'.format(csv_path),
             err,
@@ -340,22 +1108,46 @@ def ib_csv_import(grid, csv_path, timeout):
             'Cannot upload CSV file {}'.format(csv_path),
             rsp,
         )
+    upload_bytes = upload_body.bytes_sent
+    if limiter is not None:
+        upload_report(limiter, upload_bytes, time.time() - upload_start)
+    ib_progress_mark(grid, 'uploaded')
+    if grid.get('progress') is not None:
+        marks = grid['progress']['marks']
+        ib_progress_event(
+            grid,
+            'upload',
+            bytes=upload_bytes,
+            bytes_per_second=ib_progress_rate(
+                upload_bytes,
+                marks['uploaded'] - marks['start'],
+            ),
+        )
+    return upload_token
 
-    # Initiate the actual import task. Attempt to add the records in
-    # the CSV file, and do not terminate on errors.
+
+def ib_csv_start(grid, csv_path, upload_token, operation):
+    """Start import of uploaded file, return task reference and ID.
+
+    Return None if the grid refuses to start the import.
+    """
+
+    # Initiate the actual import task. Attempt to add (or update or
+    # delete) the records in the CSV file, and do not terminate on
+    # errors.
     req_params = {
         'token': upload_token,
         'doimport': True,
         'on_error': 'CONTINUE',
-        'operation': 'INSERT',
+        'operation': operation,
         'update_method': 'OVERRIDE'
     }
     try:
-        rsp = requests.post(
+        rsp = ib_request(
+            grid,
+            'POST',
             grid['url'] + 'fileop?_function=csv_import',
             params=req_params,
-            cookies=req_cookies,
-            verify=grid['valid_cert']
         )
     except requests.exceptions.RequestException as err:
         error_exit(
@@ -363,41 +1155,33 @@ def ib_csv_import(grid, csv_path, timeout):
             err,
         )
     if rsp.status_code != requests.codes.ok:  # pylint: disable=E1101
-        ib_error_exit(
-            'Cannot import CSV file {}'.format(csv_path),
-            rsp,
-        )
+        ib_error_print(rsp)
+        return None
 
-    # Record cvsimporttask object reference and import ID for later use.
+    # Return cvsimporttask object reference and import ID for later use.
     # NOTE: This WAPI call returns a single dictionary.
     result = rsp.json()
-    import_ref = result['csv_import_task']['_ref']
-    import_id = result['csv_import_task']['import_id']
-
-    # Display ongoing status of CSV import.
-    (_, failed) = ib_display_import_progress(grid, import_ref, timeout)
-
-    # Return pathname of CSV error log if any errors occurred.
-    if failed <= 0:
-        return ''
-    return ib_get_csv_error_log(grid, import_id)
+    return (
+        result['csv_import_task']['_ref'],
+        result['csv_import_task']['import_id'],
+    )
 
 
-def ib_display_import_progress(grid, import_ref, timeout):
-    """Display import_ref progress, return # lines that succeeded, failed."""
+def ib_display_import_progress(grid, import_ref, timeout, poll_interval=30):
+    """Display import_ref progress, return # lines processed, failed.
 
-    # Authentication info for the grid.
-    req_cookies = {'ibapauth': grid['auth_cookie']}
+    Also return whether the import completed within timeout seconds.
+    """
 
     # Loop up to timeout seconds to see if CSV import is complete.
     completed = False
     time_so_far = 0
     while time_so_far < timeout:
         try:
-            rsp = requests.get(
+            rsp = ib_request(
+                grid,
+                'GET',
                 grid['url'] + import_ref,
-                cookies=req_cookies,
-                verify=grid['valid_cert']
             )
         except requests.exceptions.RequestException as err:
             error_exit(
@@ -413,6 +1197,7 @@ def ib_display_import_progress(grid, import_ref, timeout):
         # Check to see if import has been completed (end time is set).
         # NOTE: This WAPI call returns a single dictionary.
         result = rsp.json()
+        ib_progress_status(grid, result)
         if 'end_time' in result:
             print(('Imported {} lines '
                    '({} failed)').format(
@@ -430,19 +1215,64 @@ def ib_display_import_progress(grid, import_ref, timeout):
                    result['lines_failed'],
                )
         )
-        time_so_far = time_so_far + 30
-        time.sleep(30)
+        position = {}
+        if grid.get('rows'):
+            position = rows_position(grid['rows'], result['lines_processed'])
+        if position:
+            print('  {}'.format(rows_describe(position)))
+        time_so_far = time_so_far + poll_interval
+        with trace_output.trace_span('wait', cat='sleep'):
+            stopped = FANOUT_STOP.wait(poll_interval)
+        if stopped:
+            error_exit('Interrupted while importing (CSV task {})'.format(
+                import_ref,
+            ))
 
     if not completed:
         print('Import did not complete in {} seconds'.format(timeout))
-    return (result['lines_processed'], result['lines_failed'])
+    return (result['lines_processed'], result['lines_failed'], completed)
+
+
+def ib_csv_import_retry(grid, csv_path, timeout, retries, operation='INSERT',
+                        poll_interval=30):
+    """Import csv_path, then retry failed rows up to retries times.
+
+    Return the name of the error log for the last attempt, as for
+    ib_csv_import.
+    """
+    error_log = ib_csv_import(
+        grid,
+        csv_path,
+        timeout,
+        operation,
+        poll_interval,
+    )
+    attempt = 0
+    while attempt < retries and is_nonblank_string(error_log):
+        retry_path = csv_retry_path(error_log)
+        if os.path.getsize(retry_path) == 0:
+            break  # No failed rows could be recovered from the log
+        attempt = attempt + 1
+        print('Retrying failed rows from {} (attempt {} of {})'.format(
+            retry_path,
+            attempt,
+            retries,
+        ))
+        error_log = ib_csv_import(
+            grid,
+            retry_path,
+            timeout,
+            operation,
+            poll_interval,
+        )
+    return error_log
 
 
 def ib_get_csv_error_log(grid, import_id):
-    """Download CSV error log for import_id and return pathname."""
+    """Download CSV error log for import_id and return pathname.
 
-    # Authentication info for the grid.
-    req_cookies = {'ibapauth': grid['auth_cookie']}
+    Also summarize the failures and write a CSV file of the failed rows.
+    """
 
     # Request download of the CSV error log.
     req_params = {'_function': 'csv_error_log'}
@@ -450,12 +1280,12 @@ def ib_get_csv_error_log(grid, import_id):
         'import_id': import_id,
     }
     try:
-        rsp = requests.post(
+        rsp = ib_request(
+            grid,
+            'POST',
             grid['url'] + 'fileop',
             params=req_params,
             data=json.dumps(req_data),
-            cookies=req_cookies,
-            verify=grid['valid_cert'],
             )
     except requests.exceptions.RequestException as err:
         error_exit(
@@ -475,13 +1305,15 @@ def ib_get_csv_error_log(grid, import_id):
     csv_token = result['token']
 
     # Download the error log contents using the provided URL.
+    # NOTE: The log is streamed rather than read into memory at once.
     req_headers = {'Content-type': 'application/force-download'}
     try:
-        rsp = requests.get(
+        rsp = ib_request(
+            grid,
+            'GET',
             csv_url,
             headers=req_headers,
-            cookies=req_cookies,
-            verify=grid['valid_cert'],
+            stream=True,
             )
     except requests.exceptions.RequestException as err:
         error_exit(
@@ -494,21 +1326,47 @@ def ib_get_csv_error_log(grid, import_id):
             rsp,
         )
 
-    # Create unique temporary filename for CSV output, write it out.
-    csv_fn = tempfile.mktemp('.csv')
-    with open(csv_fn, 'wb') as csv_output:
-        csv_output.write(rsp.content)
+    # Create unique temporary file for CSV output, write the log to it
+    # as it arrives, and analyze it along the way.
+    (csv_fd, csv_fn) = tempfile.mkstemp('.csv')
+    download_start = time.time()
+    try:
+        with os.fdopen(csv_fd, 'wb') as csv_output:
+            summary = csv_analyze_error_log(
+                rsp.iter_content(chunk_size=IB_CHUNK_SIZE),
+                csv_output,
+                csv_retry_path(csv_fn),
+            )
+            download_bytes = csv_output.tell()
+    except (OSError, requests.exceptions.RequestException) as err:
+        error_exit(
+            'Error downloading error log for CSV import {}'.format(import_id),
+            err,
+        )
+    finally:
+        rsp.close()
+    ib_progress_mark(grid, 'downloaded')
+    ib_progress_event(
+        grid,
+        'download',
+        bytes=download_bytes,
+        bytes_per_second=ib_progress_rate(
+            download_bytes,
+            time.time() - download_start,
+        ),
+    )
+    csv_print_error_summary(summary)
 
     # Tell Infoblox system the download is complete.
     req_params = {'_function': 'downloadcomplete'}
     req_data = {'token': csv_token}
     try:
-        rsp = requests.post(
+        rsp = ib_request(
+            grid,
+            'POST',
             grid['url'] + 'fileop',
             params=req_params,
             data=json.dumps(req_data),
-            cookies=req_cookies,
-            verify=grid['valid_cert'],
             )
     except requests.exceptions.RequestException as err:
         error_exit(
@@ -525,22 +1383,1688 @@ def ib_get_csv_error_log(grid, import_id):
     return csv_fn
 
 
+# Define CSV file-related functions.
+class CsvUploadBody:
+    """Multipart form data for uploading a CSV file, read as it is sent.
+
+    The body can be iterated over more than once, so that the upload
+    can be retried.  Its length is known (and sent as Content-Length)
+    only for a single uncompressed file.
+    """
+
+    def __init__(self, csv_path, limiter=None):
+        self.csv_path = csv_path
+        self.limiter = limiter
+        self.filename = csv_upload_name(csv_path)
+        boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(
+            boundary,
+        )
+        self.head = (
+            '--{}\r\n'
+            'Content-Disposition: form-data; name="filedata"; '
+            'filename="{}"\r\n\r\n'
+        ).format(boundary, self.filename).encode('ascii')
+        self.tail = '\r\n--{}--\r\n'.format(boundary).encode('ascii')
+        self.bytes_sent = 0
+        self.len = None
+        paths = csv_input_paths(csv_path)
+        if csv_path in ROWS_SLICES:
+            self.len = (len(self.head) + rows_size(ROWS_SLICES[csv_path])
+                        + len(self.tail))
+        elif len(paths) == 1 and csv_is_plain(paths[0]):
+            self.len = (len(self.head) + os.path.getsize(paths[0])
+                        + len(self.tail))
+
+    def __iter__(self):
+        self.bytes_sent = 0
+        if self.limiter is not None:
+            self.limiter.start()
+        try:
+            yield self.head
+            for chunk in csv_input_chunks(self.csv_path):
+                if self.limiter is not None:
+                    self.limiter.wait(len(chunk))
+                self.bytes_sent = self.bytes_sent + len(chunk)
+                yield chunk
+            yield self.tail
+        finally:
+            if self.limiter is not None:
+                self.limiter.stop()
+
+
+def csv_is_pattern(path):
+    """Return whether path is a wildcard pattern rather than a file."""
+    return any(char in path for char in '*?[')
+
+
+def csv_is_plain(path):
+    """Return whether path names a single uncompressed file."""
+    return (not csv_is_pattern(path)
+            and not path.lower().endswith(('.gz', '.zip')))
+
+
+def csv_upload_name(csv_path):
+    """Return sanitized name under which to upload csv_path."""
+    name = os.path.basename(csv_path)
+    for suffix in ('.gz', '.zip'):
+        if name.lower().endswith(suffix):
+            name = name[:-len(suffix)]
+    name = sanitized_filename(name.replace('*', 'all'))
+    if not name.lower().endswith('.csv'):
+        name = name + '.csv'
+    return name
+
+
+def csv_input_paths(csv_path):
+    """Return sorted list of files matching csv_path, or raise OSError."""
+    if not csv_is_pattern(csv_path):
+        if not os.path.isfile(csv_path):
+            raise FileNotFoundError('No such file: {}'.format(csv_path))
+        return [csv_path]
+    paths = sorted(glob.glob(csv_path))
+    if not paths:
+        raise FileNotFoundError('No files match {}'.format(csv_path))
+    return paths
+
+
+def csv_input_parts(path):
+    """Yield binary file object for each part of a (compressed) file.
+
+    A .zip file may contain several parts, which are read in order of
+    their names.
+    """
+    if path.lower().endswith('.gz'):
+        with gzip.open(path, 'rb') as part:
+            yield part
+    elif path.lower().endswith('.zip'):
+        try:
+            with zipfile.ZipFile(path) as zip_f:
+                for name in sorted(zip_f.namelist()):
+                    if name.endswith('/'):
+                        continue  # Directory entry
+                    with zip_f.open(name) as part:
+                        yield part
+        except zipfile.BadZipFile as err:
+            raise OSError('Bad zip file {}: {}'.format(path, err))
+    else:
+        with open(path, 'rb') as part:
+            yield part
+
+
+def csv_input_lines(csv_path):
+    """Yield lines of text of all parts of csv_path, as one CSV file.
+
+    A header row identical to the last one seen for its object type
+    (e.g., one repeated at the start of each part) is dropped.
+    NOTE: Only the first line of a multi-line row is checked, and
+    header rows are compared as text rather than field by field.
+    """
+    headers = {}
+    for path in csv_input_paths(csv_path):
+        for part in csv_input_parts(path):
+            text_in = io.TextIOWrapper(part, encoding='utf-8-sig',
+                                       newline='')
+            for line in text_in:
+                if line[:7].lower() == 'header-':
+                    obj_type = line.split(',', 1)[0].strip().lower()
+                    if headers.get(obj_type) == line.rstrip('\r\n'):
+                        continue
+                    headers[obj_type] = line.rstrip('\r\n')
+                if not line.endswith('\n'):
+                    line = line + '\r\n'  # Last line of part
+                yield line
+
+
+def csv_input_chunks(csv_path):
+    """Yield contents of csv_path (or all its parts) in binary chunks.
+
+    Only the rows selected by --rows or --section, if any, are read.
+    """
+    if csv_path in ROWS_SLICES:
+        yield from rows_chunks(csv_path, ROWS_SLICES[csv_path])
+        return
+    paths = csv_input_paths(csv_path)
+    if len(paths) == 1 and csv_is_plain(paths[0]):
+        with open(paths[0], 'rb') as csv_in:
+            yield from iter(lambda: csv_in.read(IB_CHUNK_SIZE), b'')
+        return
+    chunk = []
+    size = 0
+    for line in csv_input_lines(csv_path):
+        data = line.encode('utf-8')
+        chunk.append(data)
+        size = size + len(data)
+        if size >= IB_CHUNK_SIZE:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+def csv_open(csv_path):
+    """Open csv_path for reading as text by csv.reader.
+
+    Compressed files and wildcard patterns matching several parts are
+    read as a single file using csv_input_lines, and only the rows
+    selected by --rows or --section, if any, are read.
+    """
+    if csv_path in ROWS_SLICES:
+        return contextlib.closing(
+            csv_stream_lines(csv_input_chunks(csv_path), None),
+        )
+    if csv_is_plain(csv_path):
+        return open(csv_path, 'r', newline='', encoding='utf-8-sig')
+    csv_input_paths(csv_path)  # Raise OSError now if there are no files
+    return contextlib.closing(csv_input_lines(csv_path))
+
+
+def csv_field_name(field):
+    """Return field name from CSV header without case or markers."""
+    return field.strip().rstrip('*').lower()
+
+
+def csv_key_fields(obj_type, header):
+    """Return indexes in header of the fields identifying an object."""
+    names = [csv_field_name(field) for field in header]
+    keys = [
+        names.index(name)
+        for name in IB_CSV_KEY_FIELDS.get(obj_type, [])
+        if name in names
+    ]
+    if not keys:
+        keys = [
+            idx
+            for idx, field in enumerate(header)
+            if idx > 0 and field.strip().endswith('*')
+        ]
+    if not keys:
+        keys = list(range(1, len(header)))
+    return keys
+
+
+def csv_data_rows(csv_file):
+    """Yield object type, header row, and row for each CSV data row.
+
+    The header row is the most recent "header-<type>" row for the
+    object type, or an empty list if there was none.
+    """
+    headers = {}
+    for row in csv.reader(csv_file):
+        if not row or not is_nonblank_string(row[0]):
+            continue  # Blank line
+        obj_type = row[0].strip().lower()
+        if obj_type.startswith('#'):
+            continue  # Comment line
+        if obj_type.startswith('header-'):
+            headers[obj_type[len('header-'):]] = row
+            continue
+        yield (obj_type, headers.get(obj_type, []), row)
+
+
+def csv_row_key(obj_type, header, row):
+    """Return string identifying the object in a CSV data row."""
+    if not header:
+        return json.dumps([obj_type, row[1:]])
+    values = [
+        row[idx].strip().lower() if idx < len(row) else ''
+        for idx in csv_key_fields(obj_type, header)
+    ]
+    return json.dumps([obj_type, values])
+
+
+def csv_row_hash(header, row):
+    """Return hash of CSV data row contents, ignoring field order."""
+    if not header:
+        fields = list(enumerate(row))
+    else:
+        fields = sorted(
+            (csv_field_name(field), row[idx] if idx < len(row) else '')
+            for idx, field in enumerate(header)
+        )
+    return hashlib.sha1(json.dumps(fields).encode('utf-8')).hexdigest()
+
+
+def csv_writerow(csv_writer, headers_written, obj_type, header, row):
+    """Write CSV data row, preceded by its header row if needed."""
+    if header and headers_written.get(obj_type) != header:
+        csv_writer.writerow(header)
+        headers_written[obj_type] = header
+    csv_writer.writerow(row)
+
+
+def csv_error_rows(lines):
+    """Yield object type, header, row, and error message for failed rows.
+
+    The error log for a CSV import contains the header rows and failed
+    data rows of the original file, with the error messages in extra
+    columns.  Rather than depend on where the extra columns are, we
+    look for the "header-<type>" column in each header row and treat
+    any columns before it or after the last header field as part of the
+    error message.
+    """
+    headers = {}
+    offset = 0
+    for row in csv.reader(lines):
+        # Save header rows, noting where the header fields start.
+        header_idx = None
+        for (idx, cell) in enumerate(row):
+            if cell.strip().lower().startswith('header-'):
+                header_idx = idx
+                break
+        if header_idx is not None:
+            offset = header_idx
+            obj_type = row[offset].strip().lower()[len('header-'):]
+            headers[obj_type] = row[offset:]
+            continue
+        if len(row) <= offset or not is_nonblank_string(row[offset]):
+            continue  # Blank line
+
+        # Separate the data fields from the error message fields.
+        obj_type = row[offset].strip().lower()
+        header = headers.get(obj_type, [])
+        end = offset + len(header) if header else len(row)
+        extra = row[:offset] + row[end:]
+        msg = ' '.join(cell.strip() for cell in extra if cell.strip())
+        yield (obj_type, header, row[offset:end], msg or 'Unknown error')
+
+
+def csv_stream_lines(chunks, out_f):
+    """Write chunks of bytes to out_f (unless None), yield lines of text."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    pending = ''
+    for chunk in chunks:
+        if out_f is not None:
+            out_f.write(chunk)
+        lines = (pending + decoder.decode(chunk)).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    pending = pending + decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def csv_retry_path(error_log):
+    """Return pathname of CSV file of failed rows for an error log."""
+    return os.path.splitext(error_log)[0] + '_retry.csv'
+
+
+def csv_analyze_error_log(chunks, out_f, retry_path):
+    """Save CSV error log to out_f, write failed rows to retry_path.
+
+    Return dictionary mapping (object type, error message) to the
+    number of failed rows.
+    """
+    summary = {}
+    with open(retry_path, 'w', newline='', encoding='utf-8') as retry_f:
+        retry_writer = csv.writer(retry_f)
+        headers_written = {}
+        log_lines = csv_stream_lines(chunks, out_f)
+        for (obj_type, header, row, msg) in csv_error_rows(log_lines):
+            csv_writerow(retry_writer, headers_written, obj_type, header, row)
+            summary[(obj_type, msg)] = summary.get((obj_type, msg), 0) + 1
+    return summary
+
+
+def csv_print_error_summary(summary):
+    """Print number of failed rows by object type and error message."""
+    print('CSV import failures by object type and error:')
+    for ((obj_type, msg), count) in sorted(
+            summary.items(),
+            key=lambda item: (-item[1], item[0]),
+    ):
+        print('{:>8}  {}: {}'.format(count, obj_type, msg))
+
+
+def csv_error_keys(error_log):
+    """Return set of keys for the rows in a CSV error log."""
+    keys = set()
+    if not is_nonblank_string(error_log):
+        return keys
+    with open(error_log, 'r', newline='', encoding='utf-8-sig') as log_f:
+        for (obj_type, header, row, _) in csv_error_rows(log_f):
+            keys.add(csv_row_key(obj_type, header, row))
+    return keys
+
+
+# Define functions for indexing and selecting rows of CSV files.
+def rows_parse_range(text):
+    """Return (first, last) row numbers given as e.g. 1001-2000.
+
+    Rows are numbered from 1.  A range such as "5001-" runs to the end
+    of the file (last is None), and a single number selects one row.
+    """
+    (first, sep, last) = text.partition('-')
+    try:
+        first = int(first)
+        if not sep:
+            last = first
+        elif last.strip():
+            last = int(last)
+        else:
+            last = None
+    except ValueError:
+        first = 0
+    if first < 1 or (last is not None and last < first):
+        raise argparse.ArgumentTypeError(
+            'invalid row range {}'.format(text),
+        )
+    return (first, last)
+
+
+def rows_index(csv_path):
+    """Return an index of the lines and sections of an uncompressed file.
+
+    The index holds the byte offset at which each line starts, followed
+    by the size of the file, and the line number (counting from 0) and
+    object type of each "header-<type>" row, which starts a section of
+    the file.  It is built in a single pass over the memory-mapped file.
+    NOTE: Each line counts as a row, including the lines of a row with
+    a quoted field containing a newline.
+    """
+    sections = []
+    with open(csv_path, 'rb') as csv_in:
+        size = os.fstat(csv_in.fileno()).st_size
+        # NOTE: 4-byte offsets are enough for files smaller than 4 GB.
+        offsets = array.array('I' if size < 2 ** 32 else 'Q')
+        if size == 0:
+            offsets.append(0)
+            return {'offsets': offsets, 'sections': sections}
+        with mmap.mmap(csv_in.fileno(), 0,
+                       access=mmap.ACCESS_READ) as csv_map:
+            base = 0
+            if csv_map[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8:
+                base = len(codecs.BOM_UTF8)
+            offsets.append(base)
+            while base < size:
+                # Scan a block ending at the end of a line (unless it is
+                # the last), adding the offset at which each line in it
+                # ends, i.e., where the next line starts.
+                block = csv_map[base:base + ROWS_BLOCK_SIZE]
+                end = block.rfind(b'\n') + 1
+                if end > 0 and base + len(block) < size:
+                    block = block[:end]
+                for match in ROWS_HEADER_RE.finditer(b'\n' + block):
+                    sections.append((base + match.start(), match.group(1)))
+                offsets.extend(itertools.islice(
+                    itertools.accumulate(
+                        map(operator.add,
+                            map(len, block.split(b'\n')[:-1]),
+                            itertools.repeat(1)),
+                        initial=base,
+                    ),
+                    1,
+                    None,
+                ))
+                base = base + len(block)
+    if offsets[-1] != size:
+        offsets.append(size)  # Last line does not end with a newline
+    return {
+        'offsets': offsets,
+        'sections': [
+            (bisect.bisect_right(offsets, offset) - 1,
+             obj_type.decode('utf-8', 'replace').strip().lower())
+            for (offset, obj_type) in sections
+        ],
+    }
+
+
+def rows_slice(index, row_range=None, section=None):
+    """Return the rows of an indexed file selected for import.
+
+    The rows are those in row_range (first and last row numbers,
+    counting from 1) in the sections for object type section, or all
+    rows if these are None.  The result holds the index, the ranges of
+    lines (first and end line numbers, counting from 0, end exclusive)
+    to read in order, each preceded by the header row of its section,
+    and the numbers of the sections that the ranges are in.
+    """
+    lines = len(index['offsets']) - 1
+    (first, last) = row_range or (1, None)
+    first = first - 1
+    last = lines if last is None else min(last, lines)
+
+    # Take the selected rows from each section, including the lines
+    # before the first header row, if any.
+    bounds = [(0, None, None)] + [
+        (line, line, obj_type) for (line, obj_type) in index['sections']
+    ] + [(lines, None, None)]
+    ranges = []
+    numbers = []
+    for (number, (begin, header, obj_type)) in enumerate(bounds[:-1]):
+        if section is not None and obj_type != section:
+            continue
+        low = max(begin, first)
+        high = min(bounds[number + 1][0], last)
+        if low >= high:
+            continue
+        if header is not None and low > header:
+            ranges.append((header, header + 1))
+        if ranges and ranges[-1][1] == low:
+            ranges[-1] = (ranges[-1][0], high)
+        else:
+            ranges.append((low, high))
+        numbers.append(number - 1)  # -1 is before the first section
+    return {'index': index, 'ranges': ranges, 'sections': numbers}
+
+
+def rows_count(rows):
+    """Return the number of lines in the selected rows."""
+    return sum(end - first for (first, end) in rows['ranges'])
+
+
+def rows_size(rows):
+    """Return the number of bytes in the selected rows."""
+    offsets = rows['index']['offsets']
+    return sum(offsets[end] - offsets[first]
+               for (first, end) in rows['ranges'])
+
+
+def rows_chunks(csv_path, rows):
+    """Yield the selected rows of csv_path in binary chunks."""
+    offsets = rows['index']['offsets']
+    with open(csv_path, 'rb') as csv_in:
+        for (first, end) in rows['ranges']:
+            csv_in.seek(offsets[first])
+            remaining = offsets[end] - offsets[first]
+            while remaining > 0:
+                chunk = csv_in.read(min(remaining, IB_CHUNK_SIZE))
+                if not chunk:
+                    raise OSError('File {} changed while being read'.format(
+                        csv_path,
+                    ))
+                remaining = remaining - len(chunk)
+                yield chunk
+
+
+def rows_init(grid, csv_path):
+    """Return the selected rows of csv_path, for showing progress.
+
+    If no rows were selected, return all rows if progress is being
+    tracked for grid (which then needs the number of lines anyway) and
+    the file can be indexed (i.e., is not compressed), else None.
+    Return None for a file with no rows.
+    """
+    rows = ROWS_SLICES.get(csv_path)
+    if rows is not None:
+        return rows
+    if grid.get('progress') is None or not csv_is_plain(csv_path):
+        return None
+    try:
+        rows = rows_slice(rows_index(csv_path))
+    except (OSError, ValueError):
+        return None
+    return rows if rows['ranges'] else None
+
+
+def rows_position(rows, processed):
+    """Return where in the file an import has got to.
+
+    processed is the number of lines of the uploaded rows processed so
+    far.  The result holds the row being imported (counting from 1),
+    the object type of its section (None if before the first section),
+    the number of the section among those selected, and the number of
+    rows of the section done and selected.  It is empty if no rows are
+    selected.
+    """
+    if not rows['ranges']:
+        return {}
+
+    # NOTE: Rows before the one being imported are done, or all rows if
+    # the import has got past the last one.
+    row = rows['ranges'][-1][1] - 1
+    upto = row + 1
+    remaining = processed
+    for (first, end) in rows['ranges']:
+        if remaining < end - first:
+            row = first + remaining
+            upto = row
+            break
+        remaining = remaining - (end - first)
+
+    # Find the section and count its rows done and selected.
+    sections = rows['index']['sections']
+    number = bisect.bisect_right([line for (line, _) in sections], row) - 1
+    begin = sections[number][0] if number >= 0 else 0
+    stop = (sections[number + 1][0] if number + 1 < len(sections)
+            else len(rows['index']['offsets']) - 1)
+    done = 0
+    selected = 0
+    for (first, end) in rows['ranges']:
+        selected = selected + max(min(end, stop) - max(first, begin), 0)
+        done = done + max(min(end, stop, upto) - max(first, begin), 0)
+    return {
+        'row': row + 1,
+        'section': sections[number][1] if number >= 0 else None,
+        'section_number': rows['sections'].index(number) + 1,
+        'sections': len(rows['sections']),
+        'section_done': done,
+        'section_rows': selected,
+    }
+
+
+def rows_describe(position):
+    """Return description of where an import has got to."""
+    if position['section'] is None:
+        return 'at row {}'.format(position['row'])
+    return 'section {} ({} of {}): {} of {} rows, at row {}'.format(
+        position['section'],
+        position['section_number'],
+        position['sections'],
+        position['section_done'],
+        position['section_rows'],
+        position['row'],
+    )
+
+
+def rows_select(cmd_args):
+    """Select the rows of the CSV file to import, or exit."""
+    csv_path = cmd_args['csv_path']
+    if not csv_is_plain(csv_path):
+        error_exit('The --rows and --section options require a single '
+                   'uncompressed CSV file')
+    # NOTE: The delta index would lose the rows not selected.
+    if is_nonblank_string(cmd_args['delta_index']):
+        error_exit('The --rows and --section options cannot be used with '
+                   '--delta')
+    try:
+        with trace_output.trace_span('index rows', file=csv_path):
+            index = rows_index(csv_path)
+    except (OSError, ValueError) as err:
+        error_exit('Error reading CSV file {}'.format(csv_path), err)
+    rows = rows_slice(index, cmd_args['rows'], cmd_args['section'])
+    if not rows['ranges']:
+        error_exit('No rows selected from CSV file {}'.format(csv_path))
+    ROWS_SLICES[csv_path] = rows
+    print('Importing {} of {} rows of {} (sections: {})'.format(
+        rows_count(rows),
+        len(index['offsets']) - 1,
+        csv_path,
+        ', '.join(index['sections'][number][1] if number >= 0 else 'none'
+                  for number in rows['sections']),
+    ))
+
+
+# Define functions for limiting upload bandwidth.
+def upload_parse_rate(text):
+    """Return rate in bytes per second given as e.g. 500K or 2M."""
+    multiplier = UPLOAD_RATE_UNITS.get(text[-1:].upper(), 1)
+    number = text[:-1] if multiplier != 1 else text
+    try:
+        rate = float(number) * multiplier
+    except ValueError:
+        rate = 0
+    if rate <= 0:
+        raise argparse.ArgumentTypeError(
+            'invalid upload rate {}'.format(text),
+        )
+    return rate
+
+
+def upload_format_rate(rate):
+    """Return rate in bytes per second in a readable form (e.g., 2.0M)."""
+    for (suffix, multiplier) in sorted(UPLOAD_RATE_UNITS.items(),
+                                       key=lambda item: -item[1]):
+        if rate >= multiplier:
+            return '{:.1f}{}'.format(rate / multiplier, suffix)
+    return '{:.0f}'.format(rate)
+
+
+def upload_init(grid, max_rate, adaptive):
+    """Set up grid for uploads limited to max_rate bytes per second."""
+    grid['upload'] = {'max_rate': max_rate, 'adaptive': adaptive}
+
+
+def upload_report(limiter, upload_bytes, seconds):
+    """Print the rate achieved by a rate-limited upload."""
+    msg = 'Uploaded {} bytes in {:.1f} seconds ({}/s, limit {}/s)'.format(
+        upload_bytes,
+        seconds,
+        upload_format_rate(upload_bytes / max(seconds, 0.001)),
+        upload_format_rate(limiter.max_rate),
+    )
+    if limiter.cuts:
+        msg = msg + ', slowed {} times to as low as {}/s'.format(
+            limiter.cuts,
+            upload_format_rate(limiter.lowest_rate),
+        )
+    print(msg)
+
+
+class UploadLimiter:
+    """Limit the rate at which an upload is sent to a grid.
+
+    If adaptive, the round-trip time to the grid (the time taken to
+    open a TCP connection) is measured every UPLOAD_PROBE_INTERVAL
+    seconds during the upload.  The rate is halved whenever that time
+    is well above what it was before the upload started, and otherwise
+    raised by a tenth of the maximum rate, up to the maximum.
+    """
+
+    def __init__(self, url, max_rate, adaptive):
+        url_parts = urllib.parse.urlsplit(url)
+        default_port = 443 if url_parts.scheme == 'https' else 80
+        self.address = (url_parts.hostname, url_parts.port or default_port)
+        self.max_rate = max_rate
+        self.adaptive = adaptive
+        self.rate = max_rate
+        self.lowest_rate = max_rate
+        self.cuts = 0
+        self.baseline = None
+        self.next_send = 0.0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def probe(self):
+        """Return round-trip time to the grid, or None if unreachable."""
+        start = time.time()
+        try:
+            with socket.create_connection(
+                    self.address,
+                    timeout=UPLOAD_PROBE_TIMEOUT,
+            ):
+                pass
+        except OSError:
+            return None
+        return time.time() - start
+
+    def start(self):
+        """Start limiting an upload, measuring round-trip time if needed."""
+        self.next_send = time.time()
+        if not self.adaptive:
+            return
+        rtts = [self.probe() for _ in range(UPLOAD_BASELINE_PROBES)]
+        rtts = [rtt for rtt in rtts if rtt is not None]
+        if not rtts:
+            print('Cannot measure round-trip time to grid, '
+                  'not adapting upload rate', file=sys.stderr)
+            return
+        self.baseline = min(rtts)
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.adapt, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop measuring round-trip time."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def adapt(self):
+        """Adjust the rate to the round-trip time until stopped."""
+        threshold = self.baseline * UPLOAD_RTT_FACTOR + UPLOAD_RTT_SLACK
+        while not self.stopped.wait(UPLOAD_PROBE_INTERVAL):
+            rtt = self.probe()
+            with self.lock:
+                if rtt is None or rtt > threshold:
+                    self.rate = max(
+                        self.rate / 2,
+                        self.max_rate * UPLOAD_MIN_FRACTION,
+                    )
+                    self.cuts = self.cuts + 1
+                    self.lowest_rate = min(self.lowest_rate, self.rate)
+                else:
+                    self.rate = min(
+                        self.rate + self.max_rate / 10,
+                        self.max_rate,
+                    )
+            trace_output.trace_add(
+                'upload rate',
+                'upload',
+                time.time(),
+                time.time(),
+                rate=self.rate,
+                rtt=rtt,
+            )
+
+    def wait(self, size):
+        """Wait until size more bytes can be sent without going too fast."""
+        with self.lock:
+            now = time.time()
+            delay = self.next_send - now
+            self.next_send = max(self.next_send, now) + size / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Define functions for importing only changed rows.
+def delta_read_index(index_path):
+    """Return index of previously imported rows, or an empty index."""
+    try:
+        with open(index_path, 'r') as index_f:
+            return json.load(index_f)
+    except FileNotFoundError:
+        return {'headers': {}, 'rows': {}}
+    except (OSError, ValueError) as err:
+        error_exit(
+            'Error reading delta index {}'.format(index_path),
+            err,
+        )
+    return None  # Not reached
+
+
+def delta_write_index(index_path, index):
+    """Write out index of imported rows, replacing any previous index."""
+    tmp_path = index_path + '.tmp'
+    try:
+        with open(tmp_path, 'w') as index_f:
+            json.dump(index, index_f)
+        os.replace(tmp_path, index_path)
+    except OSError as err:
+        error_exit(
+            'Error writing delta index {}'.format(index_path),
+            err,
+        )
+
+
+def delta_split_csv(csv_path, index, tmp_dir):
+    """Write CSV files of inserted, updated, and deleted rows.
+
+    Return a dictionary mapping CSV import operation to a tuple of the
+    CSV file pathname, the number of rows in it, and a dictionary
+    mapping the key of each row to its new index entry (None for
+    deleted rows).
+    """
+    changes = {}
+    writers = {}
+    for operation in ['DELETE', 'UPDATE', 'INSERT']:
+        change_path = os.path.join(
+            tmp_dir,
+            '{}_{}'.format(operation.lower(), sanitized_filename(csv_path)),
+        )
+        change_f = open(change_path, 'w', newline='', encoding='utf-8')
+        writers[operation] = (change_f, csv.writer(change_f), {})
+        changes[operation] = (change_path, 0, {})
+
+    # Compare each row against the index entry for its key, if any.
+    seen = set()
+    try:
+        csv_in = csv_open(csv_path)
+    except OSError as err:
+        error_exit(
+            'Error opening CSV file {}'.format(csv_path),
+            err,
+        )
+    with csv_in:
+        for (obj_type, header, row) in csv_data_rows(csv_in):
+            key = csv_row_key(obj_type, header, row)
+            seen.add(key)
+            row_hash = csv_row_hash(header, row)
+            old_entry = index['rows'].get(key)
+            if old_entry is None:
+                operation = 'INSERT'
+            elif old_entry[0] != row_hash:
+                operation = 'UPDATE'
+            else:
+                continue  # Unchanged row
+            (_, csv_writer, headers_written) = writers[operation]
+            csv_writerow(csv_writer, headers_written, obj_type, header, row)
+
+            # Remember the key fields in case the object is deleted later.
+            if header:
+                key_fields = csv_key_fields(obj_type, header)
+                index['headers'][obj_type] = [
+                    header[idx] for idx in key_fields
+                ]
+                values = [
+                    row[idx] if idx < len(row) else '' for idx in key_fields
+                ]
+            else:
+                values = row[1:]
+            (change_path, count, entries) = changes[operation]
+            entries[key] = [row_hash, values]
+            changes[operation] = (change_path, count + 1, entries)
+
+    # Objects in the index but not in the file are to be deleted.
+    # NOTE: Only the key fields are needed to delete an object.
+    (_, csv_writer, headers_written) = writers['DELETE']
+    (change_path, count, entries) = changes['DELETE']
+    for (key, old_entry) in index['rows'].items():
+        if key in seen:
+            continue
+        obj_type = json.loads(key)[0]
+        header = []
+        if obj_type in index['headers']:
+            header = ['header-' + obj_type] + index['headers'][obj_type]
+        row = [obj_type] + old_entry[1]
+        csv_writerow(csv_writer, headers_written, obj_type, header, row)
+        entries[key] = None
+        count += 1
+    changes['DELETE'] = (change_path, count, entries)
+
+    for (change_f, _, _) in writers.values():
+        change_f.close()
+    return changes
+
+
+def delta_csv_import(grid, csv_path, timeout, index_path, retries=0,
+                     poll_interval=30):
+    """Import only rows of csv_path changed since the last delta import.
+
+    Return list of pathnames of CSV error logs, if any.
+    """
+    index = delta_read_index(index_path)
+    error_logs = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with trace_output.trace_span('delta split', file=csv_path):
+            changes = delta_split_csv(csv_path, index, tmp_dir)
+        print(
+            'Delta import: {} inserted, {} updated, {} deleted rows'.format(
+                changes['INSERT'][1],
+                changes['UPDATE'][1],
+                changes['DELETE'][1],
+            )
+        )
+
+        # Delete objects first, in case new objects would conflict.
+        for operation in ['DELETE', 'UPDATE', 'INSERT']:
+            (change_path, count, entries) = changes[operation]
+            if count == 0:
+                continue
+            error_log = ib_csv_import_retry(
+                grid,
+                change_path,
+                timeout,
+                retries,
+                operation,
+                poll_interval,
+            )
+            if error_log is None:
+                # We don't know which rows made it, so don't record any.
+                print('{} of changed rows did not complete'.format(operation))
+                continue
+            if is_nonblank_string(error_log):
+                error_logs.append(error_log)
+
+            # Record the changes that succeeded.
+            failed_keys = csv_error_keys(error_log)
+            for (key, entry) in entries.items():
+                if key in failed_keys:
+                    continue
+                if entry is None:
+                    index['rows'].pop(key, None)
+                else:
+                    index['rows'][key] = entry
+            delta_write_index(index_path, index)
+    return error_logs
+
+
+# Define functions for resuming interrupted imports.
+def state_init(grid, state_path):
+    """Set up grid to save import state in state_path."""
+    grid['state_path'] = state_path
+
+
+def state_file_key(grid, csv_path, operation):
+    """Return key for the state of an import of csv_path, or None.
+
+    The key identifies the grid, the operation, and the contents of the
+    file (after decompression, for compressed files).
+    """
+    if not is_nonblank_string(grid.get('state_path')):
+        return None
+    file_hash = hashlib.sha256()
+    try:
+        for chunk in csv_input_chunks(csv_path):
+            file_hash.update(chunk)
+    except OSError as err:
+        error_exit(
+            'Error opening CSV file {}'.format(csv_path),
+            err,
+        )
+    return '{} {} {}'.format(grid['url'], operation, file_hash.hexdigest())
+
+
+def state_read(state_path):
+    """Read and return import state, or an empty state if none."""
+    try:
+        with open(state_path, 'r') as state_f:
+            state = json.load(state_f)
+        if isinstance(state, dict):
+            return state
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as err:
+        print(err, file=sys.stderr)
+        print('Ignoring import state file {}'.format(state_path),
+              file=sys.stderr)
+    return {}
+
+
+def state_update(grid, key, entry):
+    """Save (or if entry is None, remove) import state for key."""
+    if key is None:
+        return
+    state_path = grid['state_path']
+    with STATE_LOCK:
+        state = state_read(state_path)
+        if entry is None:
+            state.pop(key, None)
+        else:
+            state[key] = entry
+        tmp_path = state_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as state_f:
+                json.dump(state, state_f, indent=2)
+            os.replace(tmp_path, state_path)
+        except OSError as err:
+            error_exit(
+                'Error writing import state {}'.format(state_path),
+                err,
+            )
+
+
+def state_save(grid, key, csv_path, **fields):
+    """Save how far the import of csv_path has gotten."""
+    fields['file'] = os.path.abspath(csv_path)
+    fields['time'] = time.time()
+    state_update(grid, key, fields)
+
+
+def state_clear(grid, key):
+    """Forget the state of a completed import."""
+    state_update(grid, key, None)
+
+
+def state_reattach(grid, key, csv_path, operation):
+    """Return task reference and ID for a previous import of csv_path.
+
+    If the file was uploaded but its import not started, start it now.
+    Return None if there is nothing to reattach to.
+    """
+    if key is None:
+        return None
+    entry = state_read(grid['state_path']).get(key)
+    if entry is None:
+        return None
+    if entry.get('import_ref'):
+        try:
+            rsp = ib_request(grid, 'GET', grid['url'] + entry['import_ref'])
+        except requests.exceptions.RequestException as err:
+            error_exit(
+                'Error checking CSV task {}'.format(entry['import_ref']),
+                err,
+            )
+        if rsp.status_code == requests.codes.ok:  # pylint: disable=E1101
+            print('Reattaching to import {} of {}'.format(
+                entry['import_id'],
+                csv_path,
+            ))
+            return (entry['import_ref'], entry['import_id'])
+        print('Import {} of {} not found, importing again'.format(
+            entry['import_id'],
+            csv_path,
+        ))
+    elif entry.get('upload_token'):
+        print('Starting import of previously uploaded {}'.format(csv_path))
+        task = ib_csv_start(grid, csv_path, entry['upload_token'], operation)
+        if task is not None:
+            state_save(grid, key, csv_path,
+                       upload_token=entry['upload_token'],
+                       import_ref=task[0], import_id=task[1])
+            return task
+        print('Cannot reuse upload of {}, uploading again'.format(csv_path))
+    state_clear(grid, key)
+    return None
+
+
+# Define functions for removing duplicate rows.
+def dedup_address(value):
+    """Return IP address (or list of addresses) in standard form."""
+    addrs = []
+    for addr in value.split(','):
+        addr = addr.strip()
+        parts = addr.split('.')
+        if len(parts) == 4 and all(part.isdigit() for part in parts):
+            addr = '.'.join(str(int(part)) for part in parts)
+        else:
+            try:
+                addr = str(ipaddress.ip_address(addr))
+            except ValueError:
+                pass  # E.g., "func:nextavailableip:..."
+        addrs.append(addr)
+    return ','.join(addrs)
+
+
+def dedup_mac(value):
+    """Return MAC address in lowercase, colon-separated form."""
+    digits = ''.join(char for char in value if char not in ':-. ').lower()
+    if len(digits) != 12 or any(char not in '0123456789abcdef'
+                                for char in digits):
+        return value
+    return ':'.join(digits[idx:idx + 2] for idx in range(0, 12, 2))
+
+
+def dedup_fqdn(value):
+    """Return domain name in lowercase without a trailing dot."""
+    return value.strip().rstrip('.').lower()
+
+
+def dedup_normalizers(header):
+    """Return list of (index, function) for fields to be normalized."""
+    normalizers = []
+    for (idx, field) in enumerate(header):
+        name = csv_field_name(field)
+        if name in DEDUP_ADDRESS_FIELDS:
+            normalizers.append((idx, dedup_address))
+        elif name in DEDUP_MAC_FIELDS:
+            normalizers.append((idx, dedup_mac))
+        elif name in DEDUP_FQDN_FIELDS:
+            normalizers.append((idx, dedup_fqdn))
+    return normalizers
+
+
+def dedup_digest(value):
+    """Return short binary hash of a string."""
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+
+
+def dedup_mark(dropped, row_num, reason):
+    """Record that row row_num is to be dropped for the given reason.
+
+    Reason 1 means an exact duplicate, 2 the same key but different
+    contents.
+    """
+    if len(dropped) <= row_num:
+        dropped.extend(bytes(row_num + 1 + IB_CHUNK_SIZE - len(dropped)))
+    dropped[row_num] = reason
+
+
+def dedup_spill(spill, key, content, row_num):
+    """Write record for a row to the spill file for its key."""
+    spill[key[0] % DEDUP_PARTITIONS].write(
+        DEDUP_RECORD.pack(key, content, row_num),
+    )
+
+
+def dedup_scan(csv_path, out_path, tmp_dir, normalize=False):
+    """Write copy of csv_path and find duplicate rows.
+
+    Rows are compared with addresses and names in normalized form, but
+    written unchanged unless normalize is True.  Return number of rows,
+    number of values changed by normalizing, and a bytearray giving the
+    reason (if any) each row is to be dropped.
+    """
+    seen = {}
+    spill = None
+    dropped = bytearray()
+    rows = 0
+    normalized = 0
+    normalizers = {}
+    with csv_open(csv_path) as csv_in, \
+            open(out_path, 'w', newline='', encoding='utf-8') as out_f:
+        csv_writer = csv.writer(out_f)
+        headers_written = {}
+        for (obj_type, header, row) in csv_data_rows(csv_in):
+            row_num = rows
+            rows = rows + 1
+            cached = normalizers.get(obj_type)
+            if cached is None or cached[0] is not header:
+                normalizers[obj_type] = (header, dedup_normalizers(header))
+            key_row = list(row)
+            for (idx, normalizer) in normalizers[obj_type][1]:
+                if idx < len(row) and row[idx]:
+                    value = normalizer(row[idx])
+                    if value != row[idx]:
+                        key_row[idx] = value
+                        normalized = normalized + 1
+            csv_writerow(csv_writer, headers_written, obj_type, header,
+                         key_row if normalize else row)
+
+            # Check whether we have seen this object before.
+            key = dedup_digest(csv_row_key(obj_type, header, key_row))
+            content = dedup_digest(csv_row_hash(header, key_row))
+            if spill is not None:
+                dedup_spill(spill, key, content, row_num)
+            elif key in seen:
+                dedup_mark(dropped, row_num,
+                           1 if seen[key][0] == content else 2)
+            elif len(seen) < DEDUP_MAX_KEYS:
+                seen[key] = (content, row_num)
+            else:
+                # Too many rows to track in memory, so move the rows
+                # seen so far to disk and check the rest there.
+                spill = [
+                    open(os.path.join(tmp_dir, 'spill{}'.format(num)), 'wb')
+                    for num in range(DEDUP_PARTITIONS)
+                ]
+                for (seen_key, entry) in seen.items():
+                    dedup_spill(spill, seen_key, *entry)
+                seen = {}
+                dedup_spill(spill, key, content, row_num)
+    if spill is None:
+        return (rows, normalized, dropped)
+
+    # Find duplicates among the rows in each spill file in turn.
+    # NOTE: Records are in row order within each file.
+    for spill_f in spill:
+        spill_f.close()
+        with open(spill_f.name, 'rb') as spill_in:
+            seen = {}
+            for (key, content, row_num) in DEDUP_RECORD.iter_unpack(
+                    spill_in.read()):
+                if key not in seen:
+                    seen[key] = content
+                elif seen[key] == content:
+                    dedup_mark(dropped, row_num, 1)
+                else:
+                    dedup_mark(dropped, row_num, 2)
+        os.remove(spill_f.name)
+    return (rows, normalized, dropped)
+
+
+def dedup_csv(csv_path, tmp_dir, normalize=False):
+    """Write copy of csv_path without duplicate rows, return its name.
+
+    Also print a summary of the rows removed and write them to a file.
+    If normalize is True the copy has addresses and names in normalized
+    form.
+    """
+    out_path = os.path.join(tmp_dir, csv_upload_name(csv_path))
+    scan_path = out_path + '.scan'
+    try:
+        (rows, normalized, dropped) = dedup_scan(csv_path, scan_path,
+                                                 tmp_dir, normalize)
+    except (OSError, csv.Error) as err:
+        error_exit('Error reading CSV file {}'.format(csv_path), err)
+    if normalize:
+        print('Normalized {} values in {} rows'.format(normalized, rows))
+    else:
+        print('Checked {} rows ({} values compared in normalized '
+              'form)'.format(rows, normalized))
+    if not any(dropped):
+        os.replace(scan_path, out_path)
+        return out_path
+
+    # Copy the rows to be kept, and write the others to a file.
+    reasons = {1: 'exact duplicate', 2: 'same key as earlier row'}
+    summary = {}
+    (removed_fd, removed_path) = tempfile.mkstemp('_removed.csv')
+    with open(scan_path, 'r', newline='', encoding='utf-8') as scan_in, \
+            open(out_path, 'w', newline='', encoding='utf-8') as out_f, \
+            os.fdopen(removed_fd, 'w', newline='',
+                      encoding='utf-8') as removed_f:
+        (out_writer, removed_writer) = (csv.writer(out_f),
+                                        csv.writer(removed_f))
+        (out_headers, removed_headers) = ({}, {})
+        for (row_num, (obj_type, header, row)) in enumerate(
+                csv_data_rows(scan_in)):
+            reason = dropped[row_num] if row_num < len(dropped) else 0
+            if reason == 0:
+                csv_writerow(out_writer, out_headers, obj_type, header, row)
+                continue
+            csv_writerow(removed_writer, removed_headers, obj_type, header,
+                         row)
+            summary[(obj_type, reasons[reason])] = summary.get(
+                (obj_type, reasons[reason]), 0) + 1
+    os.remove(scan_path)
+    print('Removed duplicate rows by object type and reason:')
+    for ((obj_type, reason), count) in sorted(
+            summary.items(),
+            key=lambda item: (-item[1], item[0]),
+    ):
+        print('{:>8}  {}: {}'.format(count, obj_type, reason))
+    print('See {} for removed rows'.format(removed_path))
+    return out_path
+
+
+# Define functions for keeping statistics on past imports.
+def stats_init(grid, stats_path):
+    """Set up grid to record and use statistics on past imports."""
+    history = []
+    try:
+        with open(stats_path, 'r', encoding='utf-8') as stats_f:
+            for line in stats_f:
+                try:
+                    history.append(json.loads(line))
+                except ValueError:
+                    continue  # Partially written or corrupt line
+    except FileNotFoundError:
+        pass
+    except OSError as err:
+        error_exit('Error reading statistics file {}'.format(stats_path), err)
+    grid['stats'] = {'path': stats_path, 'history': history}
+
+    # Use the progress marks to time the phases of each import.
+    if grid.get('progress') is None:
+        ib_progress_init(grid, lambda event: None)
+
+
+def stats_count_rows(grid, csv_path):
+    """Return number of data rows of each object type in csv_path."""
+    rows = {}
+    if grid.get('stats') is None:
+        return rows
+    try:
+        with csv_open(csv_path) as csv_in:
+            for (obj_type, _, _) in csv_data_rows(csv_in):
+                rows[obj_type] = rows.get(obj_type, 0) + 1
+    except (OSError, ValueError):
+        pass  # Reported when the file is uploaded
+    return rows
+
+
+def stats_median(values):
+    """Return the median of a non-empty list of numbers."""
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2
+
+
+def stats_predict(grid, rows, operation):
+    """Return predicted seconds to import the given rows, or None.
+
+    The prediction is the median fixed overhead (upload, queueing, and
+    so on) of recent imports to the grid, plus the number of rows of
+    each object type times the average seconds per row of that type.
+    NOTE: The processing time of past imports is divided among object
+    types in proportion to their number of rows.
+    """
+    stats = grid.get('stats')
+    if stats is None or not rows:
+        return None
+    history = [
+        record for record in stats['history']
+        if record.get('url') == grid['url']
+        and record.get('operation') == operation
+        and record.get('completed')
+        and not record.get('resumed')
+    ][-STATS_HISTORY:]
+    if not history:
+        return None
+
+    # Total up processing time and rows by object type.
+    seconds = {}
+    counts = {}
+    for record in history:
+        total_rows = sum(record['rows'].values())
+        for (obj_type, count) in record['rows'].items():
+            share = record['processing_seconds'] * count / max(total_rows, 1)
+            seconds[obj_type] = seconds.get(obj_type, 0) + share
+            counts[obj_type] = counts.get(obj_type, 0) + count
+    all_rows = max(sum(counts.values()), 1)
+    default_rate = sum(seconds.values()) / all_rows
+
+    predicted = stats_median([
+        record['total_seconds'] - record['processing_seconds']
+        for record in history
+    ])
+    for (obj_type, count) in rows.items():
+        rate = default_rate
+        if counts.get(obj_type):
+            rate = seconds[obj_type] / counts[obj_type]
+        predicted = predicted + count * rate
+    return predicted
+
+
+def stats_timeout(predicted):
+    """Return timeout in seconds for an import given its prediction."""
+    if predicted is None:
+        return STATS_DEFAULT_TIMEOUT
+    return max(int(math.ceil(predicted * STATS_TIMEOUT_FACTOR)),
+               STATS_MIN_TIMEOUT)
+
+
+def stats_record(grid, csv_path, operation, rows, predicted, outcome,
+                 resumed=False):
+    """Record statistics for an import and report if it was slow.
+
+    The outcome is the number of lines processed and failed and whether
+    the import completed.  If the import was resumed (i.e., started by
+    an earlier run of the script) its timings cover only this run, so
+    it is recorded as such and not used for predictions.
+    """
+    stats = grid.get('stats')
+    if stats is None:
+        return
+    (processed, failed, completed) = outcome
+    marks = grid['progress']['marks']
+    now = time.time()
+    total_seconds = now - marks['start']
+    processing_seconds = (marks.get('processed', now)
+                          - marks.get('dequeued', marks['start']))
+    record = {
+        'time': now,
+        'url': grid['url'],
+        'file': os.path.basename(csv_path),
+        'operation': operation,
+        'rows': rows,
+        'lines_processed': processed,
+        'lines_failed': failed,
+        'completed': completed,
+        'total_seconds': total_seconds,
+        'processing_seconds': processing_seconds,
+        'lines_per_second': ib_progress_rate(processed, processing_seconds),
+        'predicted_seconds': predicted,
+        'resumed': resumed,
+    }
+    stats['history'].append(record)
+    try:
+        with open(stats['path'], 'a', encoding='utf-8') as stats_f:
+            stats_f.write(json.dumps(record) + '\n')
+    except OSError as err:
+        print('Cannot record statistics in {}: {}'.format(stats['path'], err))
+
+    # Report imports that took much longer than predicted.
+    if (predicted is not None and not resumed
+            and total_seconds > predicted * STATS_SLOW_FACTOR):
+        print('Import took {:.0f} seconds, predicted {:.0f}'.format(
+            total_seconds,
+            predicted,
+        ))
+        ib_progress_event(
+            grid,
+            'slow',
+            total_seconds=total_seconds,
+            predicted_seconds=predicted,
+        )
+
+
+def stats_estimate(grid, csv_path):
+    """Print predicted time to import csv_path without importing it."""
+    import batch_import  # pylint: disable=C0415
+    if batch_import.batch_plan(grid, csv_path, 'INSERT') is not None:
+        print('{} would be written directly in batch mode'.format(csv_path))
+        return
+    rows = stats_count_rows(grid, csv_path)
+    if not rows:
+        error_exit('No data rows found in CSV file {}'.format(csv_path))
+    for obj_type in sorted(rows):
+        print('{:>8}  {}'.format(rows[obj_type], obj_type))
+    predicted = stats_predict(grid, rows, 'INSERT')
+    if predicted is None:
+        print('No past imports to predict from')
+    else:
+        print('Predicted import time {:.0f} seconds'.format(predicted))
+    print('Timeout {} seconds'.format(stats_timeout(predicted)))
+
+
+# Define functions for importing into several grids at once.
+def fanout_validate(csv_path):
+    """Check that csv_path can be read and has data rows, or exit."""
+    rows = 0
+    try:
+        with csv_open(csv_path) as csv_in:
+            for _ in csv_data_rows(csv_in):
+                rows = rows + 1
+    except (OSError, ValueError, csv.Error) as err:
+        error_exit('Error reading CSV file {}'.format(csv_path), err)
+    if rows == 0:
+        error_exit('No data rows found in CSV file {}'.format(csv_path))
+    return rows
+
+
+def fanout_result(error_logs):
+    """Return a short description of the outcome of a grid's import."""
+    if any(error_log is None for error_log in error_logs):
+        return 'timed out'
+    failed = 0
+    for error_log in error_logs:
+        if not is_nonblank_string(error_log):
+            continue
+        with open(csv_retry_path(error_log), 'r', newline='',
+                  encoding='utf-8') as retry_in:
+            for _ in csv_data_rows(retry_in):
+                failed = failed + 1
+    if failed > 0:
+        return '{} rows failed'.format(failed)
+    return 'OK'
+
+
+def fanout_import(cmd_args, progress_callback=None):
+    """Import the CSV file into the grid for each profile in parallel.
+
+    Print a table of the results for each grid, and return the list of
+    error logs for all grids.
+    """
+    profiles = cmd_args['ib_profiles']
+    rows = fanout_validate(cmd_args['csv_path'])
+    print('Importing {} rows into {} grids'.format(rows, len(profiles)))
+    width = max([len('Profile')] + [len(profile) for profile in profiles])
+
+    def run(profile):
+        trace_output.LABEL_THREAD.label = '[{:<{}}] '.format(profile, width)
+        start = time.time()
+        try:
+            (grid, error_logs) = import_grid(
+                cmd_args,
+                profile,
+                progress_callback,
+            )
+            result = fanout_result(error_logs)
+        except SystemExit as err:
+            (grid, error_logs) = ({'url': ''}, [])
+            result = 'error: {}'.format(err.code)
+        except Exception as err:  # pylint: disable=broad-except
+            # Report the error for this grid, and keep importing into
+            # the others.
+            (grid, error_logs) = ({'url': ''}, [])
+            result = 'error: {!r}'.format(err)
+        return (grid['url'], result, time.time() - start, error_logs)
+
+    # Label the output of each import with the name of its profile.
+    (stdout, stderr) = (sys.stdout, sys.stderr)
+    sys.stdout = trace_output.LabeledOutput(stdout)
+    sys.stderr = trace_output.LabeledOutput(stderr)
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=len(profiles),
+    )
+    try:
+        results = list(executor.map(run, profiles))
+    except KeyboardInterrupt:
+        # Stop the imports at their next progress check, rather than
+        # waiting for them to finish.
+        FANOUT_STOP.set()
+        raise
+    finally:
+        executor.shutdown(cancel_futures=True)
+        (sys.stdout, sys.stderr) = (stdout, stderr)
+
+    # Show the results for each grid side by side.
+    print()
+    print('{:<{}}  {:<40}  {:>8}  {}'.format(
+        'Profile', width, 'URL', 'Seconds', 'Result',
+    ))
+    all_error_logs = []
+    for (profile, (url, result, seconds, error_logs)) in zip(profiles,
+                                                             results):
+        print('{:<{}}  {:<40}  {:>8.1f}  {}'.format(
+            profile, width, url, seconds, result,
+        ))
+        all_error_logs.extend(error_logs)
+    return all_error_logs
+
+
+def import_grid(cmd_args, ib_profile, progress_callback=None):
+    """Import the CSV file into the grid for ib_profile.
+
+    Return the grid object and list of pathnames of CSV error logs.
+    """
+    csv_path = cmd_args['csv_path']
+
+    # Initialize WAPI connections for read/write access.
+    grid = ib_init(
+        cmd_args['ib_config'],
+        ib_profile,
+        cmd_args['auth_cache'],
+    )
+
+    # Import small files in batches of WAPI requests if allowed.
+    import batch_import  # pylint: disable=C0415
+    batch_import.batch_init(
+        grid,
+        cmd_args['mode'],
+        cmd_args['batch_threshold'],
+        cmd_args['batch_size'],
+        cmd_args['workers'],
+    )
+
+    # Write progress events, save import state for resuming imports,
+    # and record import statistics if requested.
+    if progress_callback is not None:
+        ib_progress_init(grid, progress_callback)
+    if is_nonblank_string(cmd_args['state_path']):
+        state_init(grid, cmd_args['state_path'])
+    if is_nonblank_string(cmd_args['stats_path']):
+        stats_init(grid, cmd_args['stats_path'])
+    if cmd_args['max_upload_rate'] is not None:
+        upload_init(
+            grid,
+            cmd_args['max_upload_rate'],
+            cmd_args['adaptive_upload'],
+        )
+
+    # Attempt to import the CSV file, or only the changes to it.
+    if is_nonblank_string(cmd_args['delta_index']):
+        error_logs = delta_csv_import(
+            grid,
+            csv_path,
+            cmd_args['timeout'],
+            cmd_args['delta_index'],
+            cmd_args['retries'],
+            cmd_args['poll_interval'],
+        )
+    else:
+        error_logs = [
+            ib_csv_import_retry(
+                grid,
+                csv_path,
+                cmd_args['timeout'],
+                cmd_args['retries'],
+                poll_interval=cmd_args['poll_interval'],
+            )
+        ]
+    grid['session'].close()
+    return (grid, error_logs)
+
+
+def import_main(cmd_args):
+    """Import the CSV file as specified by the command line arguments."""
+    csv_path = cmd_args['csv_path']
+    profiles = cmd_args['ib_profiles']
+
+    # Read and upload only the selected rows of the file, if requested.
+    if cmd_args['rows'] is not None or cmd_args['section'] is not None:
+        rows_select(cmd_args)
+
+    # Predict how long the import would take, without logging in.
+    if cmd_args['estimate']:
+        if not is_nonblank_string(cmd_args['stats_path']):
+            error_exit('The --estimate option requires --stats')
+        import batch_import  # pylint: disable=C0415
+        for profile in profiles:
+            grid = ib_get_config_info(
+                ib_get_config_location(cmd_args['ib_config']),
+                profile,
+            )
+            if len(profiles) > 1:
+                print('Profile {}:'.format(profile))
+            batch_import.batch_init(
+                grid,
+                cmd_args['mode'],
+                cmd_args['batch_threshold'],
+                cmd_args['batch_size'],
+                cmd_args['workers'],
+            )
+            stats_init(grid, cmd_args['stats_path'])
+            stats_estimate(grid, csv_path)
+        return
+
+    if cmd_args['adaptive_upload'] and cmd_args['max_upload_rate'] is None:
+        error_exit('The --adaptive-upload option requires --max-upload-rate')
+    if cmd_args['normalize'] and not cmd_args['dedup']:
+        error_exit('The --normalize option requires --dedup')
+
+    # NOTE: The delta index records what was imported into one grid.
+    if len(profiles) > 1 and is_nonblank_string(cmd_args['delta_index']):
+        error_exit('The --delta option cannot be used with several profiles')
+
+    # Write progress events if requested.
+    progress_f = None
+    progress_callback = None
+    if cmd_args['progress_json'] == '-':
+        progress_callback = ib_progress_jsonl(sys.stdout)
+    elif is_nonblank_string(cmd_args['progress_json']):
+        try:
+            progress_f = open(cmd_args['progress_json'], 'w')
+        except OSError as err:
+            error_exit(
+                'Error opening progress file {}'.format(
+                    cmd_args['progress_json'],
+                ),
+                err,
+            )
+        progress_callback = ib_progress_jsonl(progress_f)
+
+    # Normalize the file and remove duplicate rows once for all grids.
+    dedup_dir = None
+    if cmd_args['dedup']:
+        dedup_dir = tempfile.mkdtemp(prefix='import_csv_')
+        with trace_output.trace_span('dedup', file=csv_path):
+            cmd_args['csv_path'] = dedup_csv(
+                csv_path,
+                dedup_dir,
+                cmd_args['normalize'],
+            )
+
+    # Import into one grid, or into several grids at the same time.
+    try:
+        if len(profiles) > 1:
+            error_logs = fanout_import(cmd_args, progress_callback)
+        else:
+            (_, error_logs) = import_grid(
+                cmd_args,
+                profiles[0],
+                progress_callback,
+            )
+    except KeyboardInterrupt:
+        if not is_nonblank_string(cmd_args['state_path']):
+            raise
+        error_exit('Interrupted, run again with --state {} to resume'.format(
+            cmd_args['state_path'],
+        ))
+    finally:
+        if dedup_dir is not None:
+            shutil.rmtree(dedup_dir, ignore_errors=True)
+    if progress_f is not None:
+        progress_f.close()
+    for error_log in error_logs:
+        if is_nonblank_string(error_log):
+            print('See {} for CSV import errors'.format(error_log))
+            print('See {} for failed rows'.format(csv_retry_path(error_log)))
+
+
 def main():
     """Main program."""
 
     # Get arguments from command line.
     cmd_args = get_cmd_args()
-    csv_path = cmd_args['csv_path']
 
-    # Initialize WAPI connections for read/write access.
-    grid = ib_init(cmd_args['ib_config'], cmd_args['ib_profile'])
-
-    # Attempt to import the CSV file.
-    error_log = ib_csv_import(grid, csv_path, cmd_args['timeout'])
-    if is_nonblank_string(error_log):
-        print('See {} for CSV import errors'.format(error_log))
+    # Record phase timings and profile the script if requested.
+    profiler = trace_output.trace_start(
+        cmd_args['profile'],
+        cmd_args['profile_stats'],
+    )
+    try:
+        import_main(cmd_args)
+    finally:
+        trace_output.trace_finish(
+            cmd_args['profile'],
+            cmd_args['profile_stats'],
+            profiler,
+        )
 
 
 # Execute the following when this is run as a script.
 if __name__ == '__main__':
+    # NOTE: Modules imported later (e.g., batch_import) import this one
+    # by name, so make sure they get this copy of it and its state
+    # rather than loading a second one.
+    sys.modules.setdefault('import_csv', sys.modules[__name__])
     main()
@@ -0,0 +1,673 @@
+"""Queue CSV import jobs and run them against grids in a predictable way.
+
+This script runs a small local service that accepts CSV import jobs,
+queues them by grid (i.e., by profile in the Infoblox configuration
+file used by import_csv.py), and runs at most a fixed number of
+imports at a time against each grid, rather than letting several
+people or programs start overlapping imports on the same grid.
+Consecutive small jobs for the same grid and CSV import operation are
+merged into a single upload and import, to avoid paying the per-import
+overhead of the grid's CSV job manager for each of them.
+
+The script has three modes of operation:
+
+  import_queue.py serve [--max-concurrent N] [--merge-rows N]
+  import_queue.py submit [--ib-profile P] [--operation OP] [--wait] FILE
+  import_queue.py stats
+
+The "serve" mode runs the service itself, by default listening on
+http://127.0.0.1:8642/.  The service accepts the following requests:
+
+  POST /jobs        submit a job, given a JSON object with "csv_path",
+                    and optionally "profile" and "operation" (INSERT,
+                    UPDATE, DELETE, etc.); returns the job's ID
+  GET /jobs/<id>    return status and results of a job
+  GET /stats        return queue depth, wait times, and throughput
+                    for each grid profile
+
+The "submit" and "stats" modes make these requests on behalf of the
+user.  The CSV file for a job must be readable by the service.
+
+Every request must include the service's token in an X-Queue-Token
+header.  The "serve" mode writes a new random token at startup to a
+file readable only by its owner (by default ~/.import_queue_token),
+and the "submit" and "stats" modes read it from there, so only that
+user can submit jobs (i.e., have the service read files on their
+behalf) or see their status.
+"""
+
+# Import the required Python modules.
+import argparse
+import collections
+import csv
+import hmac
+import http.server
+import json
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import async_import
+import import_csv
+
+# NOTE: The asyncio and requests modules take much longer to import
+# than the others, so are only imported when first needed (see
+# import_modules), keeping --help, --version and argument errors fast.
+# NOTE: Must disable pylint E1101 error when checking requests.codes.
+asyncio = None  # pylint: disable=C0103
+requests = None  # pylint: disable=C0103
+
+
+# Default address on which the service listens.
+QUEUE_DEFAULT_URL = 'http://127.0.0.1:8642/'
+
+# Default file holding the token clients must send with requests.
+QUEUE_DEFAULT_TOKEN_FILE = os.path.join('~', '.import_queue_token')
+QUEUE_TOKEN_HEADER = 'X-Queue-Token'
+
+
+# Define functions to manage the queues of jobs.
+def import_modules():
+    """Import the asyncio and requests modules, if not already done."""
+    global asyncio, requests  # pylint: disable=C0103,W0603
+    async_import.import_modules()
+    (asyncio, requests) = (async_import.asyncio, async_import.requests)
+
+
+def queue_new_service(cmd_args):
+    """Return a new (empty) service object."""
+    return {
+        'ib_config': cmd_args['ib_config'],
+        'auth_cache': cmd_args['auth_cache'],
+        'timeout': cmd_args['timeout'],
+        'max_concurrent': cmd_args['max_concurrent'],
+        'merge_rows': cmd_args['merge_rows'],
+        'profiles': {},
+        'jobs': {},
+        'next_id': 1,
+    }
+
+
+def queue_count_rows(csv_path, limit):
+    """Return number of data rows in csv_path, or limit + 1 if more."""
+    rows = 0
+    with open(csv_path, 'r', newline='', encoding='utf-8-sig') as csv_in:
+        for _ in import_csv.csv_data_rows(csv_in):
+            rows = rows + 1
+            if rows > limit:
+                break
+    return rows
+
+
+def queue_take_batch(pending, merge_rows):
+    """Remove and return the next job, plus any jobs to merge with it.
+
+    Jobs can be merged if they are for the same import operation and
+    have no more than merge_rows rows in total.
+    """
+    batch = [pending.popleft()]
+    rows = batch[0]['rows']
+    while pending and rows <= merge_rows:
+        job = pending[0]
+        if job['operation'] != batch[0]['operation']:
+            break
+        if rows + job['rows'] > merge_rows:
+            break
+        batch.append(pending.popleft())
+        rows = rows + job['rows']
+    return batch
+
+
+def queue_merge_jobs(batch, merged_path):
+    """Write rows of all jobs in batch to merged_path.
+
+    Return a dictionary mapping the key of each row to the job's ID.
+    """
+    job_keys = {}
+    with open(merged_path, 'w', newline='', encoding='utf-8') as merged_f:
+        merged_writer = csv.writer(merged_f)
+        headers_written = {}
+        for job in batch:
+            with open(
+                    job['csv_path'],
+                    'r',
+                    newline='',
+                    encoding='utf-8-sig',
+            ) as csv_in:
+                for (obj_type, header, row) in import_csv.csv_data_rows(
+                        csv_in,
+                ):
+                    import_csv.csv_writerow(
+                        merged_writer,
+                        headers_written,
+                        obj_type,
+                        header,
+                        row,
+                    )
+                    key = import_csv.csv_row_key(obj_type, header, row)
+                    job_keys[key] = job['id']
+    return job_keys
+
+
+def queue_profile_stats(service, profile, state):
+    """Return statistics for the jobs queued for a grid profile."""
+    now = time.time()
+    jobs = [job for job in service['jobs'].values()
+            if job['profile'] == profile]
+    finished = [job for job in jobs if job['status'] in ('done', 'failed')]
+    waits = [job['started'] - job['submitted']
+             for job in jobs if job['started'] is not None]
+    stats = {
+        'queued': len(state['pending']),
+        'running': state['running'],
+        'finished': len(finished),
+        'failed': len([job for job in finished if job['status'] == 'failed']),
+        'oldest_wait': (now - state['pending'][0]['submitted']
+                        if state['pending'] else 0.0),
+        'average_wait': sum(waits) / len(waits) if waits else 0.0,
+        'rows_imported': sum(job['lines_processed'] for job in finished),
+        'rows_per_second': 0.0,
+    }
+    if state['first_started'] is not None:
+        elapsed = now - state['first_started']
+        if elapsed > 0:
+            stats['rows_per_second'] = stats['rows_imported'] / elapsed
+    return stats
+
+
+async def queue_get_grid(service, state):
+    """Return grid object for a profile, logging in the first time."""
+    async with state['grid_lock']:
+        if state['grid'] is None:
+            state['grid'] = await async_import.ib_async_init(
+                service['ib_config'],
+                state['profile'],
+                service['auth_cache'],
+            )
+    return state['grid']
+
+
+def queue_fail_batch(batch, error):
+    """Mark all jobs in batch as failed with error."""
+    for job in batch:
+        job['status'] = 'failed'
+        job['error'] = error
+
+
+async def queue_run_batch(service, state, batch):
+    """Import the CSV files for a batch of jobs."""
+    now = time.time()
+    for job in batch:
+        job['status'] = 'running'
+        job['started'] = now
+        job['batch'] = [other['id'] for other in batch]
+    if state['first_started'] is None:
+        state['first_started'] = now
+    state['running'] = state['running'] + 1
+    tmp_dir = None
+    try:
+        grid = await queue_get_grid(service, state)
+
+        # Merge several jobs' files into one if needed.
+        if len(batch) > 1:
+            tmp_dir = tempfile.mkdtemp()
+            csv_path = os.path.join(tmp_dir, 'merged.csv')
+            job_keys = await async_import.ib_async_call(
+                grid,
+                queue_merge_jobs,
+                batch,
+                csv_path,
+            )
+        else:
+            csv_path = batch[0]['csv_path']
+        results = await async_import.ib_async_csv_import(
+            grid,
+            csv_path,
+            service['timeout'],
+            batch[0]['operation'],
+        )
+
+        # Attribute failed rows in a merged file to their jobs.
+        failed = collections.Counter()
+        if len(batch) > 1:
+            for key in import_csv.csv_error_keys(results['error_log']):
+                failed[job_keys.get(key)] += 1
+        else:
+            failed[batch[0]['id']] = results['lines_failed']
+
+        # Report data rows for every job, rather than the grid's count
+        # of lines (which includes header lines) for unmerged jobs.
+        if len(batch) == 1 and batch[0]['rows'] > service['merge_rows']:
+            batch[0]['rows'] = await async_import.ib_async_call(
+                grid,
+                queue_count_rows,
+                csv_path,
+                sys.maxsize,
+            )
+
+        # NOTE: The grid processes the rows of a merged file in the
+        # order of its jobs, so credit the lines it processed to each
+        # job in turn.  (Header lines are counted too, so a finished
+        # import covers every job's rows.)
+        lines = results['lines_processed']
+        for job in batch:
+            job['status'] = 'done'
+            job['lines_processed'] = min(job['rows'], lines)
+            lines = lines - job['lines_processed']
+            job['lines_failed'] = failed[job['id']]
+            job['error_log'] = results['error_log']
+    except (async_import.IbError, OSError) as err:
+        queue_fail_batch(batch, str(err))
+    except Exception as err:  # pylint: disable=broad-except
+        # Fail the jobs rather than leave them running forever.
+        queue_fail_batch(batch, 'Unexpected error: {!r}'.format(err))
+    finally:
+        now = time.time()
+        for job in batch:
+            job['finished'] = now
+        state['running'] = state['running'] - 1
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+async def queue_worker(service, state):
+    """Run batches of jobs for a grid profile as they are queued."""
+    while True:
+        async with state['wakeup']:
+            await state['wakeup'].wait_for(lambda: state['pending'])
+            batch = queue_take_batch(state['pending'], service['merge_rows'])
+
+        # Keep running later jobs for the profile whatever happens.
+        try:
+            await queue_run_batch(service, state, batch)
+        except Exception as err:  # pylint: disable=broad-except
+            print(
+                'Error running jobs {}: {!r}'.format(
+                    ', '.join(str(job['id']) for job in batch),
+                    err,
+                ),
+                file=sys.stderr,
+            )
+
+
+async def queue_submit(service, request):
+    """Queue a new job, return its ID."""
+    profile = request.get('profile')
+    operation = request.get('operation', 'INSERT').upper()
+    csv_path = request['csv_path']
+    rows = await asyncio.get_running_loop().run_in_executor(
+        None,
+        queue_count_rows,
+        csv_path,
+        service['merge_rows'],
+    )
+    job = {
+        'id': service['next_id'],
+        'profile': profile,
+        'operation': operation,
+        'csv_path': csv_path,
+        'rows': rows,
+        'status': 'queued',
+        'submitted': time.time(),
+        'started': None,
+        'finished': None,
+        'batch': [],
+        'lines_processed': 0,
+        'lines_failed': 0,
+        'error_log': '',
+        'error': '',
+    }
+    service['next_id'] = service['next_id'] + 1
+    service['jobs'][job['id']] = job
+
+    # Start workers for the grid profile if this is its first job.
+    if profile not in service['profiles']:
+        state = {
+            'profile': profile,
+            'pending': collections.deque(),
+            'wakeup': asyncio.Condition(),
+            'grid': None,
+            'grid_lock': asyncio.Lock(),
+            'running': 0,
+            'first_started': None,
+            'workers': [],
+        }
+        for _ in range(service['max_concurrent']):
+            state['workers'].append(
+                asyncio.ensure_future(queue_worker(service, state))
+            )
+        service['profiles'][profile] = state
+    state = service['profiles'][profile]
+    async with state['wakeup']:
+        state['pending'].append(job)
+        state['wakeup'].notify()
+    return job['id']
+
+
+async def queue_stats(service):
+    """Return statistics for all grid profiles."""
+    return {
+        str(profile): queue_profile_stats(service, profile, state)
+        for (profile, state) in service['profiles'].items()
+    }
+
+
+# Define functions to manage the token clients must send.
+def queue_write_token(token_file):
+    """Write a new random token to token_file, return the token.
+
+    The file is readable and writable only by its owner.
+    """
+    token = secrets.token_hex(32)
+    path = os.path.expanduser(token_file)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as token_f:
+        # Tighten the permissions of a file that already existed.
+        os.fchmod(token_f.fileno(), 0o600)
+        token_f.write(token + '\n')
+    return token
+
+
+def queue_read_token(token_file):
+    """Return the token in token_file."""
+    path = os.path.expanduser(token_file)
+    with open(path, 'r', encoding='utf-8') as token_f:
+        return token_f.read().strip()
+
+
+# Define the HTTP interface to the service.
+class QueueRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Handle HTTP requests to submit jobs and get their status."""
+
+    # Set by queue_serve() to the service, its event loop and token.
+    service = None
+    loop = None
+    token = None
+
+    def send_json(self, status, result):
+        """Send result as a JSON response."""
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def run(self, coro):
+        """Run coroutine in the service's event loop, return result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def authorized(self):
+        """Return True if the request has the service's token.
+
+        Otherwise send an error response and return False.
+        """
+        token = self.headers.get(QUEUE_TOKEN_HEADER, '')
+        if hmac.compare_digest(token.encode('utf-8'),
+                               self.token.encode('utf-8')):
+            return True
+        self.send_json(403, {'text': 'Missing or invalid token'})
+        return False
+
+    def do_GET(self):  # pylint: disable=C0103
+        """Return job status or service statistics."""
+        if not self.authorized():
+            return
+        if self.path == '/stats':
+            self.send_json(200, self.run(queue_stats(self.service)))
+            return
+        if self.path.startswith('/jobs/'):
+            try:
+                job = self.service['jobs'][int(self.path[len('/jobs/'):])]
+            except (ValueError, KeyError):
+                self.send_json(404, {'text': 'No such job'})
+                return
+            self.send_json(200, dict(job))
+            return
+        self.send_json(404, {'text': 'Unknown request'})
+
+    def do_POST(self):  # pylint: disable=C0103
+        """Queue a new job."""
+        if not self.authorized():
+            return
+        if self.path != '/jobs':
+            self.send_json(404, {'text': 'Unknown request'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length))
+            job_id = self.run(queue_submit(self.service, request))
+        except (ValueError, KeyError, TypeError, AttributeError) as err:
+            self.send_json(400, {'text': 'Bad job request: {}'.format(err)})
+            return
+        except OSError as err:
+            self.send_json(400, {'text': str(err)})
+            return
+        self.send_json(202, {'id': job_id})
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        """Log requests only if running verbosely."""
+
+
+def queue_serve(cmd_args):
+    """Run the queue service until interrupted."""
+    import_modules()
+    service = queue_new_service(cmd_args)
+    loop = asyncio.new_event_loop()
+    QueueRequestHandler.service = service
+    QueueRequestHandler.loop = loop
+    try:
+        QueueRequestHandler.token = queue_write_token(cmd_args['token_file'])
+    except OSError as err:
+        import_csv.error_exit(
+            'Cannot write token file {}'.format(cmd_args['token_file']),
+            err,
+        )
+    url = urllib.parse.urlsplit(cmd_args['url'])
+    try:
+        server = http.server.ThreadingHTTPServer(
+            (url.hostname, url.port),
+            QueueRequestHandler,
+        )
+    except OSError as err:
+        import_csv.error_exit(
+            'Cannot listen on {}'.format(cmd_args['url']),
+            err,
+        )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print('Listening on {}'.format(cmd_args['url']))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    server.shutdown()
+
+
+# Define the client side of the service.
+def queue_client_request(cmd_args, method, path, body=None):
+    """Make a request to the queue service, return the JSON result."""
+    try:
+        token = queue_read_token(cmd_args['token_file'])
+    except OSError as err:
+        import_csv.error_exit(
+            'Cannot read token file {}'.format(cmd_args['token_file']),
+            err,
+        )
+    import_modules()
+    try:
+        rsp = requests.request(
+            method,
+            cmd_args['url'].rstrip('/') + path,
+            json=body,
+            headers={QUEUE_TOKEN_HEADER: token},
+        )
+    except requests.exceptions.RequestException as err:
+        import_csv.error_exit(
+            'Error connecting to queue service at {}'.format(cmd_args['url']),
+            err,
+        )
+    if rsp.status_code >= 400:
+        import_csv.ib_error_exit('Queue service request failed', rsp)
+    return rsp.json()
+
+
+def queue_submit_job(cmd_args):
+    """Submit a job to the queue service, optionally waiting for it."""
+    request = {
+        'csv_path': os.path.abspath(cmd_args['csv_path']),
+        'profile': cmd_args['ib_profile'],
+        'operation': cmd_args['operation'],
+    }
+    job_id = queue_client_request(cmd_args, 'POST', '/jobs', request)['id']
+    print('Queued job {}'.format(job_id))
+    if not cmd_args['wait']:
+        return
+    while True:
+        job = queue_client_request(cmd_args, 'GET', '/jobs/{}'.format(job_id))
+        if job['status'] in ('done', 'failed'):
+            break
+        time.sleep(5)
+    if job['status'] == 'failed':
+        import_csv.error_exit('Job {} failed: {}'.format(job_id, job['error']))
+    print('Imported {} lines ({} failed), waited {:.0f} seconds'.format(
+        job['lines_processed'],
+        job['lines_failed'],
+        job['started'] - job['submitted'],
+    ))
+    if job['lines_failed'] > 0:
+        print('See {} for CSV import errors'.format(job['error_log']))
+
+
+def get_cmd_args():
+    """Get arguments from command line or user input and return them."""
+    parser = argparse.ArgumentParser(
+        description='Queue CSV import jobs and run them per grid',
+    )
+
+    # Add an option to print the version of the script.
+    parser.add_argument(
+        '-v',
+        '--version',
+        action='version',
+        version='%(prog)s 0.9',
+    )
+
+    # Add an option for the address of the service.
+    parser.add_argument(
+        '--url',
+        action='store',
+        dest='url',
+        default=QUEUE_DEFAULT_URL,
+        help='URL of queue service (default {})'.format(QUEUE_DEFAULT_URL),
+    )
+
+    # Add an option for the file holding the service's token.
+    parser.add_argument(
+        '--token-file',
+        action='store',
+        dest='token_file',
+        default=QUEUE_DEFAULT_TOKEN_FILE,
+        help='file holding the token for requests to the service '
+             '(default {})'.format(QUEUE_DEFAULT_TOKEN_FILE),
+    )
+    subparsers = parser.add_subparsers(dest='mode')
+    subparsers.required = True
+
+    # Add options for running the service.
+    serve_parser = subparsers.add_parser('serve', help='run the service')
+    serve_parser.add_argument(
+        '--ib-config',
+        action='store',
+        dest='ib_config',
+        # No default, value of None means look for the file.
+        help='file with Infoblox credentials and WAPI info',
+    )
+    serve_parser.add_argument(
+        '--auth-cache',
+        action='store',
+        dest='auth_cache',
+        # No default, value of None means do not cache the auth cookie.
+        help='file in which to cache the WAPI authentication cookie',
+    )
+    serve_parser.add_argument(
+        '--max-concurrent',
+        action='store',
+        dest='max_concurrent',
+        type=int,
+        default=1,
+        help='maximum imports to run at once per grid (default 1)',
+    )
+    serve_parser.add_argument(
+        '--merge-rows',
+        action='store',
+        dest='merge_rows',
+        type=int,
+        default=1000,
+        help='merge queued jobs up to this many rows (default 1000)',
+    )
+    serve_parser.add_argument(
+        '--timeout',
+        action='store',
+        dest='timeout',
+        type=int,
+        default=1800,
+        help='maximum time to let each job run (default 1800 seconds)',
+    )
+
+    # Add options for submitting a job.
+    submit_parser = subparsers.add_parser('submit', help='submit a job')
+    submit_parser.add_argument(
+        '--ib-profile',
+        action='store',
+        dest='ib_profile',
+        # No default, value of None means use first section
+        # (other than the DEFAULT section, if present).
+        help='profile in Infoblox configuration file',
+    )
+    submit_parser.add_argument(
+        '--operation',
+        action='store',
+        dest='operation',
+        default='INSERT',
+        help='CSV import operation (default INSERT)',
+    )
+    submit_parser.add_argument(
+        '--wait',
+        action='store_true',
+        dest='wait',
+        help='wait for the job to finish',
+    )
+    submit_parser.add_argument(
+        action='store',
+        dest='csv_path',
+        help='Pathname of CSV import file',
+    )
+
+    subparsers.add_parser('stats', help='show queue statistics')
+
+    # Parse the command line and return argument values as a dictionary.
+    args = parser.parse_args()
+    return vars(args)
+
+
+def main():
+    """Main program."""
+    cmd_args = get_cmd_args()
+    if cmd_args['mode'] == 'serve':
+        if cmd_args['max_concurrent'] < 1:
+            sys.exit('--max-concurrent must be at least 1')
+        queue_serve(cmd_args)
+    elif cmd_args['mode'] == 'submit':
+        queue_submit_job(cmd_args)
+    else:
+        stats = queue_client_request(cmd_args, 'GET', '/stats')
+        print(json.dumps(stats, indent=2))
+
+
+# Execute the following when this is run as a script.
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""Record timings and label output for scripts doing work in parallel.
+
+This module is shared by the NIOS CSV scripts (import_csv.py and the
+scripts built on it) and the BloxOne on-prem host management scripts
+(oph_manage.py and oph_rename.py), so that they record traces and label
+output in the same way.
+
+A trace records how long each phase of a script's work took and each
+HTTP request it made, in the Chrome trace event format.  The file can
+be viewed using the Perfetto UI (https://ui.perfetto.dev/) or
+chrome://tracing.  Events are shown on a separate track for each
+thread, or for each label set in LABEL_THREAD (see below).
+
+When a script does the same work for several grids or tenants at once,
+each thread sets LABEL_THREAD.label (e.g., "[east] ") and optionally
+LABEL_THREAD.tid, and replaces sys.stdout and sys.stderr with
+LabeledOutput objects, so that each line of output is prefixed with the
+label of the thread that wrote it.
+"""
+
+# Import the required Python modules.
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+
+
+# Phase and HTTP request timings recorded for --profile, as Chrome
+# trace events, and names of the threads (tracks) that recorded them.
+TRACE = {'events': None, 'threads': {}}
+
+# Per-thread label for output of work for one of several grids or
+# tenants, and the ID of the trace track for the thread's events.
+LABEL_THREAD = threading.local()
+
+
+# Define functions for recording timings and profiling.
+def trace_add(name, cat, start, end, **args):
+    """Record an event named name from time start to end, if tracing."""
+    events = TRACE['events']
+    if events is None:
+        return
+    thread = threading.current_thread()
+    tid = getattr(LABEL_THREAD, 'tid', thread.ident)
+    if tid not in TRACE['threads']:
+        TRACE['threads'][tid] = getattr(
+            LABEL_THREAD,
+            'label',
+            thread.name,
+        ).strip()
+    events.append({
+        'name': name,
+        'cat': cat,
+        'ph': 'X',
+        'ts': int(start * 1000000),
+        'dur': int((end - start) * 1000000),
+        'pid': os.getpid(),
+        'tid': tid,
+        'args': args,
+    })
+
+
+@contextlib.contextmanager
+def trace_span(name, cat='phase', **args):
+    """Record the time taken by the code in a with statement."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        trace_add(name, cat, start, time.time(), **args)
+
+
+def trace_response(rsp, *args, **kwargs):  # pylint: disable=W0613
+    """Record timing of an HTTP request (as a requests response hook)."""
+    if TRACE['events'] is None:
+        return
+    end = time.time()
+    trace_add(
+        '{} {}'.format(
+            rsp.request.method,
+            urllib.parse.urlsplit(rsp.url).path,
+        ),
+        'http',
+        end - rsp.elapsed.total_seconds(),
+        end,
+        status=rsp.status_code,
+    )
+
+
+def trace_handle(b1_handle):
+    """Record the time taken by each API call made using b1_handle."""
+    if TRACE['events'] is None:
+        return
+
+    def traced(method_name, method):
+        def call(objpath, *args, **kwargs):
+            start = time.time()
+            resp = method(objpath, *args, **kwargs)
+            trace_add(
+                '{} {}'.format(method_name, objpath),
+                'http',
+                start,
+                time.time(),
+                status=getattr(resp, 'status_code', None),
+            )
+            return resp
+        return call
+
+    for method_name in ['get', 'create', 'update', 'delete']:
+        method = getattr(b1_handle, method_name, None)
+        if method is not None:
+            setattr(b1_handle, method_name, traced(method_name, method))
+
+
+def trace_start(trace_path, stats_path):
+    """Start recording a trace and/or profile as requested.
+
+    Return the cProfile profiler, if any.
+    """
+    if trace_path:
+        TRACE['events'] = []
+    if not stats_path:
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def trace_finish(trace_path, stats_path, profiler):
+    """Write out the trace and profile statistics, if any."""
+    if profiler is not None:
+        profiler.disable()
+        try:
+            profiler.dump_stats(stats_path)
+        except OSError as err:
+            print(err, file=sys.stderr)
+            print('Cannot write profile statistics to {}'.format(stats_path),
+                  file=sys.stderr)
+    if TRACE['events'] is None:
+        return
+    events = list(TRACE['events'])
+    for (tid, name) in TRACE['threads'].items():
+        events.append({
+            'name': 'thread_name',
+            'ph': 'M',
+            'pid': os.getpid(),
+            'tid': tid,
+            'args': {'name': name},
+        })
+    try:
+        with open(trace_path, 'w') as trace_f:
+            json.dump(
+                {'traceEvents': events, 'displayTimeUnit': 'ms'},
+                trace_f,
+            )
+    except OSError as err:
+        print(err, file=sys.stderr)
+        print('Cannot write trace to {}'.format(trace_path), file=sys.stderr)
+
+
+# Define a class for labeling output of work done in parallel.
+class LabeledOutput:
+    """File-like object labeling each line written by a thread.
+
+    The label is set per thread in LABEL_THREAD.label, so that output
+    from work done in parallel can be told apart.
+    """
+
+    def __init__(self, out_f):
+        self.out_f = out_f
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        """Write complete lines of text with the thread's label."""
+        partial = getattr(LABEL_THREAD, 'partial', {})
+        lines = (partial.pop(id(self), '') + text).split('\n')
+        partial[id(self)] = lines.pop()
+        LABEL_THREAD.partial = partial
+        label = getattr(LABEL_THREAD, 'label', '')
+        with self.lock:
+            for line in lines:
+                self.out_f.write(label + line + '\n')
+        return len(text)
+
+    def flush(self):
+        """Flush the underlying file."""
+        self.out_f.flush()